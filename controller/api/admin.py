@@ -13,8 +13,12 @@ from .models import App
 from .models import Build
 from .models import Config
 from .models import Container
+from .models import ContainerStatus
 from .models import Domain
+from .models import EtcdChange
 from .models import Key
+from .models import Lease
+from .models import Operation
 from .models import Release
 
 
@@ -58,6 +62,15 @@ class ContainerAdmin(admin.ModelAdmin):
 admin.site.register(Container, ContainerAdmin)
 
 
+class ContainerStatusAdmin(admin.ModelAdmin):
+    """Set presentation options for :class:`~api.models.ContainerStatus` models
+    in the Django admin.
+    """
+    list_display = ('job_id', 'app', 'state', 'drift', 'seen', 'checked')
+    list_filter = ('drift', 'state')
+admin.site.register(ContainerStatus, ContainerStatusAdmin)
+
+
 class DomainAdmin(admin.ModelAdmin):
     """Set presentation options for :class:`~api.models.Domain` models
     in the Django admin.
@@ -68,6 +81,16 @@ class DomainAdmin(admin.ModelAdmin):
 admin.site.register(Domain, DomainAdmin)
 
 
+class EtcdChangeAdmin(admin.ModelAdmin):
+    """Set presentation options for :class:`~api.models.EtcdChange` models
+    in the Django admin.
+    """
+    date_hierarchy = 'created'
+    list_display = ('created', 'action', 'path', 'attempts', 'next_attempt')
+    list_filter = ('action',)
+admin.site.register(EtcdChange, EtcdChangeAdmin)
+
+
 class KeyAdmin(admin.ModelAdmin):
     """Set presentation options for :class:`~api.models.Key` models
     in the Django admin.
@@ -78,6 +101,24 @@ class KeyAdmin(admin.ModelAdmin):
 admin.site.register(Key, KeyAdmin)
 
 
+class LeaseAdmin(admin.ModelAdmin):
+    """Set presentation options for :class:`~api.models.Lease` models
+    in the Django admin.
+    """
+    list_display = ('name', 'holder', 'expires')
+admin.site.register(Lease, LeaseAdmin)
+
+
+class OperationAdmin(admin.ModelAdmin):
+    """Set presentation options for :class:`~api.models.Operation` models
+    in the Django admin.
+    """
+    date_hierarchy = 'created'
+    list_display = ('created', 'type', 'phase', 'owner', 'app')
+    list_filter = ('type', 'phase', 'owner', 'app')
+admin.site.register(Operation, OperationAdmin)
+
+
 class ReleaseAdmin(admin.ModelAdmin):
     """Set presentation options for :class:`~api.models.Release` models
     in the Django admin.
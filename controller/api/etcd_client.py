@@ -0,0 +1,101 @@
+"""
+A shared etcd client which connects lazily and fails over between etcd endpoints.
+"""
+
+from __future__ import unicode_literals
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+from django.conf import settings
+import etcd
+import urllib3
+
+
+logger = logging.getLogger(__name__)
+
+
+class EtcdUnavailable(etcd.EtcdException):
+    """None of the configured etcd endpoints could be reached."""
+    pass
+
+
+class _EndpointClient(etcd.Client):
+    """A client for a single endpoint, which gives up on it rather than looking for others."""
+
+    def _next_server(self):
+        # called while handling the error which made the request fail
+        raise EtcdUnavailable('{}: {}'.format(self._base_uri, sys.exc_info()[1]))
+
+
+class EtcdClient(object):
+    """
+    Sends requests to the first of ETCD_ENDPOINTS which answers.
+
+    Nothing is connected until the first request. A request which cannot reach an endpoint is
+    retried on the next one, for up to DEIS_ETCD_TIMEOUT seconds, and the endpoint which answered
+    is tried first from then on. Once every endpoint has failed, requests fail straight away with
+    :class:`EtcdUnavailable` for DEIS_ETCD_RETRY_INTERVAL seconds before etcd is tried again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._clients = {}
+        self._current = 0
+        self._down_until = 0
+
+    def _client(self, endpoint):
+        with self._lock:
+            # pooled connections do not survive a fork, so every process makes its own clients
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._clients = {}
+            if endpoint not in self._clients:
+                client = _EndpointClient(host=endpoint[0], port=endpoint[1],
+                                         read_timeout=settings.DEIS_ETCD_TIMEOUT)
+                # keep a connection around for each of the requests we may send at once
+                client.http.connection_pool_kw['maxsize'] = settings.DEIS_ETCD_CONCURRENCY
+                self._clients[endpoint] = client
+            return self._clients[endpoint]
+
+    def _call(self, method, *args, **kwargs):
+        endpoints = settings.ETCD_ENDPOINTS
+        start = self._current % len(endpoints)
+        if kwargs.get('wait'):
+            # a watch which times out has not failed, so leave it to the caller
+            return getattr(self._client(endpoints[start]), method)(*args, **kwargs)
+        if time.time() < self._down_until:
+            raise EtcdUnavailable('etcd is unavailable, not retrying yet')
+        deadline = time.time() + settings.DEIS_ETCD_TIMEOUT
+        errors = []
+        for i in xrange(len(endpoints)):
+            if errors and time.time() >= deadline:
+                break
+            endpoint = endpoints[(start + i) % len(endpoints)]
+            try:
+                result = getattr(self._client(endpoint), method)(*args, **kwargs)
+            except (EtcdUnavailable, urllib3.exceptions.HTTPError, socket.error) as e:
+                errors.append(str(e))
+                continue
+            self._current = start + i
+            return result
+        self._down_until = time.time() + settings.DEIS_ETCD_RETRY_INTERVAL
+        msg = 'could not reach etcd: {}'.format('; '.join(errors))
+        logger.warning(msg)
+        raise EtcdUnavailable(msg)
+
+    def get(self, *args, **kwargs):
+        return self._call('get', *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self._call('read', *args, **kwargs)
+
+    def write(self, *args, **kwargs):
+        return self._call('write', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call('delete', *args, **kwargs)
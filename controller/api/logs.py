@@ -0,0 +1,755 @@
+"""
+Storage for application logs, and buffered, non-blocking destinations for the controller's own
+log output.
+
+Application logs are appended to ``<app>.log`` in DEIS_LOG_DIR, both by the logger component and,
+for application events, through a per-process :class:`LogSink` which batches writes and keeps
+recently used files open. Once that live file grows past DEIS_LOG_SEGMENT_SIZE bytes it is set
+aside and sealed, in the background, into a gzipped segment alongside an index of the timestamps
+found in it, so that :func:`read` can seek straight to a range of time. Only the newest
+DEIS_LOG_SEGMENTS segments are kept.
+
+Lines are written by several processes, each of which buffers its own, so they are only roughly
+in order of time: a line may come after lines stamped up to DEIS_LOG_MAX_DISORDER seconds later.
+
+Records sent to the ``api`` logger go through a :class:`QueueHandler`, so a slow syslog socket
+never holds up a request. Both are flushed when the process exits.
+"""
+
+from __future__ import unicode_literals
+import atexit
+import bisect
+from collections import deque, OrderedDict
+from concurrent import futures
+from datetime import timedelta
+import glob
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import Queue
+import re
+import sre_constants
+import sre_parse
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_by_path
+
+from api import utils
+
+
+# every log line starts with a timestamp in DEIS_DATETIME_FORMAT, which sorts as text once the
+# time zone is cut off
+TIMESTAMP_RE = re.compile(br'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d')
+
+
+def _timestamp(line):
+    match = TIMESTAMP_RE.match(line)
+    return match.group(0).decode('ascii') if match else None
+
+
+def _key(value):
+    """Return the text a log line stamped at the given datetime starts with."""
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+# segments are named after the log and the time they were set aside at, and end in .gz once
+# they have been sealed
+SEGMENT_RE = re.compile(r'^\.\d+\.\d+(\.gz)?$')
+
+
+def segments(path):
+    """
+    Return the segments of the log at path, oldest first.
+
+    A log set aside but not sealed yet is returned as it is, uncompressed, until its sealed
+    segment is complete.
+    """
+    found = {}
+    for p in glob.glob(path + '.*'):
+        match = SEGMENT_RE.match(p[len(path):])
+        if match:
+            raw = p[:-len('.gz')] if match.group(1) else p
+            if match.group(1) or raw not in found:
+                found[raw] = p
+    return [found[key] for key in sorted(found)]
+
+
+def _sealed(segment):
+    return segment.endswith('.gz')
+
+
+def _index_path(segment):
+    return (segment[:-len('.gz')] if _sealed(segment) else segment) + '.idx'
+
+
+def _set_aside(path):
+    """Move the log at path out of the way of writers, and return where it went to."""
+    raw = '{}.{:017.6f}'.format(path, time.time())
+    try:
+        os.rename(path, raw)
+    except OSError:
+        return None
+    open(path, 'ab').close()
+    return raw
+
+
+def seal(path):
+    """
+    Compress the log at path into a new segment, leaving an empty log in its place.
+
+    The segment is written as a series of gzip members of about DEIS_LOG_INDEX_INTERVAL bytes
+    each, and its index records the timestamp of the first line of every member along with the
+    offsets it starts at in the segment and in the original log. Returns the path of the new
+    segment, or None if there was nothing to seal.
+    """
+    raw = _set_aside(path)
+    return _seal(path, raw) if raw else None
+
+
+def _seal(path, raw):
+    """Compress the log set aside from path at raw into a segment, and return it."""
+    segment = raw + '.gz'
+    index = {'start': None, 'end': None, 'size': 0, 'members': []}
+    with open(raw, 'rb') as src, open(segment + '.tmp', 'wb') as dst:
+        key, chunk, size = '', [], 0
+        for line in itertools.chain(src, [None]):
+            if line is None or size >= settings.DEIS_LOG_INDEX_INTERVAL:
+                if chunk:
+                    index['members'].append([chunk[0][0], dst.tell(), index['size']])
+                    index['size'] += size
+                    with gzip.GzipFile(filename='', mode='wb', fileobj=dst) as member:
+                        member.writelines(l for _, l in chunk)
+                chunk, size = [], 0
+            if line is None:
+                break
+            key = _timestamp(line) or key
+            chunk.append((key, line))
+            size += len(line)
+        index['end'] = key
+    if not index['members'] or not os.path.exists(raw):
+        # there was nothing to seal, or the log was removed while we were at it
+        os.remove(segment + '.tmp')
+        if os.path.exists(raw):
+            os.remove(raw)
+        return None
+    index['start'] = index['members'][0][0]
+    with open(_index_path(segment), 'w') as f:
+        json.dump(index, f)
+    os.rename(segment + '.tmp', segment)
+    os.remove(raw)
+    for old in segments(path)[:-settings.DEIS_LOG_SEGMENTS]:
+        remove_segment(old)
+    return segment
+
+
+_sealer = {}
+_sealer_lock = threading.Lock()
+
+
+def sealer():
+    """Return the executor this process seals set aside logs on, one at a time."""
+    with _sealer_lock:
+        # worker threads do not survive a fork, so every process gets its own executor
+        if _sealer.get('pid') != os.getpid():
+            _sealer['pid'] = os.getpid()
+            _sealer['executor'] = futures.ThreadPoolExecutor(max_workers=1)
+        return _sealer['executor']
+
+
+def _seal_in_background(path, raw):
+    try:
+        return _seal(path, raw)
+    except (IOError, OSError) as e:
+        logging.getLogger(__name__).error('could not seal {}: {}'.format(raw, e))
+
+
+def rotate(path):
+    """
+    Set the log at path aside if it has outgrown DEIS_LOG_SEGMENT_SIZE, and seal it in the
+    background. Returns a future of the new segment, or None if the log was left alone.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    if size >= settings.DEIS_LOG_SEGMENT_SIZE:
+        raw = _set_aside(path)
+        if raw:
+            return sealer().submit(_seal_in_background, path, raw)
+
+
+def wait_sealed():
+    """Wait until every log this process has set aside so far has been sealed."""
+    sealer().submit(lambda: None).result()
+
+
+def remove_segment(segment):
+    for p in (segment, _index_path(segment)):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def remove(path):
+    """Delete the log at path along with all of its segments."""
+    for segment in segments(path):
+        remove_segment(segment)
+    for segment in glob.glob(path + '.*.gz.tmp'):
+        # a segment being sealed right now is dropped once it is done
+        os.remove(segment)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _read_segment(segment, offset=0):
+    with open(segment, 'rb') as f:
+        f.seek(offset)
+        if not _sealed(segment):
+            for line in f:
+                yield line
+            return
+        # gzip reads on through every member that follows the one at offset
+        for line in gzip.GzipFile(filename='', mode='rb', fileobj=f):
+            yield line
+
+
+def _between(lines, since, until, stop, key=''):
+    """Yield the lines stamped from since up to until, stopping at the first one past stop."""
+    for line in lines:
+        key = _timestamp(line) or key
+        if stop and key >= stop:
+            return
+        if (not since or key >= since) and (not until or key < until):
+            yield line
+
+
+def _load_index(segment):
+    if not _sealed(segment):
+        # a log set aside but not sealed yet has no index, but it can be read as it is
+        try:
+            size = os.path.getsize(segment)
+        except OSError:
+            size = 0
+        return {'start': '', 'end': None, 'size': size, 'members': [['', 0, 0]]}
+    try:
+        with open(_index_path(segment)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        # without an index, the whole segment has to be read
+        return {'start': '', 'end': None, 'size': None, 'members': [['', 0, 0]]}
+
+
+def _read_sealed(segment, index, since, until, seek, stop):
+    members = index['members']
+    key, offset = '', 0
+    if seek:
+        # start from the last member which begins before seek
+        i = max(bisect.bisect_left([m[0] for m in members], seek) - 1, 0)
+        key, offset = members[i][:2]
+    try:
+        for line in _between(_read_segment(segment, offset), since, until, stop, key):
+            yield line
+    except IOError:
+        # the segment was pruned while we were reading it
+        return
+
+
+def _live_offset(f, since):
+    """
+    Return an offset in f at or before the first line stamped since or later, give or take
+    DEIS_LOG_MAX_DISORDER. Every line before it is stamped before since, less that much.
+    """
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while hi - lo > settings.DEIS_LOG_INDEX_INTERVAL:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        # skip ahead to the next stamped line
+        f.readline()
+        key = None
+        while key is None and f.tell() < hi:
+            key = _timestamp(f.readline())
+        if key is not None and key < since:
+            lo = mid
+        else:
+            hi = mid
+    if lo:
+        f.seek(lo)
+        f.readline()
+        return f.tell()
+    return 0
+
+
+def read(path, since=None, until=None):
+    """
+    Return an iterator over the lines of the log at path stamped from since up to, but not
+    including, until.
+
+    Either bound may be left out. Segments entirely outside the range are skipped, and within a
+    segment reading begins at the last indexed member stamped before since. As lines are only
+    roughly in order, reading starts, and carries on, DEIS_LOG_MAX_DISORDER seconds beyond the
+    range. Raises IOError if the log does not exist.
+    """
+    disorder = timedelta(seconds=settings.DEIS_LOG_MAX_DISORDER)
+    seek = _key(since - disorder) if since else None
+    stop = _key(until + disorder) if until else None
+    since, until = _key(since), _key(until)
+    sealed = segments(path)
+    if not sealed and not os.path.exists(path):
+        raise IOError('no such log: {}'.format(path))
+
+    def _read():
+        for segment in sealed:
+            index = _load_index(segment)
+            if stop and index['start'] >= stop:
+                return
+            if seek and index['end'] is not None and index['end'] < seek:
+                continue
+            for line in _read_sealed(segment, index, since, until, seek, stop):
+                yield line
+            if stop and index['end'] is not None and index['end'] >= stop:
+                return
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return
+        with f:
+            if seek:
+                f.seek(_live_offset(f, seek))
+            for line in _between(f, since, until, stop):
+                yield line
+
+    return _read()
+
+
+def _blocks_backwards(f, end, size):
+    """Yield the lines of f before end in lists of about size bytes, the newest first."""
+    rest = b''
+    while end > 0:
+        start = max(end - size, 0)
+        f.seek(start)
+        lines = (f.read(end - start) + rest).splitlines(True)
+        end = start
+        # the first line of a block may have begun in the block before it
+        rest = lines.pop(0) if end > 0 and lines else b''
+        yield lines
+
+
+def _segment_backwards(segment, index, stop):
+    """Yield the indexed members of segment before stop, newest first, with their first key."""
+    with open(segment, 'rb') as f:
+        if not _sealed(segment):
+            for lines in _blocks_backwards(f, os.fstat(f.fileno()).st_size,
+                                           settings.DEIS_LOG_INDEX_INTERVAL):
+                yield '', lines
+            return
+        end = os.fstat(f.fileno()).st_size
+        for key, offset, _ in reversed(index['members']):
+            if not stop or key < stop:
+                f.seek(offset)
+                member = gzip.GzipFile(filename='', mode='rb', fileobj=io.BytesIO(
+                    f.read(end - offset)))
+                yield key, member.read().splitlines(True)
+            end = offset
+
+
+def _blocks_newest_first(path, sealed, seek, stop):
+    """
+    Yield the live log at path and then its segments as lists of lines, newest first, each
+    with the key of the line before them if known, skipping segments after stop and stopping
+    at those before seek.
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        pass
+    else:
+        with f:
+            for lines in _blocks_backwards(f, os.fstat(f.fileno()).st_size,
+                                           settings.DEIS_LOG_INDEX_INTERVAL):
+                yield '', lines
+    for segment in reversed(sealed):
+        index = _load_index(segment)
+        if stop and index['start'] >= stop:
+            continue
+        if seek and index['end'] is not None and index['end'] < seek:
+            return
+        try:
+            for block in _segment_backwards(segment, index, stop):
+                yield block
+        except IOError:
+            # the segment was pruned while we were reading it
+            continue
+
+
+def backwards(path, since=None, until=None):
+    """
+    Return an iterator over the lines of the log at path stamped from since up to, but not
+    including, until, newest first.
+
+    The log is read from its end a block, or an indexed member of a segment, at a time, so the
+    caller can stop as soon as it has found what it is after. Segments after the range are
+    skipped, and reading stops at the first line stamped DEIS_LOG_MAX_DISORDER seconds before
+    since. Raises IOError if the log does not exist.
+    """
+    disorder = timedelta(seconds=settings.DEIS_LOG_MAX_DISORDER)
+    seek = _key(since - disorder) if since else None
+    stop = _key(until + disorder) if until else None
+    since, until = _key(since), _key(until)
+    sealed = segments(path)
+    if not sealed and not os.path.exists(path):
+        raise IOError('no such log: {}'.format(path))
+
+    def _read():
+        for key, lines in _blocks_newest_first(path, sealed, seek, stop):
+            # lines without a timestamp of their own belong with the line before them
+            keys = []
+            for line in lines:
+                key = _timestamp(line) or key
+                keys.append(key)
+            for key, line in reversed(zip(keys, lines)):
+                if seek and key and key < seek:
+                    return
+                if (not since or key >= since) and (not until or key < until):
+                    yield line
+
+    return _read()
+
+
+# log lines are written as "<timestamp> <tag>[<process>]: <message>", where the tag is deis for
+# the controller's own events and the app's name for its containers' output
+LINE_RE = re.compile(br'^\S+ ([-_a-z0-9]+)\[([^\]]*)\]:')
+
+
+# patterns are only searched for within this many bytes at the start of each line, and may
+# repeat at most this many parts of themselves a varying number of times
+PATTERN_WINDOW = 2048
+PATTERN_REPEATS = 1
+
+
+def compile_pattern(pattern):
+    """
+    Compile a regular expression to filter log lines with, or raise ValueError if it is invalid
+    or could take too long to search for.
+
+    Searching with backreferences, lookarounds, conditionals, repeats of anything which repeats
+    or branches itself, or more than PATTERN_REPEATS repeats of several lengths, such as ``+`` or
+    ``{1,3}``, may backtrack for much longer than it takes to read a line, so such patterns are
+    refused. One such repeat backtracks at worst quadratically within the PATTERN_WINDOW bytes
+    searched, but each one added multiplies that by the length of the window again.
+    """
+    try:
+        repeats = _repeats(sre_parse.parse(pattern))
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise ValueError('invalid regex: {}'.format(e))
+    if repeats > PATTERN_REPEATS:
+        raise ValueError('regex may repeat at most {} part of itself'.format(PATTERN_REPEATS))
+    return compiled
+
+
+def _repeats(parsed, repeated=False):
+    """Count the repeats of several lengths in a parsed pattern, raising re.error for anything
+    unsupported."""
+    count = 0
+    for op, av in parsed:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS,
+                  sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            raise re.error('backreferences, lookarounds and conditionals are not supported')
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if repeated:
+                raise re.error('nested repeats are not supported')
+            count += _repeats(av[2], repeated=True) + (1 if av[1] > max(av[0], 1) else 0)
+        elif op == sre_constants.BRANCH:
+            if repeated:
+                raise re.error('repeated alternatives are not supported')
+            count += sum(_repeats(branch) for branch in av[1])
+        elif op == sre_constants.SUBPATTERN:
+            count += _repeats(av[1], repeated)
+    return count
+
+
+def grep(lines, tag=None, process=None, pattern=None, limit=None, timeout=None):
+    """
+    Yield only the lines whose tag and process match, and which pattern finds a match in.
+
+    A process with no number, such as ``web``, matches every process of that type. Pattern is
+    searched for in the first PATTERN_WINDOW bytes of each line. Scanning stops once more than
+    limit bytes have been read, or after timeout seconds.
+    """
+    tag, process, scanned = utils.encode(tag), utils.encode(process), 0
+    deadline = time.time() + timeout if timeout is not None else None
+    for line in lines:
+        scanned += len(line)
+        if limit is not None and scanned > limit:
+            return
+        if deadline is not None and time.time() > deadline:
+            return
+        if tag or process:
+            match = LINE_RE.match(line)
+            if not match:
+                continue
+            if tag and match.group(1) != tag:
+                continue
+            if process and match.group(2) != process and \
+                    not match.group(2).startswith(process + b'.'):
+                continue
+        if pattern and not pattern.search(line, 0, PATTERN_WINDOW):
+            continue
+        yield line
+
+
+def tail(path, lines, follow=False, timeout=None):
+    """
+    Return an iterator over the last lines of the log at path, like :func:`api.utils.tail`.
+
+    When the live file holds fewer than the lines asked for, the rest are taken from the newest
+    segments.
+    """
+    live = utils.tail(path, lines, follow=follow, timeout=timeout)
+    with open(path, 'rb') as f:
+        if utils._tail_offset(f, lines, 4096) > 0:
+            return live
+        # the live file is no bigger than a segment, so counting its lines is cheap
+        f.seek(0)
+        data = f.read()
+    missing = lines - data.count(b'\n') - (1 if data and not data.endswith(b'\n') else 0)
+    found = deque()
+    for segment in reversed(segments(path)):
+        if len(found) >= missing:
+            break
+        try:
+            older = deque(_read_segment(segment), maxlen=missing - len(found))
+        except IOError:
+            continue
+        found.extendleft(reversed(older))
+    return itertools.chain(found, live)
+
+
+class Follower(object):
+    """
+    An iterator following the log at path, like :func:`tail` with follow.
+
+    A follower holds one of the DEIS_LOG_FOLLOWERS slots of this process until it is closed, and
+    raises a RuntimeError when there is none left.
+    """
+
+    _lock = threading.Lock()
+    count = 0
+
+    def __init__(self, path, lines, timeout=None):
+        with Follower._lock:
+            if Follower.count >= settings.DEIS_LOG_FOLLOWERS:
+                raise RuntimeError('Too many clients are following logs, try again later')
+            Follower.count += 1
+        self._closed = False
+        try:
+            self._lines = tail(path, lines, follow=True, timeout=timeout)
+        except:
+            self.close()
+            raise
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._lines)
+
+    def close(self):
+        """Give up the follower's slot. Responses close their content once they are done."""
+        with Follower._lock:
+            if not self._closed:
+                self._closed = True
+                Follower.count -= 1
+
+
+class LogSink(object):
+    """
+    Appends lines to log files, buffering them and caching open file handles.
+
+    Buffered lines are written out once DEIS_LOG_BUFFER_SIZE bytes have piled up for a file, at
+    least every DEIS_LOG_FLUSH_INTERVAL seconds, before the file is read through :meth:`flush`
+    and when the process exits. At most DEIS_LOG_OPEN_FILES files are kept open, closing the
+    least recently used first.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pid = None
+        self._files = OrderedDict()
+        self._buffers = {}
+        self._flusher = None
+        self._closed = threading.Event()
+
+    def _check_pid(self):
+        # handles and flusher threads do not survive a fork, and the parent flushes its own
+        # buffers, so a child process starts over
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._files = OrderedDict()
+            self._buffers = {}
+            self._flusher = None
+
+    def write(self, path, data):
+        """Queue data to be appended to the file at path."""
+        with self._lock:
+            self._check_pid()
+            buf = self._buffers.setdefault(path, [])
+            buf.append(data)
+            if sum(len(d) for d in buf) >= settings.DEIS_LOG_BUFFER_SIZE:
+                self._flush(path)
+            if self._flusher is None:
+                self._closed = threading.Event()
+                self._flusher = threading.Thread(target=self._flush_periodically,
+                                                 name='log-sink-flusher')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def flush(self, path=None):
+        """Write out everything buffered for the file at path, or for every file."""
+        with self._lock:
+            self._check_pid()
+            for p in ([path] if path else self._buffers.keys()):
+                self._flush(p)
+
+    def discard(self, path):
+        """Forget about the file at path, dropping anything still buffered for it."""
+        with self._lock:
+            self._check_pid()
+            self._buffers.pop(path, None)
+            f = self._files.pop(path, None)
+            if f is not None:
+                f.close()
+
+    def _flush(self, path):
+        buf = self._buffers.pop(path, None)
+        if not buf:
+            return
+        try:
+            f = self._open(path)
+            f.write(b''.join(buf))
+            f.flush()
+            if os.fstat(f.fileno()).st_size >= settings.DEIS_LOG_SEGMENT_SIZE:
+                self._files.pop(path).close()
+                rotate(path)
+        except (IOError, OSError) as e:
+            logging.getLogger(__name__).error('could not write to {}: {}'.format(path, e))
+
+    def _open(self, path):
+        f = self._files.pop(path, None)
+        if f is not None:
+            try:
+                stale = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+            except OSError:
+                stale = True
+            if stale:
+                # the file was removed or rotated since we opened it
+                f.close()
+                f = None
+        if f is None:
+            f = open(path, 'ab')
+        self._files[path] = f
+        while len(self._files) > settings.DEIS_LOG_OPEN_FILES:
+            self._files.popitem(last=False)[1].close()
+        return f
+
+    def close(self):
+        """Write out everything buffered, and stop flushing in the background."""
+        with self._lock:
+            self._check_pid()
+            flusher, self._flusher = self._flusher, None
+            self._closed.set()
+            self.flush()
+            for f in self._files.values():
+                f.close()
+            self._files = OrderedDict()
+        if flusher is not None:
+            flusher.join(1)
+
+    def _flush_periodically(self):
+        pid, closed = os.getpid(), self._closed
+        # waiting on an event, unlike time.sleep, is safe from being mocked
+        while not closed.wait(settings.DEIS_LOG_FLUSH_INTERVAL):
+            with self._lock:
+                if self._pid != pid:
+                    return
+                self.flush()
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands log records to another handler on a background thread.
+
+    The target handler is built from its dotted class path and any remaining keyword arguments,
+    so it can be declared in the LOGGING setting. Records are dropped, rather than blocking the
+    caller, if more than maxsize of them are waiting.
+    """
+
+    def __init__(self, target, maxsize=10000, **kwargs):
+        logging.Handler.__init__(self)
+        self.target = import_by_path(target)(**kwargs)
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._lost = 0
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        self.target.setFormatter(fmt)
+
+    def _start(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = Queue.Queue(self.maxsize)
+                t = threading.Thread(target=self._drain, args=(self._queue,),
+                                     name='log-queue-handler')
+                t.daemon = True
+                t.start()
+        return self._queue
+
+    def emit(self, record):
+        try:
+            self._start().put_nowait(record)
+        except Queue.Full:
+            self._lost += 1
+
+    def _drain(self, queue):
+        while True:
+            record = queue.get()
+            try:
+                if self._lost:
+                    lost, self._lost = self._lost, 0
+                    self.target.handle(logging.makeLogRecord({
+                        'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                        'msg': 'dropped {} log records'.format(lost)}))
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
+            finally:
+                queue.task_done()
+
+    def flush(self):
+        """Wait until every queued record has been handed to the target."""
+        if self._pid == os.getpid():
+            self._queue.join()
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+sink = LogSink()
+atexit.register(sink.close)
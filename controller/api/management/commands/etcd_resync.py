@@ -0,0 +1,159 @@
+"""
+Publish the controller's full state to etcd, such as after the etcd cluster has been rebuilt.
+"""
+
+from __future__ import unicode_literals
+from optparse import make_option
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import models
+from api.models import App, Certificate, Config, Domain, Key
+
+
+# configs are looked up this many at a time
+CONFIG_CHUNK_SIZE = 500
+
+
+def _users():
+    for username, fp, public in Key.objects.values_list(
+            'owner__username', 'fingerprint', 'public').iterator():
+        yield '/deis/builder/users/{}/{}'.format(username, fp), public
+
+
+def _certs():
+    for name, cert, key in Certificate.objects.values_list(
+            'common_name', 'certificate', 'key').iterator():
+        yield '/deis/certs/{}/cert'.format(name), cert
+        yield '/deis/certs/{}/key'.format(name), key
+
+
+def _domains():
+    for domain, app in Domain.objects.values_list('domain', 'app__id').iterator():
+        yield '/deis/domains/{}'.format(domain), app
+
+
+def _configs():
+    latest = {}
+    for uuid, app in Config.objects.order_by('app', '-created').values_list(
+            'uuid', 'app').iterator():
+        latest.setdefault(app, uuid)
+    latest = latest.values()
+    # only the latest config of each app is needed, so leave the older ones in the database
+    for i in xrange(0, len(latest), CONFIG_CHUNK_SIZE):
+        for config in Config.objects.filter(uuid__in=latest[i:i + CONFIG_CHUNK_SIZE]).only(
+                'values', 'app__id').select_related('app').iterator():
+            root = '/deis/config/{}'.format(config.app)
+            for item in models._etcd_config_values(root, config.values).iteritems():
+                yield item
+
+
+# the keys the controller publishes under each directory, with the depth at which a directory
+# stands for a single user, certificate or app
+KEYSPACE = (
+    ('/deis/builder/users', _users, 1),
+    ('/deis/certs', _certs, 1),
+    ('/deis/domains', _domains, 0),
+    ('/deis/config', _configs, 1),
+)
+
+
+def _unit(root, key, depth):
+    """Return the directory under root which key belongs to, or key itself at depth 0."""
+    if not depth:
+        return key
+    return '{}/{}'.format(root, key[len(root) + 1:].split('/')[0])
+
+
+def _published(root):
+    """Return the values and empty directories found under root in etcd."""
+    try:
+        leaves = list(models._etcd_client.read(root, recursive=True).leaves)
+    except KeyError:
+        return {}, set()
+    values = {n.key: n.value for n in leaves if not n.dir and n.key != root}
+    return values, set(n.key for n in leaves if n.dir and n.key != root)
+
+
+def _delete(key, **kwargs):
+    try:
+        models._etcd_client.delete(key, **kwargs)
+    except KeyError:
+        pass
+
+
+def _apply(tasks):
+    """Run the given etcd requests concurrently, raising the first error seen."""
+    executor = models.etcd_executor()
+    for f in [executor.submit(fn, *args, **kwargs) for fn, args, kwargs in tasks]:
+        f.result()
+
+
+def plan(root, desired, depth):
+    """
+    Return the requests which bring the keys under root in etcd in line with desired.
+
+    Keys with missing or outdated values are written. Directories of things which no longer
+    exist are removed whole, and other keys which are no longer wanted one by one.
+    """
+    values, dirs = _published(root)
+    tasks = [(models._etcd_client.write, (k, v.encode('utf-8')), {})
+             for k, v in desired.iteritems() if values.get(k) != v]
+    stale = [k for k in values if k not in desired]
+    wanted = set(_unit(root, k, depth) for k in desired)
+    removed = (set(_unit(root, k, depth) for k in stale if depth) | dirs) - wanted
+    tasks.extend((_delete, (d,), {'dir': True, 'recursive': True}) for d in removed)
+    tasks.extend((_delete, (k,), {}) for k in stale if _unit(root, k, depth) not in removed)
+    return tasks
+
+
+def plan_services():
+    """Return the requests which leave a services directory in etcd for every app."""
+    root = '/deis/services'
+    values, dirs = _published(root)
+    published = set(_unit(root, k, 1) for k in values) | set(_unit(root, k, 1) for k in dirs)
+    wanted = set('{}/{}'.format(root, app) for app in
+                 App.objects.values_list('id', flat=True).iterator())
+    # the containers within are published by the hosts running them, so leave them be
+    tasks = [(models._etcd_client.write, (d, None), {'dir': True}) for d in wanted - published]
+    tasks.extend((_delete, (d,), {'dir': True, 'recursive': True}) for d in published - wanted)
+    return tasks
+
+
+def plan_routing():
+    """Return the request which brings the routing snapshot up to date, if it is not."""
+    update = models._etcd_routing_update(settings.DEIS_ROUTING_SNAPSHOT_KEY)
+    return [(models._etcd_client.write,) + update] if update else []
+
+
+class Command(BaseCommand):
+    help = ('Publishes SSH keys, apps, certificates, domains, config and the routing snapshot to '
+            'etcd, writing and removing only what differs from what etcd already holds.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Report what would change without changing it.'),
+    )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        changes = self._sync('/deis/services', plan_services, options['dry_run'])
+        for root, keys, depth in KEYSPACE:
+            changes += self._sync(root, lambda: plan(root, dict(keys()), depth),
+                                  options['dry_run'])
+        changes += self._sync(settings.DEIS_ROUTING_SNAPSHOT_KEY, plan_routing,
+                              options['dry_run'])
+        self.stdout.write('{} {} changes to etcd in {:.2f}s'.format(
+            'Found' if options['dry_run'] else 'Made', changes, time.time() - start))
+
+    def _sync(self, root, make_plan, dry_run):
+        start = time.time()
+        tasks = make_plan()
+        if not dry_run:
+            _apply(tasks)
+        removals = len([t for t in tasks if t[0] is _delete])
+        self.stdout.write('{}: {} written, {} removed in {:.2f}s'.format(
+            root, len(tasks) - removals, removals, time.time() - start))
+        return len(tasks)
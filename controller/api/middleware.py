@@ -5,13 +5,19 @@ See https://docs.djangoproject.com/en/1.6/topics/http/middleware/
 """
 
 import json
+import logging
 
+from django.conf import settings
+from django.db import connection
 from django.http import HttpResponse
 from rest_framework import status
 
 from api import __version__
 
 
+logger = logging.getLogger(__name__)
+
+
 class APIVersionMiddleware(object):
     """
     Return an error if a client request is incompatible with this REST API
@@ -49,3 +55,53 @@ class APIVersionMiddleware(object):
         response['DEIS_API_VERSION'] = __version__.rsplit('.', 1)[0]
         response['X_DEIS_API_VERSION'] = response['DEIS_API_VERSION']  # DEPRECATED
         return response
+
+
+def endpoint_name(request):
+    """
+    Name the endpoint which served a request after its method and view, such as
+    "GET ContainerViewSet", or return None if the request matched no view.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = getattr(match.func, 'cls', match.func)
+    return '{} {}'.format(request.method, view.__name__)
+
+
+def query_budget(endpoint):
+    """Return the number of database queries a request to the given endpoint should stay within."""
+    return settings.DEIS_QUERY_BUDGETS.get(endpoint, settings.DEIS_QUERY_BUDGET)
+
+
+class QueryCountMiddleware(object):
+    """
+    Count the database queries each request makes, and log the requests which go over the
+    query budget of their endpoint.
+
+    Queries are only recorded through Django's debug cursor, which formats and keeps every one
+    of them, so they are only counted with DEBUG or DEIS_QUERY_COUNT on. Only the queries made
+    on the request's own thread are counted, not those made on behalf of it by an executor,
+    such as when containers are started or stopped in parallel. The count is left on the
+    response as ``query_count``.
+    """
+
+    def process_request(self, request):
+        if not (settings.DEBUG or settings.DEIS_QUERY_COUNT):
+            return
+        # queries are only recorded through the debug cursor
+        request._query_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        request._query_start = len(connection.queries)
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_query_start'):
+            return response
+        response.query_count = len(connection.queries) - request._query_start
+        connection.use_debug_cursor = request._query_debug_cursor
+        endpoint = endpoint_name(request)
+        if endpoint and response.query_count > query_budget(endpoint):
+            logger.warning('{} {} made {} database queries, over the budget of {} for {}'.format(
+                request.method, request.path, response.query_count, query_budget(endpoint),
+                endpoint))
+        return response
@@ -6,24 +6,28 @@ Data models for the Deis API.
 
 from __future__ import unicode_literals
 import base64
-from datetime import datetime
-import etcd
-import importlib
+from collections import deque
+from concurrent import futures
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import itertools
+import json
 import logging
 import os
 import re
-import subprocess
 import time
-from threading import Thread
+from threading import BoundedSemaphore, Event, Lock, local
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError, SuspiciousOperation
-from django.db import models
+from django.db import close_old_connections, models, transaction
 from django.db.models import Count
-from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from docker.utils import utils as dockerutils
 from json_field.fields import JSONField
@@ -31,13 +35,22 @@ from OpenSSL import crypto
 import requests
 from rest_framework.authtoken.models import Token
 
-from api import fields, utils, exceptions
+from api import etcd_client, fields, logs, utils, exceptions
+from api.etcd_client import EtcdUnavailable
 from registry import publish_release
+import scheduler
 from utils import dict_diff, fingerprint
 
 
 logger = logging.getLogger(__name__)
 
+# config values which tune how an app's containers are replaced on deploy, and the scheduler
+# options they are passed on as
+DEPLOY_OPTIONS = {'DEPLOY_MAX_SURGE': 'maxSurge', 'DEPLOY_MAX_UNAVAILABLE': 'maxUnavailable'}
+
+# the operation, if any, which the current thread is carrying out
+_operation_context = local()
+
 
 def close_db_connections(func, *args, **kwargs):
     """
@@ -58,10 +71,90 @@ def close_db_connections(func, *args, **kwargs):
     return _close_db_connections
 
 
+_container_executor = {}
+_container_executor_lock = Lock()
+
+
+def container_executor():
+    """
+    Return the executor shared by this process for container lifecycle operations.
+
+    The executor bounds how many scheduler calls the controller makes at once across all apps.
+    """
+    with _container_executor_lock:
+        # worker threads do not survive a fork, so every process gets its own executor
+        if _container_executor.get('pid') != os.getpid():
+            _container_executor['pid'] = os.getpid()
+            _container_executor['executor'] = futures.ThreadPoolExecutor(
+                max_workers=settings.DEIS_CONTAINER_CONCURRENCY)
+            _container_executor['slots'] = {}
+        return _container_executor['executor']
+
+
+@contextmanager
+def _app_container_slots(app):
+    """
+    Hold on to the semaphore bounding concurrent container operations for an app.
+
+    Fan-outs for an app share one semaphore for as long as any of them runs. It is sized from
+    DEIS_APP_CONTAINER_CONCURRENCY when the first of them starts, and dropped after the last one.
+    """
+    container_executor()
+    key = (app.id, settings.DEIS_APP_CONTAINER_CONCURRENCY)
+    with _container_executor_lock:
+        slots = _container_executor['slots']
+        if key not in slots:
+            slots[key] = {'semaphore': BoundedSemaphore(key[1]), 'users': 0}
+        entry = slots[key]
+        entry['users'] += 1
+    try:
+        yield entry['semaphore']
+    finally:
+        with _container_executor_lock:
+            entry['users'] -= 1
+            if not entry['users'] and slots.get(key) is entry:
+                del slots[key]
+
+
+_etcd_executor = {}
+_etcd_executor_lock = Lock()
+
+
+def etcd_executor():
+    """Return the executor shared by this process for sending requests to etcd concurrently."""
+    with _etcd_executor_lock:
+        # worker threads do not survive a fork, so every process gets its own executor
+        if _etcd_executor.get('pid') != os.getpid():
+            _etcd_executor['pid'] = os.getpid()
+            _etcd_executor['executor'] = futures.ThreadPoolExecutor(
+                max_workers=settings.DEIS_ETCD_CONCURRENCY)
+        return _etcd_executor['executor']
+
+
+_healthcheck_sessions = {}
+
+
+def healthcheck_session():
+    """Return the HTTP session this process shares between all healthcheck probes."""
+    pid = os.getpid()
+    if pid not in _healthcheck_sessions:
+        # pooled connections do not survive a fork, so every process gets its own session
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(
+            pool_maxsize=settings.DEIS_APP_CONTAINER_CONCURRENCY))
+        _healthcheck_sessions.clear()
+        _healthcheck_sessions[pid] = session
+    return _healthcheck_sessions[pid]
+
+
 def log_event(app, msg, level=logging.INFO):
     # controller needs to know which app this log comes from
     logger.log(level, "{}: {}".format(app.id, msg))
     app.log(msg)
+    # surface the event as the progress of any operation working on this app
+    operation = getattr(_operation_context, 'operation', None)
+    if operation is not None and operation.app_id == app.pk:
+        operation.report(msg)
 
 
 def validate_base64(value):
@@ -119,16 +212,9 @@ def validate_certificate(value):
 
 
 def get_etcd_client():
+    """Return the etcd client shared by this process, which connects on first use."""
     if not hasattr(get_etcd_client, "client"):
-        # wire up etcd publishing if we can connect
-        try:
-            get_etcd_client.client = etcd.Client(
-                host=settings.ETCD_HOST,
-                port=int(settings.ETCD_PORT))
-            get_etcd_client.client.get('/deis')
-        except etcd.EtcdException:
-            logger.log(logging.WARNING, 'Cannot synchronize with etcd cluster')
-            get_etcd_client.client = None
+        get_etcd_client.client = etcd_client.EtcdClient()
     return get_etcd_client.client
 
 
@@ -163,8 +249,40 @@ class UuidAuditedModel(AuditedModel):
         abstract = True
 
 
+# set once the current thread has recorded changes to etcd in a transaction not yet committed
+_etcd_pending = local()
+
+
+@contextmanager
+def etcd_changes():
+    """
+    Run a block in a transaction, so the changes to etcd recorded in it are committed along
+    with the model changes they stem from, and have them published once it has committed.
+    """
+    with transaction.atomic():
+        yield
+    pending = getattr(_etcd_pending, 'notify', False)
+    if pending and not transaction.get_connection().in_atomic_block:
+        _etcd_pending.notify = False
+        # imported here, as the outbox depends on our models
+        from api import outbox
+        outbox.notify()
+
+
+class EtcdSyncedMixin(object):
+    """Save and delete a model which is mirrored to etcd within :func:`etcd_changes`."""
+
+    def save(self, *args, **kwargs):
+        with etcd_changes():
+            return super(EtcdSyncedMixin, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with etcd_changes():
+            return super(EtcdSyncedMixin, self).delete(*args, **kwargs)
+
+
 @python_2_unicode_compatible
-class App(UuidAuditedModel):
+class App(EtcdSyncedMixin, UuidAuditedModel):
     """
     Application used to service requests on behalf of end-users
     """
@@ -174,17 +292,57 @@ class App(UuidAuditedModel):
                           validators=[validate_id_is_docker_compatible,
                                       validate_reserved_names])
     structure = JSONField(default={}, blank=True, validators=[validate_app_structure])
+    # the most recently created release, kept current as releases are created
+    latest_release = models.ForeignKey('Release', null=True, blank=True, editable=False,
+                                       related_name='+', on_delete=models.SET_NULL)
 
     class Meta:
         permissions = (('use_app', 'Can use app'),)
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # only releases move the latest release along, so that saving an app which was
+            # loaded before a release was created does not point it back at an older one
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'latest_release']
+        return super(App, self).save(*args, **kwargs)
+
+    def get_latest_release(self):
+        """
+        Return the latest release of this app.
+
+        The release is looked up once per instance, along with its config and build, so an
+        operation on an app resolves them once however many containers it touches. That is
+        only good for the length of one operation, so scale, deploy and run begin with
+        :meth:`refresh_latest_release`.
+        """
+        release = self.latest_release
+        if release is None:
+            # releases made before the latest release was recorded, or after it was deleted
+            release = self.release_set.latest()
+            App.objects.filter(pk=self.pk, latest_release__isnull=True).update(
+                latest_release=release)
+            self.latest_release = release
+        # let new releases made from this one share the app, and so update its latest release
+        release.app = self
+        return release
+
+    def refresh_latest_release(self):
+        """Forget the cached latest release if a newer one was made since it was looked up."""
+        latest = App.objects.filter(pk=self.pk).values_list('latest_release', flat=True)
+        latest = latest[0] if latest else None
+        if latest != self.latest_release_id:
+            cache = self._meta.get_field('latest_release').get_cache_name()
+            self.__dict__.pop(cache, None)
+            self.latest_release_id = latest
+
     @property
     def _scheduler(self):
-        mod = importlib.import_module(settings.SCHEDULER_MODULE)
-        return mod.SchedulerClient(settings.SCHEDULER_TARGET,
-                                   settings.SCHEDULER_AUTH,
-                                   settings.SCHEDULER_OPTIONS,
-                                   settings.SSH_PRIVATE_KEY)
+        return scheduler.get_client(settings.SCHEDULER_MODULE,
+                                    settings.SCHEDULER_TARGET,
+                                    settings.SCHEDULER_AUTH,
+                                    settings.SCHEDULER_OPTIONS,
+                                    settings.SSH_PRIVATE_KEY)
 
     def __str__(self):
         return self.id
@@ -193,9 +351,25 @@ class App(UuidAuditedModel):
     def url(self):
         return self.id + '.' + settings.DEIS_DOMAIN
 
+    def container_states(self, containers):
+        """
+        Return a dict mapping the job ID of each container to its state name.
+
+        States the reconciler recorded recently enough are served as they are. The rest are
+        resolved with a single call to the scheduler rather than one per container.
+        """
+        job_ids = [c.job_id for c in containers]
+        states = dict(ContainerStatus.objects.filter(
+            job_id__in=job_ids, checked__gte=_fresh_since()).values_list('job_id', 'state'))
+        stale = [job_id for job_id in job_ids if job_id not in states]
+        if stale:
+            states.update({job_id: state.name
+                           for job_id, state in self._scheduler.states(stale).items()})
+        return states
+
     def _get_job_id(self, container_type):
         app = self.id
-        release = self.release_set.latest()
+        release = self.get_latest_release()
         version = "v{}".format(release.version)
         job_id = "{app}_{version}.{container_type}".format(**locals())
         return job_id
@@ -205,7 +379,7 @@ class App(UuidAuditedModel):
             # if this is not procfile-based app, ensure they cannot break out
             # and run arbitrary commands on the host
             # FIXME: remove slugrunner's hardcoded entrypoint
-            release = self.release_set.latest()
+            release = self.get_latest_release()
             if release.build.dockerfile or not release.build.sha:
                 return "bash -c '{}'".format(release.build.procfile[container_type])
             else:
@@ -223,10 +397,10 @@ class App(UuidAuditedModel):
         Django's case because logging is set up before you run the server and it disables all
         existing logging configurations.
         """
-        with open(os.path.join(settings.DEIS_LOG_DIR, self.id + '.log'), 'a') as f:
-            msg = "{} deis[api]: {}\n".format(time.strftime(settings.DEIS_DATETIME_FORMAT),
-                                              message)
-            f.write(msg.encode('utf-8'))
+        msg = "{} deis[api]: {}\n".format(time.strftime(settings.DEIS_DATETIME_FORMAT),
+                                          message)
+        logs.sink.write(os.path.join(settings.DEIS_LOG_DIR, self.id + '.log'),
+                        msg.encode('utf-8'))
 
     def create(self, *args, **kwargs):
         """Create a new application with an initial config and release"""
@@ -237,14 +411,15 @@ class App(UuidAuditedModel):
         """Delete this application including all containers"""
         try:
             # attempt to remove containers from the scheduler
-            self._destroy_containers([c for c in self.container_set.exclude(type='run')])
+            self._destroy_containers(
+                list(self.container_set.exclude(type='run').select_related('release')))
         except RuntimeError:
             pass
         self._clean_app_logs()
         return super(App, self).delete(*args, **kwargs)
 
     def restart(self, **kwargs):
-        to_restart = self.container_set.all()
+        to_restart = self.container_set.select_related('release')
         if kwargs.get('type'):
             to_restart = to_restart.filter(type=kwargs.get('type'))
         if kwargs.get('num'):
@@ -255,15 +430,16 @@ class App(UuidAuditedModel):
     def _clean_app_logs(self):
         """Delete application logs stored by the logger component"""
         path = os.path.join(settings.DEIS_LOG_DIR, self.id + '.log')
-        if os.path.exists(path):
-            os.remove(path)
+        logs.sink.discard(path)
+        logs.remove(path)
 
     def scale(self, user, structure):  # noqa
         """Scale containers up or down to match requested structure."""
-        if self.release_set.latest().build is None:
+        self.refresh_latest_release()
+        release = self.get_latest_release()
+        if release.build is None:
             raise EnvironmentError('No build associated with this release')
         requested_structure = structure.copy()
-        release = self.release_set.latest()
         # test for available process types
         available_process_types = release.build.procfile or {}
         for container_type in requested_structure:
@@ -280,12 +456,17 @@ class App(UuidAuditedModel):
         to_add, to_remove = [], []
         scale_types = {}
 
+        # look up the containers of every requested type at once
+        existing = {}
+        for c in self.container_set.filter(
+                type__in=requested_structure.keys()).select_related('release').order_by(
+                'created'):
+            existing.setdefault(c.type, []).append(c)
         # iterate on a copy of the container_type keys
         for container_type in requested_structure.keys():
-            containers = list(self.container_set.filter(type=container_type).order_by('created'))
+            containers = existing.get(container_type, [])
             # increment new container nums off the most recent container
-            results = self.container_set.filter(type=container_type).aggregate(Max('num'))
-            container_num = (results.get('num__max') or 0) + 1
+            container_num = max([c.num for c in containers] or [0]) + 1
             requested = requested_structure.pop(container_type)
             diff = requested - len(containers)
             if diff == 0:
@@ -297,15 +478,15 @@ class App(UuidAuditedModel):
                 to_remove.append(c)
                 diff += 1
             while diff > 0:
-                # create a database record
-                c = Container.objects.create(owner=self.owner,
-                                             app=self,
-                                             release=release,
-                                             type=container_type,
-                                             num=container_num)
-                to_add.append(c)
+                to_add.append(Container(owner=self.owner,
+                                        app=self,
+                                        release=release,
+                                        type=container_type,
+                                        num=container_num))
                 container_num += 1
                 diff -= 1
+        # create the database records with a single insert
+        Container.objects.bulk_create(to_add)
 
         if changed:
             if "scale" in dir(self._scheduler):
@@ -325,7 +506,7 @@ class App(UuidAuditedModel):
         return changed
 
     def _scale_containers(self, scale_types, to_remove):
-        release = self.release_set.latest()
+        release = self.get_latest_release()
         for scale_type in scale_types:
             image = release.image
             version = "v{}".format(release.version)
@@ -347,47 +528,103 @@ class App(UuidAuditedModel):
                 err = '{} (scale): {}'.format(job_id, e)
                 log_event(self, err, logging.ERROR)
                 raise
-        [c.delete() for c in to_remove]
+        self._delete_containers(to_remove)
+
+    def _fan_out(self, tasks):
+        """
+        Run each of the given callables on the shared container executor and wait for them all.
+
+        No more than DEIS_APP_CONTAINER_CONCURRENCY of them are in flight for this app at once.
+        Failures are logged by the container methods themselves, so callers inspect container
+        states afterwards rather than the outcome of each call.
+        """
+        executor = container_executor()
+        with _app_container_slots(self) as slots:
+
+            def _run(task):
+                try:
+                    task()
+                finally:
+                    # executor threads are long-lived, so drop any connection past its lifetime
+                    close_old_connections()
+                    slots.release()
+
+            pending = []
+            for task in tasks:
+                slots.acquire()
+                try:
+                    pending.append(executor.submit(_run, task))
+                except:
+                    slots.release()
+                    raise
+            futures.wait(pending)
+
+    def _forget_states(self, containers):
+        """Have the states of the given containers looked up again, as they are about to change."""
+        ContainerStatus.objects.filter(
+            job_id__in=[c.job_id for c in containers]).update(checked=None,
+                                                              forgotten=timezone.now())
 
     def _start_containers(self, to_add):
         """Creates and starts containers via the scheduler"""
         if not to_add:
             return
-        create_threads = [Thread(target=c.create) for c in to_add]
-        start_threads = [Thread(target=c.start) for c in to_add]
-        [t.start() for t in create_threads]
-        [t.join() for t in create_threads]
-        if any(c.state != 'created' for c in to_add):
+        self._forget_states(to_add)
+        if settings.DEIS_PIPELINE_CONTAINER_START:
+            created = self._create_and_start_containers(to_add)
+        else:
+            self._fan_out([c.create for c in to_add])
+            created = set(self.container_states(to_add).values()) == set(['created'])
+        if not created:
             err = 'aborting, failed to create some containers'
             log_event(self, err, logging.ERROR)
             self._destroy_containers(to_add)
             raise RuntimeError(err)
-        [t.start() for t in start_threads]
-        [t.join() for t in start_threads]
-        if set([c.state for c in to_add]) != set(['up']):
+        if not settings.DEIS_PIPELINE_CONTAINER_START:
+            self._fan_out([c.start for c in to_add])
+        if set(self.container_states(to_add).values()) != set(['up']):
             err = 'warning, some containers failed to start'
             log_event(self, err, logging.WARNING)
         # if the user specified a health check, try checking to see if it's running
-        try:
-            config = self.config_set.latest()
-            if 'HEALTHCHECK_URL' in config.values.keys():
-                self._healthcheck(to_add, config.values)
-        except Config.DoesNotExist:
-            pass
+        config = self.get_latest_release().config
+        if 'HEALTHCHECK_URL' in config.values.keys():
+            self._healthcheck(to_add, config.values)
+
+    def _create_and_start_containers(self, to_add):
+        """
+        Start each container as soon as its own create succeeds.
+
+        Once any create has failed no further containers are started, since the caller is going
+        to destroy the whole batch anyway. Returns whether every container was created.
+        """
+        failed = Event()
+
+        def _create_and_start(c):
+            try:
+                c.create()
+            except Exception:
+                failed.set()
+                return
+            if c.state != 'created':
+                failed.set()
+            elif not failed.is_set():
+                c.start()
+
+        self._fan_out([lambda c=c: _create_and_start(c) for c in to_add])
+        return not failed.is_set()
 
     def _healthcheck(self, containers, config):
         # if at first it fails, back off and try again at 10%, 50% and 100% of INITIAL_DELAY
         intervals = [1.0, 0.1, 0.5, 1.0]
-        # HACK (bacongobbler): we need to wait until publisher has a chance to publish each
-        # service to etcd, which can take up to 20 seconds.
-        time.sleep(20)
+        to_healthcheck = [c for c in containers if c.type in ['web', 'cmd']]
+        # the publisher has to announce each container in etcd before it can be checked
+        self._wait_for_services(to_healthcheck)
         for i in xrange(len(intervals)):
             delay = int(config.get('HEALTHCHECK_INITIAL_DELAY', 0))
             try:
                 # sleep until the initial timeout is over
                 if delay > 0:
                     time.sleep(delay * intervals[i])
-                to_healthcheck = [c for c in containers if c.type in ['web', 'cmd']]
                 self._do_healthcheck(to_healthcheck, config)
                 break
             except exceptions.HealthcheckException as e:
@@ -403,16 +640,67 @@ class App(UuidAuditedModel):
             log_event(self, msg, logging.ERROR)
             raise RuntimeError(msg)
 
+    def _get_services(self):
+        """Return the address the publisher announced for each of this app's containers."""
+        services = _etcd_client.read('/deis/services/{}'.format(self), recursive=True)
+        return {leaf.key.split('/')[-1]: leaf.value for leaf in services.leaves}
+
+    def _wait_for_services(self, containers):
+        """
+        Wait until the publisher has announced each of the given containers in etcd.
+
+        Rather than polling, this watches the app's services directory for changes. It gives up
+        quietly after DEIS_HEALTHCHECK_PUBLISH_TIMEOUT seconds and leaves it to the healthcheck
+        itself to report containers which never showed up.
+        """
+        if not containers:
+            return
+        key = '/deis/services/{}'.format(self)
+        expected = set(c.job_id for c in containers)
+        deadline = time.time() + settings.DEIS_HEALTHCHECK_PUBLISH_TIMEOUT
+        try:
+            services = _etcd_client.read(key, recursive=True)
+            published = set(leaf.key.split('/')[-1] for leaf in services.leaves if leaf.value)
+            index = services.etcd_index
+        except KeyError:
+            published, index = set(), None
+        except EtcdUnavailable:
+            return
+        while not expected <= published:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            kwargs = {'wait': True, 'recursive': True, 'timeout': remaining}
+            if index:
+                kwargs['waitIndex'] = index + 1
+            try:
+                change = _etcd_client.read(key, **kwargs)
+            except Exception:
+                # timed out, or etcd is unavailable
+                return
+            index = change.modifiedIndex
+            if change.action in ('delete', 'expire'):
+                published.discard(change.key.split('/')[-1])
+            else:
+                published.add(change.key.split('/')[-1])
+
     def _do_healthcheck(self, containers, config):
         path = config.get('HEALTHCHECK_URL', '/')
         timeout = int(config.get('HEALTHCHECK_TIMEOUT', 1))
-        if not _etcd_client:
-            raise exceptions.HealthcheckException('no etcd client available')
-        for container in containers:
+        try:
+            services = self._get_services()
+        except KeyError as e:
+            raise exceptions.HealthcheckException(
+                'failed to connect to container ({})'.format(e))
+        except EtcdUnavailable as e:
+            raise exceptions.HealthcheckException(
+                'could not look up containers ({})'.format(e))
+        session = healthcheck_session()
+
+        def _probe(container):
             try:
-                key = "/deis/services/{self}/{container.job_id}".format(**locals())
-                url = "http://{}{}".format(_etcd_client.get(key).value, path)
-                response = requests.get(url, timeout=timeout)
+                url = "http://{}{}".format(services[container.job_id], path)
+                response = session.get(url, timeout=timeout)
                 if response.status_code != requests.codes.OK:
                     raise exceptions.HealthcheckException(
                         "app failed health check (got '{}', expected: '200')".format(
@@ -421,20 +709,22 @@ class App(UuidAuditedModel):
                 raise exceptions.HealthcheckException(
                     'failed to connect to container ({})'.format(e))
 
+        # probe every container at once, reporting the first to fail
+        probes = [container_executor().submit(_probe, c) for c in containers]
+        for probe in probes:
+            probe.result()
+
     def _restart_containers(self, to_restart):
         """Restarts containers via the scheduler"""
         if not to_restart:
             return
-        stop_threads = [Thread(target=c.stop) for c in to_restart]
-        start_threads = [Thread(target=c.start) for c in to_restart]
-        [t.start() for t in stop_threads]
-        [t.join() for t in stop_threads]
-        if any(c.state != 'created' for c in to_restart):
+        self._forget_states(to_restart)
+        self._fan_out([c.stop for c in to_restart])
+        if set(self.container_states(to_restart).values()) != set(['created']):
             err = 'warning, some containers failed to stop'
             log_event(self, err, logging.WARNING)
-        [t.start() for t in start_threads]
-        [t.join() for t in start_threads]
-        if any(c.state != 'up' for c in to_restart):
+        self._fan_out([c.start for c in to_restart])
+        if set(self.container_states(to_restart).values()) != set(['up']):
             err = 'warning, some containers failed to start'
             log_event(self, err, logging.WARNING)
 
@@ -442,25 +732,28 @@ class App(UuidAuditedModel):
         """Destroys containers via the scheduler"""
         if not to_destroy:
             return
-        destroy_threads = [Thread(target=c.destroy) for c in to_destroy]
-        [t.start() for t in destroy_threads]
-        [t.join() for t in destroy_threads]
-        [c.delete() for c in to_destroy if c.state == 'destroyed']
-        if any(c.state != 'destroyed' for c in to_destroy):
+        self._forget_states(to_destroy)
+        self._fan_out([c.destroy for c in to_destroy])
+        states = self.container_states(to_destroy)
+        destroyed = [c for c in to_destroy if states[c.job_id] == 'destroyed']
+        self._delete_containers(destroyed)
+        if len(destroyed) < len(to_destroy):
             err = 'aborting, failed to destroy some containers'
             log_event(self, err, logging.ERROR)
             raise RuntimeError(err)
 
+    def _delete_containers(self, containers):
+        """Delete the database records of the given containers with a single query."""
+        if containers:
+            Container.objects.filter(pk__in=[c.pk for c in containers]).delete()
+
     def deploy(self, user, release):
         """Deploy a new release to this application"""
-        existing = self.container_set.exclude(type='run')
-        new = []
-        scale_types = set()
-        for e in existing:
-            n = e.clone(release)
-            n.save()
-            new.append(n)
-            scale_types.add(e.type)
+        self.refresh_latest_release()
+        existing = list(self.container_set.exclude(type='run').select_related('release'))
+        new = [e.clone(release) for e in existing]
+        Container.objects.bulk_create(new)
+        scale_types = set(e.type for e in existing)
 
         if new and "deploy" in dir(self._scheduler):
             self._deploy_app(scale_types, release, existing)
@@ -485,6 +778,10 @@ class App(UuidAuditedModel):
                       'aname': self.id,
                       'num': 0,
                       'version': version}
+            # let the app tune how fast its containers are replaced
+            for key, option in DEPLOY_OPTIONS.items():
+                if key in release.config.values:
+                    kwargs[option] = release.config.values[key]
             job_id = self._get_job_id(scale_type)
             command = self._get_command(scale_type)
             try:
@@ -497,7 +794,7 @@ class App(UuidAuditedModel):
                 err = '{} (deploy): {}'.format(job_id, e)
                 log_event(self, err, logging.ERROR)
                 raise
-        [c.delete() for c in existing]
+        self._delete_containers(existing)
 
     def _default_scale(self, user, release):
         """Scale to default structure based on release type"""
@@ -519,13 +816,46 @@ class App(UuidAuditedModel):
 
         self.scale(user, structure)
 
-    def logs(self, log_lines=str(settings.LOG_LINES)):
+    def logs(self, log_lines=str(settings.LOG_LINES), **kwargs):
         """Return aggregated log data for this application."""
+        return ''.join(self.stream_logs(log_lines, **kwargs))
+
+    def stream_logs(self, log_lines=str(settings.LOG_LINES), follow=False, since=None,
+                    until=None, process=None, source=None, pattern=None):
+        """
+        Return an iterator over aggregated log data for this application.
+
+        With since or until, only lines stamped within that range of time are read. Lines can
+        also be filtered by process, such as ``web`` or ``web.1``, by source, either ``deis`` for
+        platform events or ``app`` for the application's own output, and by a pattern compiled
+        with :func:`api.logs.compile_pattern`. Filters look back from the newest lines in range
+        through at most DEIS_LOG_SCAN_LIMIT bytes of logs, for at most DEIS_LOG_SCAN_TIMEOUT
+        seconds. Either way, the last log_lines matching lines are returned. Otherwise, with
+        follow, the iterator goes on to yield new log data as it is written, for up to
+        DEIS_LOG_FOLLOW_TIMEOUT seconds. It must be closed once done with, and a RuntimeError is
+        raised if too many clients are following logs already.
+        """
+        log_lines = int(log_lines)
         path = os.path.join(settings.DEIS_LOG_DIR, self.id + '.log')
-        if not os.path.exists(path):
+        tag = {'deis': 'deis', 'app': self.id}.get(source)
+        filtered = process or tag or pattern
+        # make sure our own buffered events are part of what is read
+        logs.sink.flush(path)
+        try:
+            # the logger component writes here too, so set the log aside if it has grown too big
+            logs.rotate(path)
+            if filtered:
+                lines = logs.grep(logs.backwards(path, since, until), tag, process, pattern,
+                                  settings.DEIS_LOG_SCAN_LIMIT, settings.DEIS_LOG_SCAN_TIMEOUT)
+                return reversed(list(itertools.islice(lines, log_lines)))
+            elif since or until:
+                return iter(deque(logs.read(path, since, until), maxlen=log_lines))
+            elif follow:
+                return logs.Follower(path, log_lines, timeout=settings.DEIS_LOG_FOLLOW_TIMEOUT)
+            else:
+                return logs.tail(path, log_lines)
+        except IOError:
             raise EnvironmentError('Could not locate logs')
-        data = subprocess.check_output(['tail', '-n', log_lines, path])
-        return data
 
     def run(self, user, command):
         """Run a one-off command in an ephemeral app container."""
@@ -533,7 +863,9 @@ class App(UuidAuditedModel):
         # a scheduler that supports one-off admin tasks natively
         if not settings.SSH_PRIVATE_KEY:
             raise EnvironmentError('Support for admin commands is not configured')
-        if self.release_set.latest().build is None:
+        self.refresh_latest_release()
+        release = self.get_latest_release()
+        if release.build is None:
             raise EnvironmentError('No build associated with this release to run this command')
         # TODO: add support for interactive shell
         msg = "{} runs '{}'".format(user.username, command)
@@ -543,7 +875,7 @@ class App(UuidAuditedModel):
         # create database record for run process
         c = Container.objects.create(owner=self.owner,
                                      app=self,
-                                     release=self.release_set.latest(),
+                                     release=release,
                                      type='run',
                                      num=c_num)
         image = c.release.image
@@ -580,7 +912,11 @@ class Container(UuidAuditedModel):
 
     @property
     def state(self):
-        return self._scheduler.state(self.job_id).name
+        try:
+            return ContainerStatus.objects.get(
+                job_id=self.job_id, checked__gte=_fresh_since()).state
+        except ContainerStatus.DoesNotExist:
+            return self._scheduler.state(self.job_id).name
 
     def short_name(self):
         return "{}.{}.{}".format(self.app.id, self.type, self.num)
@@ -592,6 +928,7 @@ class Container(UuidAuditedModel):
     class Meta:
         get_latest_by = '-created'
         ordering = ['created']
+        index_together = (('app', 'created', 'uuid'), ('app', 'type', 'created', 'uuid'))
 
     @property
     def job_id(self):
@@ -615,12 +952,12 @@ class Container(UuidAuditedModel):
     _command = property(_get_command)
 
     def clone(self, release):
-        c = Container.objects.create(owner=self.owner,
-                                     app=self.app,
-                                     release=release,
-                                     type=self.type,
-                                     num=self.num)
-        return c
+        """Return an unsaved copy of this container for the given release."""
+        return Container(owner_id=self.owner_id,
+                         app=self.app,
+                         release=release,
+                         type=self.type,
+                         num=self.num)
 
     @close_db_connections
     def create(self):
@@ -691,6 +1028,46 @@ class Container(UuidAuditedModel):
             raise
 
 
+def _fresh_since():
+    """Return the earliest time a recorded container state may have been checked to be served."""
+    return timezone.now() - timedelta(seconds=settings.DEIS_CONTAINER_STATE_MAX_AGE)
+
+
+@python_2_unicode_compatible
+class ContainerStatus(AuditedModel):
+    """
+    State of a container job as last observed on the scheduler by :mod:`api.reconciler`.
+
+    Jobs which have no container in the database are recorded as well, so that drift between
+    the database and the scheduler is flagged either way.
+    """
+    MISSING = 'missing'
+    ORPHANED = 'orphaned'
+    DRIFT = (
+        (MISSING, 'Missing from the scheduler'),
+        (ORPHANED, 'Unknown to the controller'),
+    )
+
+    job_id = models.CharField(max_length=255, unique=True)
+    app = models.ForeignKey('App', null=True, blank=True)
+    container = models.OneToOneField('Container', null=True, blank=True,
+                                     on_delete=models.SET_NULL)
+    state = models.CharField(max_length=16)
+    # when the scheduler last reported the job, when its state was last looked up, and when
+    # that state was last forgotten as its container was acted on
+    seen = models.DateTimeField(null=True, blank=True)
+    checked = models.DateTimeField(null=True, blank=True, db_index=True)
+    forgotten = models.DateTimeField(null=True, blank=True)
+    drift = models.CharField(max_length=16, choices=DRIFT, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['job_id']
+        verbose_name_plural = 'container statuses'
+
+    def __str__(self):
+        return "{} {}".format(self.job_id, self.state)
+
+
 @python_2_unicode_compatible
 class Push(UuidAuditedModel):
     """
@@ -735,9 +1112,10 @@ class Build(UuidAuditedModel):
         get_latest_by = 'created'
         ordering = ['-created']
         unique_together = (('app', 'uuid'),)
+        index_together = (('app', 'created', 'uuid'),)
 
     def create(self, user, *args, **kwargs):
-        latest_release = self.app.release_set.latest()
+        latest_release = self.app.get_latest_release()
         source_version = 'latest'
         if self.sha:
             source_version = 'git-{}'.format(self.sha)
@@ -755,12 +1133,10 @@ class Build(UuidAuditedModel):
     def save(self, **kwargs):
         try:
             previous_build = self.app.build_set.latest()
-            to_destroy = []
-            for proctype in previous_build.procfile:
-                if proctype not in self.procfile:
-                    for c in self.app.container_set.filter(type=proctype):
-                        to_destroy.append(c)
-            self.app._destroy_containers(to_destroy)
+            removed = [p for p in previous_build.procfile if p not in self.procfile]
+            if removed:
+                self.app._destroy_containers(list(
+                    self.app.container_set.filter(type__in=removed).select_related('release')))
         except Build.DoesNotExist:
             pass
         return super(Build, self).save(**kwargs)
@@ -770,7 +1146,7 @@ class Build(UuidAuditedModel):
 
 
 @python_2_unicode_compatible
-class Config(UuidAuditedModel):
+class Config(EtcdSyncedMixin, UuidAuditedModel):
     """
     Set of configuration values applied as environment variables
     during runtime execution of the Application.
@@ -787,6 +1163,7 @@ class Config(UuidAuditedModel):
         get_latest_by = 'created'
         ordering = ['-created']
         unique_together = (('app', 'uuid'),)
+        index_together = (('app', 'created'),)
 
     def __str__(self):
         return "{}-{}".format(self.app.id, self.uuid[:7])
@@ -835,6 +1212,7 @@ class Release(UuidAuditedModel):
         get_latest_by = 'created'
         ordering = ['-created']
         unique_together = (('app', 'version'),)
+        index_together = (('app', 'created', 'uuid'),)
 
     def __str__(self):
         return "{0}-v{1}".format(self.app.id, self.version)
@@ -888,9 +1266,9 @@ class Release(UuidAuditedModel):
             if ':' in self.build.image:
                 if '/' not in self.build.image[self.build.image.rfind(':') + 1:]:
                     source_image += self.build.image[self.build.image.rfind(':'):]
-        publish_release(source_image,
-                        self.config.values,
-                        self.image)
+        # deploy options are read by the controller, not by the app's containers
+        env = {k: v for k, v in self.config.values.items() if k not in DEPLOY_OPTIONS}
+        publish_release(source_image, env, self.image)
 
     def previous(self):
         """
@@ -898,15 +1276,13 @@ class Release(UuidAuditedModel):
 
         :return: the previous :class:`Release`, or None
         """
-        releases = self.app.release_set
-        if self.pk:
-            releases = releases.exclude(pk=self.pk)
         try:
             # Get the Release previous to this one
-            prev_release = releases.latest()
+            if not self.pk:
+                return self.app.get_latest_release()
+            return self.app.release_set.exclude(pk=self.pk).latest()
         except Release.DoesNotExist:
-            prev_release = None
-        return prev_release
+            return None
 
     def rollback(self, user, version):
         if version < 1:
@@ -996,7 +1372,7 @@ class Release(UuidAuditedModel):
 
 
 @python_2_unicode_compatible
-class Domain(AuditedModel):
+class Domain(EtcdSyncedMixin, AuditedModel):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL)
     app = models.ForeignKey('App')
     domain = models.TextField(blank=False, null=False, unique=True)
@@ -1006,7 +1382,7 @@ class Domain(AuditedModel):
 
 
 @python_2_unicode_compatible
-class Certificate(AuditedModel):
+class Certificate(EtcdSyncedMixin, AuditedModel):
     """
     Public and private key pair used to secure application traffic at the router.
     """
@@ -1038,7 +1414,7 @@ class Certificate(AuditedModel):
 
 
 @python_2_unicode_compatible
-class Key(UuidAuditedModel):
+class Key(EtcdSyncedMixin, UuidAuditedModel):
     """An SSH public key."""
 
     owner = models.ForeignKey(settings.AUTH_USER_MODEL)
@@ -1058,6 +1434,190 @@ class Key(UuidAuditedModel):
         return super(Key, self).save(*args, **kwargs)
 
 
+@python_2_unicode_compatible
+class Operation(UuidAuditedModel):
+    """
+    Long-running action on an application, carried out outside of the API request.
+
+    Operations are queued in the database and picked up by the controller's operation workers,
+    which run the matching :class:`App` method and record its phase, progress and result.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    PHASES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL)
+    # keep the operation around after an app delete so its outcome can be inspected
+    app = models.ForeignKey('App', null=True, blank=True, on_delete=models.SET_NULL)
+    type = models.CharField(max_length=32)
+    params = JSONField(default={}, blank=True)
+    phase = models.CharField(max_length=16, choices=PHASES, default=PENDING)
+    progress = models.TextField(blank=True)
+    result = JSONField(default={}, blank=True)
+    # a running operation whose lease has lapsed is queued again, see api.operations
+    lease_expires = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        get_latest_by = 'created'
+        ordering = ['-created']
+
+    def __str__(self):
+        return "{}-{}".format(self.type, self.uuid[:7])
+
+    def report(self, message):
+        """Record a progress message for this operation."""
+        self.progress = unicode(message)
+        self.save(update_fields=['progress', 'updated'])
+
+    def run(self):
+        """Carry out this operation, recording its phase and result as it goes."""
+        self.phase = self.RUNNING
+        self.lease_expires = self.lease_expiry()
+        self.save(update_fields=['phase', 'lease_expires', 'updated'])
+        _operation_context.operation = self
+        try:
+            result = getattr(self, '_run_' + self.type)()
+        except Exception as e:
+            logger.error("{}: operation {} failed: {}".format(self.app, self, e))
+            self.phase = self.FAILED
+            self.result = {'detail': str(e)}
+        else:
+            self.phase = self.SUCCEEDED
+            self.result = result or {}
+        finally:
+            _operation_context.operation = None
+        self.lease_expires = None
+        # only update our own columns, as the app may have gone away underneath us
+        self.save(update_fields=['phase', 'result', 'lease_expires', 'updated'])
+
+    @staticmethod
+    def lease_expiry():
+        """Return when a lease on a running operation taken out now expires."""
+        return timezone.now() + timedelta(seconds=settings.DEIS_OPERATION_LEASE)
+
+    def _run_scale(self):
+        self.app.scale(self.owner, self.params['structure'])
+
+    def _run_restart(self):
+        containers = self.app.restart(**self.params)
+        return {'containers': [c.short_name() for c in containers]}
+
+    def _run_build(self):
+        build = self.app.build_set.get(uuid=self.params['build'])
+        release = build.create(self.owner)
+        return {'release': release.version}
+
+    def _run_deploy(self):
+        release = self.app.release_set.get(uuid=self.params['release'])
+        try:
+            self.app.deploy(self.owner, release)
+        except RuntimeError:
+            release.delete()
+            raise
+        return {'release': release.version}
+
+    def _run_destroy(self):
+        self.app.delete()
+
+
+@python_2_unicode_compatible
+class EtcdChange(AuditedModel):
+    """
+    Change to etcd stemming from a model change, waiting to be published.
+
+    Changes are recorded in the same transaction as the model change, through
+    :func:`etcd_changes`, and applied in order by the etcd publisher in :mod:`api.outbox`, so
+    requests never wait on etcd. Only the latest change to a path matters, so older ones are
+    dropped once a newer one has been applied.
+    """
+    WRITE = 'write'
+    DELETE = 'delete'
+    CONFIG = 'config'
+    SNAPSHOT = 'snapshot'
+    ACTIONS = (
+        (WRITE, 'Write'),
+        (DELETE, 'Delete'),
+        (CONFIG, 'Publish config'),
+        (SNAPSHOT, 'Publish routing snapshot'),
+    )
+
+    path = models.CharField(max_length=255, db_index=True)
+    action = models.CharField(max_length=16, choices=ACTIONS)
+    # the value to write, or the app whose config to publish
+    value = models.TextField(null=True, blank=True)
+    options = JSONField(default={}, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    claim = models.CharField(max_length=32, blank=True, db_index=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return "{} {}".format(self.action, self.path)
+
+    def apply(self):
+        """Make this change to etcd."""
+        if self.action == self.WRITE:
+            try:
+                _etcd_client.write(self.path, utils.encode(self.value), **self.options)
+            except KeyError:
+                # the directory already exists
+                if not self.options.get('dir'):
+                    raise
+        elif self.action == self.DELETE:
+            try:
+                _etcd_client.delete(self.path, **self.options)
+            except KeyError:
+                pass
+        elif self.action == self.CONFIG:
+            _etcd_sync_config(self.path, self.value)
+        elif self.action == self.SNAPSHOT:
+            _etcd_publish_routing(self.path)
+
+
+@python_2_unicode_compatible
+class Lease(models.Model):
+    """
+    A named lease on work which only one process should be doing at a time.
+
+    A holder keeps the lease until it expires or is released, and may renew it meanwhile.
+    Taking it is a single conditional update, so two processes can never both hold it.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    holder = models.CharField(max_length=32, blank=True)
+    expires = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name, holder, seconds):
+        """Take or renew the named lease for seconds, and return whether holder now holds it."""
+        now = timezone.now()
+        lease = cls.objects.filter(Q(expires__lte=now) | Q(holder=holder), name=name)
+        if lease.update(holder=holder, expires=now + timedelta(seconds=seconds)):
+            return True
+        # unless nobody has taken it before, someone else holds it
+        _, created = cls.objects.get_or_create(name=name, defaults={'expires': now})
+        return created and lease.update(
+            holder=holder, expires=now + timedelta(seconds=seconds)) == 1
+
+    @classmethod
+    def release(cls, name, holder):
+        """Give up the named lease, if holder still holds it."""
+        cls.objects.filter(name=name, holder=holder).update(holder='', expires=timezone.now())
+
+
 # define update/delete callbacks for synchronizing
 # models with the configuration management backend
 
@@ -1077,6 +1637,16 @@ def _log_release_created(**kwargs):
         release.app.log(release.summary)
 
 
+def _update_latest_release(**kwargs):
+    if kwargs.get('created'):
+        release = kwargs['instance']
+        # a release made concurrently with a newer one must not take its place
+        App.objects.filter(pk=release.app_id).filter(
+            Q(latest_release__isnull=True) | Q(latest_release__version__lt=release.version)
+        ).update(latest_release=release)
+        release.app.latest_release = release
+
+
 def _log_config_updated(**kwargs):
     config = kwargs['instance']
     # log only to the controller; this event will be logged in the release summary
@@ -1105,107 +1675,175 @@ def _log_cert_removed(**kwargs):
     logger.info("cert {} removed".format(cert))
 
 
+def _etcd_enqueue(path, action, value=None, next_attempt=None, **options):
+    """Record a change to etcd for the publisher to make."""
+    EtcdChange.objects.create(path=path, action=action, value=value, options=options,
+                              next_attempt=next_attempt or timezone.now())
+    if transaction.get_connection().in_atomic_block:
+        # the publisher could not see the change yet, so it is told once it has been committed
+        _etcd_pending.notify = True
+        return
+    # imported here, as the outbox depends on our models
+    from api import outbox
+    outbox.notify()
+
+
+def routing_snapshot():
+    """Return the domains routed to each app and the names of certificates held for them."""
+    return {
+        'domains': dict(Domain.objects.values_list('domain', 'app__id').iterator()),
+        'certs': sorted(Certificate.objects.values_list('common_name', flat=True).iterator()),
+    }
+
+
+def _etcd_routing_update(path):
+    """Return the arguments for writing a new routing snapshot, or None if it is unchanged."""
+    snapshot = routing_snapshot()
+    try:
+        published = _etcd_client.get(path).value
+    except KeyError:
+        published = None
+    previous = json.loads(published) if published else {}
+    if all(previous.get(k) == v for k, v in snapshot.iteritems()):
+        return None
+    snapshot['version'] = previous.get('version', 0) + 1
+    # should another publisher have got there first, fail and try again with its version
+    condition = {'prevValue': published} if published else {'prevExist': False}
+    return (path, json.dumps(snapshot, sort_keys=True, separators=(',', ':'))), condition
+
+
+def _etcd_publish_routing(path):
+    """Publish a new version of the routing snapshot, unless it is unchanged."""
+    update = _etcd_routing_update(path)
+    if update:
+        _etcd_client.write(*update[0], **update[1])
+
+
+def _etcd_enqueue_routing():
+    """Have the routing snapshot rebuilt shortly, along with any other changes made meanwhile."""
+    # join a rebuild which is already waiting, so that a burst of changes is published once
+    pending = EtcdChange.objects.filter(
+        path=settings.DEIS_ROUTING_SNAPSHOT_KEY, claim='').aggregate(Min('next_attempt'))
+    _etcd_enqueue(settings.DEIS_ROUTING_SNAPSHOT_KEY, EtcdChange.SNAPSHOT,
+                  next_attempt=pending['next_attempt__min'] or timezone.now() + timedelta(
+                      seconds=settings.DEIS_ROUTING_SNAPSHOT_DELAY))
+
+
 def _etcd_publish_key(**kwargs):
     key = kwargs['instance']
-    _etcd_client.write('/deis/builder/users/{}/{}'.format(
-        key.owner.username, fingerprint(key.public)), key.public)
+    _etcd_enqueue('/deis/builder/users/{}/{}'.format(
+        key.owner.username, fingerprint(key.public)), EtcdChange.WRITE, key.public)
 
 
 def _etcd_purge_key(**kwargs):
     key = kwargs['instance']
-    try:
-        _etcd_client.delete('/deis/builder/users/{}/{}'.format(
-            key.owner.username, fingerprint(key.public)))
-    except KeyError:
-        pass
+    _etcd_enqueue('/deis/builder/users/{}/{}'.format(
+        key.owner.username, fingerprint(key.public)), EtcdChange.DELETE)
 
 
 def _etcd_purge_user(**kwargs):
     username = kwargs['instance'].username
-    try:
-        _etcd_client.delete(
-            '/deis/builder/users/{}'.format(username), dir=True, recursive=True)
-    except KeyError:
-        # If _etcd_publish_key() wasn't called, there is no user dir to delete.
-        pass
+    _etcd_enqueue('/deis/builder/users/{}'.format(username), EtcdChange.DELETE,
+                  dir=True, recursive=True)
 
 
 def _etcd_create_app(**kwargs):
     appname = kwargs['instance']
     if kwargs['created']:
-        _etcd_client.write('/deis/services/{}'.format(appname), None, dir=True)
+        _etcd_enqueue('/deis/services/{}'.format(appname), EtcdChange.WRITE, dir=True)
 
 
 def _etcd_purge_app(**kwargs):
     appname = kwargs['instance']
-    try:
-        _etcd_client.delete('/deis/services/{}'.format(appname), dir=True, recursive=True)
-    except KeyError:
-        pass
+    _etcd_enqueue('/deis/services/{}'.format(appname), EtcdChange.DELETE,
+                  dir=True, recursive=True)
 
 
 def _etcd_publish_cert(**kwargs):
     cert = kwargs['instance']
     if kwargs['created']:
-        _etcd_client.write('/deis/certs/{}/cert'.format(cert), cert.certificate)
-        _etcd_client.write('/deis/certs/{}/key'.format(cert), cert.key)
+        _etcd_enqueue('/deis/certs/{}/cert'.format(cert), EtcdChange.WRITE, cert.certificate)
+        _etcd_enqueue('/deis/certs/{}/key'.format(cert), EtcdChange.WRITE, cert.key)
+        _etcd_enqueue_routing()
 
 
 def _etcd_purge_cert(**kwargs):
     cert = kwargs['instance']
+    _etcd_enqueue('/deis/certs/{}'.format(cert), EtcdChange.DELETE,
+                  prevExist=True, dir=True, recursive=True)
+    _etcd_enqueue_routing()
+
+
+def _etcd_config_values(root, values):
+    """Return the etcd keys and values an app's config is published as."""
+    return {'{}/{}'.format(root, unicode(k).lower()): unicode(v) for k, v in values.iteritems()}
+
+
+def _etcd_sync(writes, deletes):
+    """Write and delete the given etcd keys concurrently, raising the first error seen."""
+    def _delete(key):
+        try:
+            _etcd_client.delete(key)
+        except KeyError:
+            pass
+    tasks = [(_etcd_client.write, k, v.encode('utf-8')) for k, v in writes.iteritems()]
+    tasks.extend((_delete, k) for k in deletes)
+    if len(tasks) == 1:
+        fn, args = tasks[0][0], tasks[0][1:]
+        return fn(*args)
+    for f in [etcd_executor().submit(*task) for task in tasks]:
+        f.result()
+
+
+def _etcd_sync_config(root, app_id):
+    """Bring the config published for an app at root in line with its latest config."""
     try:
-        _etcd_client.delete('/deis/certs/{}'.format(cert),
-                            prevExist=True, dir=True, recursive=True)
+        values = Config.objects.filter(app__id=app_id).latest().values
+    except Config.DoesNotExist:
+        values = {}
+    try:
+        # diff against what etcd holds, so that only changed and removed keys are sent, and
+        # watchers of unchanged keys are left alone
+        published = {node.key: node.value for node in
+                     _etcd_client.read(root, recursive=True).leaves if not node.dir}
     except KeyError:
-        pass
+        # etcd has no view of this app's config, so publish all of it
+        published = {}
+    diff = dict_diff(_etcd_config_values(root, values), published)
+    writes = dict(diff.get('added', {}), **diff.get('changed', {}))
+    _etcd_sync(writes, diff.get('deleted', {}).keys())
 
 
 def _etcd_publish_config(**kwargs):
     config = kwargs['instance']
-    # we purge all existing config when adding the newest instance. This is because
-    # deis config:unset would remove an existing value, but not delete the
-    # old config object
-    try:
-        _etcd_client.delete('/deis/config/{}'.format(config.app),
-                            prevExist=True, dir=True, recursive=True)
-    except KeyError:
-        pass
-    if kwargs['created']:
-        for k, v in config.values.iteritems():
-            _etcd_client.write(
-                '/deis/config/{}/{}'.format(
-                    config.app,
-                    unicode(k).encode('utf-8').lower()),
-                unicode(v).encode('utf-8'))
+    # the latest config is looked up when publishing, so queued changes for an app collapse
+    _etcd_enqueue('/deis/config/{}'.format(config.app), EtcdChange.CONFIG, config.app.id)
 
 
 def _etcd_purge_config(**kwargs):
     config = kwargs['instance']
-    try:
-        _etcd_client.delete('/deis/config/{}'.format(config.app),
-                            prevExist=True, dir=True, recursive=True)
-    except KeyError:
-        pass
+    _etcd_enqueue('/deis/config/{}'.format(config.app), EtcdChange.DELETE,
+                  prevExist=True, dir=True, recursive=True)
 
 
 def _etcd_publish_domains(**kwargs):
     domain = kwargs['instance']
     if kwargs['created']:
-        _etcd_client.write('/deis/domains/{}'.format(domain), domain.app)
+        _etcd_enqueue('/deis/domains/{}'.format(domain), EtcdChange.WRITE, unicode(domain.app))
+        _etcd_enqueue_routing()
 
 
 def _etcd_purge_domains(**kwargs):
     domain = kwargs['instance']
-    try:
-        _etcd_client.delete('/deis/domains/{}'.format(domain),
-                            prevExist=True, dir=True, recursive=True)
-    except KeyError:
-        pass
+    _etcd_enqueue('/deis/domains/{}'.format(domain), EtcdChange.DELETE,
+                  prevExist=True, dir=True, recursive=True)
+    _etcd_enqueue_routing()
 
 
 # Log significant app-related events
 post_save.connect(_log_build_created, sender=Build, dispatch_uid='api.models.log')
 post_save.connect(_log_release_created, sender=Release, dispatch_uid='api.models.log')
+post_save.connect(_update_latest_release, sender=Release, dispatch_uid='api.models')
 post_save.connect(_log_config_updated, sender=Config, dispatch_uid='api.models.log')
 post_save.connect(_log_domain_added, sender=Domain, dispatch_uid='api.models.log')
 post_save.connect(_log_cert_added, sender=Certificate, dispatch_uid='api.models.log')
@@ -1223,15 +1861,14 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
 _etcd_client = get_etcd_client()
 
 
-if _etcd_client:
-    post_save.connect(_etcd_publish_key, sender=Key, dispatch_uid='api.models')
-    post_delete.connect(_etcd_purge_key, sender=Key, dispatch_uid='api.models')
-    post_delete.connect(_etcd_purge_user, sender=get_user_model(), dispatch_uid='api.models')
-    post_save.connect(_etcd_publish_domains, sender=Domain, dispatch_uid='api.models')
-    post_delete.connect(_etcd_purge_domains, sender=Domain, dispatch_uid='api.models')
-    post_save.connect(_etcd_create_app, sender=App, dispatch_uid='api.models')
-    post_delete.connect(_etcd_purge_app, sender=App, dispatch_uid='api.models')
-    post_save.connect(_etcd_publish_cert, sender=Certificate, dispatch_uid='api.models')
-    post_delete.connect(_etcd_purge_cert, sender=Certificate, dispatch_uid='api.models')
-    post_save.connect(_etcd_publish_config, sender=Config, dispatch_uid='api.models')
-    post_delete.connect(_etcd_purge_config, sender=Config, dispatch_uid='api.models')
+post_save.connect(_etcd_publish_key, sender=Key, dispatch_uid='api.models')
+post_delete.connect(_etcd_purge_key, sender=Key, dispatch_uid='api.models')
+post_delete.connect(_etcd_purge_user, sender=get_user_model(), dispatch_uid='api.models')
+post_save.connect(_etcd_publish_domains, sender=Domain, dispatch_uid='api.models')
+post_delete.connect(_etcd_purge_domains, sender=Domain, dispatch_uid='api.models')
+post_save.connect(_etcd_create_app, sender=App, dispatch_uid='api.models')
+post_delete.connect(_etcd_purge_app, sender=App, dispatch_uid='api.models')
+post_save.connect(_etcd_publish_cert, sender=Certificate, dispatch_uid='api.models')
+post_delete.connect(_etcd_purge_cert, sender=Certificate, dispatch_uid='api.models')
+post_save.connect(_etcd_publish_config, sender=Config, dispatch_uid='api.models')
+post_delete.connect(_etcd_purge_config, sender=Config, dispatch_uid='api.models')
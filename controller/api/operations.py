@@ -0,0 +1,181 @@
+"""
+Background workers which carry out queued :class:`~api.models.Operation` objects.
+
+Operations are persisted in the database, so any controller process may pick up work queued by
+another one. Each process runs a small pool of daemon threads which claim pending operations one
+at a time and run them outside of the request/response cycle.
+
+A running operation is leased to the worker running it, which keeps renewing the lease until the
+operation is done. Should the worker's process die, the lease lapses and the operation is queued
+again for another worker to pick up.
+"""
+
+from __future__ import unicode_literals
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import App, Operation
+
+
+logger = logging.getLogger(__name__)
+
+
+def _close_db_connections():
+    for conn in connections.all():
+        conn.close()
+
+
+class _Lease(object):
+    """Renew the lease on a running operation in the background until it is done."""
+
+    def __init__(self, operation):
+        self._operation = operation
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._renew,
+                                        name='operation-lease-{}'.format(operation))
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
+
+    def _renew(self):
+        try:
+            while not self._done.wait(settings.DEIS_OPERATION_LEASE / 3.0):
+                try:
+                    Operation.objects.filter(
+                        uuid=self._operation.uuid, phase=Operation.RUNNING).update(
+                            lease_expires=Operation.lease_expiry())
+                except Exception as e:
+                    logger.error('failed to renew the lease on operation {}: {}'.format(
+                        self._operation, e))
+                    _close_db_connections()
+        finally:
+            _close_db_connections()
+
+
+def _run(operation):
+    """Carry out an operation, holding on to its lease for as long as it runs."""
+    with _Lease(operation):
+        operation.run()
+
+
+class WorkerPool(object):
+    """A per-process pool of threads draining the operation queue."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._pid = None
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads, once per process."""
+        with self._lock:
+            # threads do not survive a fork, so start a fresh set in every child process
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = []
+            for i in xrange(settings.DEIS_OPERATION_WORKERS):
+                t = threading.Thread(target=self._work, name='operation-worker-{}'.format(i))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        """Stop the worker threads once they have finished the operations they are running."""
+        self._stopping.set()
+        self.notify()
+        for t in self._threads:
+            t.join()
+
+    def notify(self):
+        """Wake up an idle worker to look for new operations."""
+        self._wakeup.set()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                operation = self._claim()
+            except Exception as e:
+                logger.error('failed to claim an operation: {}'.format(e))
+                _close_db_connections()
+                operation = None
+            if operation is None:
+                self._wakeup.wait(settings.DEIS_OPERATION_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            try:
+                _run(operation)
+            except Exception as e:
+                logger.error('failed to run operation {}: {}'.format(operation, e))
+            finally:
+                _close_db_connections()
+
+    def _requeue(self):
+        """Queue running operations again whose worker has stopped renewing their lease."""
+        lapsed = Q(phase=Operation.RUNNING) & (
+            Q(lease_expires__lt=timezone.now()) | Q(lease_expires__isnull=True))
+        for uuid in Operation.objects.filter(lapsed).values_list('uuid', flat=True):
+            if Operation.objects.filter(lapsed, uuid=uuid).update(
+                    phase=Operation.PENDING, lease_expires=None):
+                logger.warning('lease on operation {} lapsed, queued it again'.format(uuid))
+
+    def _claim(self):
+        """Mark the oldest runnable operation as ours and return it, or None if there is none."""
+        self._requeue()
+        # run at most one operation per app at a time
+        busy = Operation.objects.filter(phase=Operation.RUNNING,
+                                        app__isnull=False).values('app')
+        candidates = Operation.objects.filter(phase=Operation.PENDING).exclude(
+            app__in=busy).order_by('created').values_list('uuid', 'app')
+        for uuid, app_id in candidates[:settings.DEIS_OPERATION_WORKERS]:
+            with transaction.atomic():
+                # claims on operations for the same app take turns, so that each one sees
+                # whether another worker has just started running one of them
+                if app_id is not None:
+                    list(App.objects.select_for_update().filter(pk=app_id).values_list('pk'))
+                # another worker may have raced us to it, or to another one for the same app
+                claimed = Operation.objects.filter(
+                    uuid=uuid, phase=Operation.PENDING).exclude(app__in=busy).update(
+                        phase=Operation.RUNNING, lease_expires=Operation.lease_expiry())
+            if claimed:
+                return Operation.objects.get(uuid=uuid)
+
+
+_pool = WorkerPool()
+
+
+def start():
+    """Start this process' operation workers, if any are configured."""
+    if settings.DEIS_OPERATION_WORKERS > 0:
+        _pool.start()
+
+
+def submit(owner, app, type, params=None):
+    """
+    Queue a new operation of the given type and return it.
+
+    With no operation workers configured, the operation is carried out immediately in the calling
+    thread instead.
+    """
+    operation = Operation.objects.create(owner=owner, app=app, type=type, params=params or {})
+    if settings.DEIS_OPERATION_WORKERS > 0:
+        start()
+        _pool.notify()
+    else:
+        _run(operation)
+    return operation
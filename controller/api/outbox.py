@@ -0,0 +1,202 @@
+"""
+Background publisher which applies queued :class:`~api.models.EtcdChange` objects to etcd.
+
+Model changes record what they need changed in etcd in the same database transaction, so that
+requests never wait on etcd and nothing is lost while it is unavailable. Processes serving the
+API publish those changes from a daemon thread; anywhere else they are published right away by
+the process which recorded them. Either way, any process may pick up changes left behind by
+another one.
+"""
+
+from __future__ import unicode_literals
+from datetime import timedelta
+import logging
+import operator
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from api.etcd_client import EtcdUnavailable
+from api.models import EtcdChange, Lease
+
+
+logger = logging.getLogger(__name__)
+
+# seconds a claimed batch of changes is reserved for, should its publisher die part way through
+LEASE = 300
+# upper bound, in seconds, of the delay before a failed change is retried
+MAX_RETRY_INTERVAL = 300
+# attempts at a change which keeps failing, other than for etcd being unavailable, before it is
+# given up on
+MAX_ATTEMPTS = 10
+
+
+def _close_db_connections():
+    for conn in connections.all():
+        conn.close()
+
+
+def _related(path, other):
+    """Return whether either etcd path is, or lies under, the other."""
+    path, other = path.rstrip('/') + '/', other.rstrip('/') + '/'
+    return path.startswith(other) or other.startswith(path)
+
+
+def _put_off(change, until):
+    """Hand a claimed change back, not to be tried again until then."""
+    change.next_attempt, change.claim = until, ''
+    change.save(update_fields=['next_attempt', 'claim', 'updated'])
+
+
+def _retry(change, error):
+    """Put off a change which failed, backing off further every time."""
+    change.attempts += 1
+    change.error = unicode(error)
+    change.next_attempt = timezone.now() + timedelta(
+        seconds=min(2 ** change.attempts, MAX_RETRY_INTERVAL))
+    change.claim = ''
+    change.save(update_fields=['attempts', 'error', 'next_attempt', 'claim', 'updated'])
+    logger.warning('failed to publish {} to etcd: {}'.format(change, error))
+    return change.next_attempt
+
+
+def drain():
+    """
+    Apply the next batch of due changes in order, and return how many were handled.
+
+    Publishers take turns through a :class:`~api.models.Lease`, so changes are applied in the
+    order they were recorded. Changes superseded by a later change to the same path are dropped
+    without being applied. Should etcd be unavailable, the rest of the batch is put off along
+    with the change that failed. Any other failure puts off later changes to the same part of
+    the tree along with it, until it succeeds or is given up on after MAX_ATTEMPTS attempts.
+    """
+    claim = uuid.uuid4().hex
+    if not Lease.acquire('etcd-outbox', claim, LEASE):
+        # another publisher is at it
+        return 0
+    try:
+        return _drain(claim)
+    finally:
+        Lease.release('etcd-outbox', claim)
+
+
+def _drain(claim):
+    now = timezone.now()
+    due = list(EtcdChange.objects.filter(next_attempt__lte=now).values_list(
+        'id', flat=True)[:settings.DEIS_ETCD_OUTBOX_BATCH])
+    if not due:
+        return 0
+    EtcdChange.objects.filter(id__in=due, next_attempt__lte=now).update(
+        claim=claim, next_attempt=now + timedelta(seconds=LEASE))
+    changes = list(EtcdChange.objects.filter(claim=claim))
+    latest = dict(EtcdChange.objects.filter(path__in=set(c.path for c in changes)).values_list(
+        'path').annotate(Max('id')))
+    # changes put off earlier, or left claimed by a publisher which died, hold back later changes
+    # to related paths until they have been applied
+    held = list(EtcdChange.objects.filter(next_attempt__gt=now, id__lt=due[-1]).exclude(
+        claim=claim))
+    done = []
+    for change in changes:
+        if change.id < latest[change.path]:
+            done.append(change)
+            continue
+        # a later change to the same path supersedes the earlier one instead
+        waiting = [c.next_attempt for c in held if c.id < change.id and
+                   c.path != change.path and _related(c.path, change.path)]
+        if waiting:
+            _put_off(change, max(waiting))
+            held.append(change)
+            continue
+        try:
+            change.apply()
+        except EtcdUnavailable as e:
+            retry_at = _retry(change, e)
+            EtcdChange.objects.filter(claim=claim).update(claim='', next_attempt=retry_at)
+            break
+        except Exception as e:
+            _retry(change, e)
+            if change.attempts < MAX_ATTEMPTS:
+                held.append(change)
+                continue
+            logger.error('gave up publishing {} to etcd after {} attempts, run etcd_resync to '
+                         'restore what it was to change'.format(change, change.attempts))
+        done.append(change)
+    if done:
+        # forget what was published, along with anything older for the same paths
+        EtcdChange.objects.filter(reduce(operator.or_, (
+            Q(path=c.path, id__lte=c.id) for c in done))).delete()
+    return len(changes)
+
+
+def _idle_interval():
+    """Return how long to wait for new changes, given when the next waiting change is due."""
+    due = EtcdChange.objects.filter(claim='').aggregate(Min('next_attempt'))['next_attempt__min']
+    if due is None:
+        return settings.DEIS_ETCD_OUTBOX_POLL_INTERVAL
+    wait = (due - timezone.now()).total_seconds()
+    return min(max(wait, 0), settings.DEIS_ETCD_OUTBOX_POLL_INTERVAL)
+
+
+class Publisher(object):
+    """A per-process thread draining the etcd outbox."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._enabled = False
+        self._pid = None
+        self._thread = None
+
+    def start(self):
+        """Start the publisher thread, once per process."""
+        with self._lock:
+            self._enabled = True
+            # threads do not survive a fork, so start a fresh one in every child process
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._work, name='etcd-publisher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def notify(self):
+        """Have newly recorded changes published."""
+        if not self._enabled:
+            drain()
+            return
+        self.start()
+        self._wakeup.set()
+
+    def _work(self):
+        while True:
+            interval = settings.DEIS_ETCD_OUTBOX_POLL_INTERVAL
+            try:
+                handled = drain()
+                if handled < settings.DEIS_ETCD_OUTBOX_BATCH:
+                    interval = _idle_interval()
+            except Exception as e:
+                logger.error('failed to publish changes to etcd: {}'.format(e))
+                handled = 0
+            finally:
+                _close_db_connections()
+            if handled < settings.DEIS_ETCD_OUTBOX_BATCH:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+
+_publisher = Publisher()
+
+
+def start():
+    """Publish changes to etcd from a background thread in this process."""
+    _publisher.start()
+
+
+def notify():
+    """Have newly recorded changes to etcd published."""
+    _publisher.notify()
@@ -0,0 +1,113 @@
+"""
+Cursor pagination for lists of application resources.
+
+A cursor marks the position of an object in a list ordered by (`created`, `pk`), so a page
+is read by seeking to that position through the (app, created) indexes instead of counting
+past every earlier object with an OFFSET. Cursors are opaque to clients: they follow the
+`next` and `previous` links of each page.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from rest_framework.pagination import BasePaginationSerializer
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+
+CURSOR_PARAM = 'cursor'
+
+
+def keyset_ordering(model):
+    """Return the stable ordering of a model's objects which cursors are positions in."""
+    descending = '-created' in model._meta.ordering
+    return ('-created', '-pk') if descending else ('created', 'pk')
+
+
+def encode_cursor(obj, reverse=False):
+    """Return the cursor for the position of an object, reading backwards if `reverse`."""
+    position = [obj.created.isoformat(), str(obj.pk), reverse]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the (created, pk, reverse) position of a cursor, or raise Http404 if invalid."""
+    try:
+        created, pk, reverse = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        created = parse_datetime(created)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        created = None
+    if created is None:
+        raise Http404('Invalid cursor')
+    return created, pk, bool(reverse)
+
+
+class KeysetPage(object):
+    """A page of objects, with the cursors of the pages on either side of it."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+
+def paginate_by_keyset(queryset, cursor, page_size):
+    """
+    Return the page of up to `page_size` objects after the position of a cursor, or before it
+    when the cursor reads backwards. An empty cursor starts from the first object.
+    """
+    ordering = keyset_ordering(queryset.model)
+    created, pk, reverse = decode_cursor(cursor) if cursor else (None, None, False)
+    if reverse:
+        ordering = tuple(f[1:] if f.startswith('-') else '-' + f for f in ordering)
+    queryset = queryset.order_by(*ordering)
+    if created is not None:
+        op = 'lt' if ordering[0].startswith('-') else 'gt'
+        queryset = queryset.filter(Q(**{'created__' + op: created}) |
+                                   Q(**{'created': created, 'pk__' + op: pk}))
+    # read one object more than a page to learn whether there are any more after it
+    object_list = list(queryset[:page_size + 1])
+    more = len(object_list) > page_size
+    object_list = object_list[:page_size]
+    if reverse:
+        object_list.reverse()
+        next_cursor = encode_cursor(object_list[-1]) if object_list else None
+        previous_cursor = encode_cursor(object_list[0], True) if more else None
+    else:
+        next_cursor = encode_cursor(object_list[-1]) if more else None
+        previous_cursor = encode_cursor(object_list[0], True) \
+            if created is not None and object_list else None
+    return KeysetPage(object_list, next_cursor, previous_cursor)
+
+
+class CursorField(serializers.Field):
+    """
+    Field that returns a link to the page at a cursor of a page in paginated results.
+    """
+
+    def __init__(self, attr, **kwargs):
+        self.attr = attr
+        super(CursorField, self).__init__(source='*', **kwargs)
+
+    def to_representation(self, value):
+        cursor = getattr(value, self.attr)
+        if cursor is None:
+            return None
+        request = self.context.get('request')
+        url = request and request.build_absolute_uri() or ''
+        return replace_query_param(url, CURSOR_PARAM, cursor)
+
+
+class KeysetPaginationSerializer(BasePaginationSerializer):
+    """
+    A pagination serializer for cursor pages. Unlike page numbers, they are not counted.
+    """
+    next = CursorField('next_cursor')
+    previous = CursorField('previous_cursor')
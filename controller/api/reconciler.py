@@ -0,0 +1,183 @@
+"""
+Background reconciler which records the state of every container job on the scheduler.
+
+Every DEIS_RECONCILE_INTERVAL seconds, the jobs the scheduler runs are listed in bulk and recorded
+as :class:`~api.models.ContainerStatus` objects. Containers missing from the scheduler and jobs
+which have no container are flagged as drift. Reads of container state are served from these
+records for as long as they are fresh, rather than asking the scheduler each time.
+"""
+
+from __future__ import unicode_literals
+from datetime import timedelta
+import logging
+import operator
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import App, Container, ContainerStatus, Lease, log_event
+import scheduler
+from scheduler.states import JobState
+
+
+logger = logging.getLogger(__name__)
+
+# job states which mean the scheduler no longer runs, or never ran, the job
+GONE = (JobState.initialized, JobState.destroyed)
+# statuses are updated this many at a time
+CHUNK_SIZE = 500
+
+
+def _close_db_connections():
+    for conn in connections.all():
+        conn.close()
+
+
+def _observe(containers):
+    """Return the state of every job on the scheduler which has not gone, keyed by job ID."""
+    client = scheduler.get_client(settings.SCHEDULER_MODULE,
+                                  settings.SCHEDULER_TARGET,
+                                  settings.SCHEDULER_AUTH,
+                                  settings.SCHEDULER_OPTIONS,
+                                  settings.SSH_PRIVATE_KEY)
+    try:
+        states = client.list()
+    except NotImplementedError:
+        # without a listing, jobs which have no container cannot be found
+        states = client.states(list(containers))
+    return {job_id: state for job_id, state in states.items() if state not in GONE}
+
+
+# the fields of a status which are saved when they change
+_fields = operator.attrgetter('app_id', 'container_id', 'state', 'drift')
+
+
+def _app_name(job_id):
+    return scheduler.JOB_NAME.match(job_id).group('app')
+
+
+def _drift(container, state, since):
+    if container is None:
+        return ContainerStatus.ORPHANED
+    # a container created since the last pass may not have reached the scheduler yet
+    if state is None and container.created < since:
+        return ContainerStatus.MISSING
+    return ''
+
+
+def _report(status):
+    if status.drift == ContainerStatus.MISSING:
+        msg = '{} is missing from the scheduler'.format(status.job_id)
+    else:
+        msg = '{} runs on the scheduler without a container'.format(status.job_id)
+    if status.app is not None:
+        log_event(status.app, msg, logging.WARNING)
+    else:
+        logger.warning(msg)
+
+
+def reconcile():
+    """
+    Record the state of every container job on the scheduler, and return the drift found.
+
+    Returns a dict mapping the job ID of each job which drifted to the kind of drift.
+    """
+    now = timezone.now()
+    containers = {c.job_id: c for c in Container.objects.exclude(
+        type='run').select_related('app', 'release')}
+    observed = _observe(containers)
+    statuses = {s.job_id: s for s in ContainerStatus.objects.all()}
+    # one-off run containers come and go without being scaled, so they are never drift
+    orphans = set(job_id for job_id in observed if job_id not in containers and
+                  scheduler.JOB_NAME.match(job_id).group('type') != 'run')
+    apps = {a.id: a for a in App.objects.filter(
+        id__in=set(_app_name(job_id) for job_id in orphans))}
+    since = now - timedelta(seconds=settings.DEIS_RECONCILE_INTERVAL)
+    drift, created = {}, []
+    for job_id in set(containers) | orphans:
+        container, state = containers.get(job_id), observed.get(job_id)
+        # a new status is not served until a later pass, as its container may have been acted
+        # on since it was observed, with no status to forget yet
+        status = statuses.pop(job_id, None) or ContainerStatus(job_id=job_id)
+        before = _fields(status)
+        status.container = container
+        status.app = container.app if container else apps.get(_app_name(job_id))
+        status.state = (state or JobState.destroyed).name
+        status.drift = _drift(container, state, since)
+        if status.drift:
+            drift[job_id] = status.drift
+            if status.drift != before[-1]:
+                _report(status)
+        if status.pk is None:
+            status.seen = now if state else None
+            created.append(status)
+        elif _fields(status) != before:
+            # leave checked alone, as the state may have been forgotten during the pass
+            status.save(update_fields=['app', 'container', 'state', 'drift', 'updated'])
+    # the rest are neither in the database nor on the scheduler any more
+    ContainerStatus.objects.filter(pk__in=[s.pk for s in statuses.values()]).delete()
+    ContainerStatus.objects.bulk_create(created)
+    seen = list(observed)
+    checked = list((set(containers) | orphans) - set(s.job_id for s in created))
+    for i in xrange(0, len(seen), CHUNK_SIZE):
+        ContainerStatus.objects.filter(job_id__in=seen[i:i + CHUNK_SIZE]).update(seen=now)
+    # states forgotten since the pass began, as their containers were acted on, stay forgotten
+    for i in xrange(0, len(checked), CHUNK_SIZE):
+        ContainerStatus.objects.filter(
+            Q(forgotten__isnull=True) | Q(forgotten__lt=now),
+            job_id__in=checked[i:i + CHUNK_SIZE]).update(checked=now)
+    return drift
+
+
+def _due():
+    """
+    Return whether a pass is due, claiming it for this process if so, as any controller process
+    may have made one lately.
+    """
+    return Lease.acquire('reconcile', uuid.uuid4().hex, settings.DEIS_RECONCILE_INTERVAL)
+
+
+class Reconciler(object):
+    """A per-process thread reconciling the database with the scheduler."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+    def start(self):
+        """Start the reconciler thread, once per process."""
+        with self._lock:
+            # threads do not survive a fork, so start a fresh one in every child process
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._work, name='reconciler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            time.sleep(settings.DEIS_RECONCILE_INTERVAL)
+            try:
+                if _due():
+                    reconcile()
+            except Exception as e:
+                logger.error('failed to reconcile containers: {}'.format(e))
+            finally:
+                _close_db_connections()
+
+
+_reconciler = Reconciler()
+
+
+def start():
+    """Start reconciling containers in this process, if a reconcile interval is configured."""
+    if settings.DEIS_RECONCILE_INTERVAL > 0:
+        _reconciler.start()
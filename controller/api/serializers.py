@@ -21,6 +21,7 @@ MEMLIMIT_MATCH = re.compile(r'^(?P<mem>[0-9]+(MB|KB|GB|[BKMG]))$', re.IGNORECASE
 CPUSHARE_MATCH = re.compile(r'^(?P<cpu>[0-9]+)$')
 TAGKEY_MATCH = re.compile(r'^[a-z]+$')
 TAGVAL_MATCH = re.compile(r'^\w+$')
+DEPLOYLIMIT_MATCH = re.compile(r'^[0-9]+%?$')
 
 
 class JSONFieldSerializer(serializers.Field):
@@ -181,6 +182,16 @@ class ConfigSerializer(ModelSerializer):
         """Metadata options for a :class:`ConfigSerializer`."""
         model = models.Config
 
+    def validate_values(self, value):
+        for k in models.DEPLOY_OPTIONS:
+            v = value.get(k)
+            if v is None:  # use NoneType to unset a value
+                continue
+            if not re.match(DEPLOYLIMIT_MATCH, str(v).strip()):
+                raise serializers.ValidationError(
+                    "{} must be a number of containers or a percentage".format(k))
+        return value
+
     def validate_memory(self, value):
         for k, v in value.viewitems():
             if v is None:  # use NoneType to unset a value
@@ -242,6 +253,7 @@ class ContainerSerializer(ModelSerializer):
     created = serializers.DateTimeField(format=settings.DEIS_DATETIME_FORMAT, read_only=True)
     updated = serializers.DateTimeField(format=settings.DEIS_DATETIME_FORMAT, read_only=True)
     release = serializers.SerializerMethodField()
+    state = serializers.SerializerMethodField()
 
     class Meta:
         """Metadata options for a :class:`ContainerSerializer`."""
@@ -251,6 +263,13 @@ class ContainerSerializer(ModelSerializer):
     def get_release(self, obj):
         return "v{}".format(obj.release.version)
 
+    def get_state(self, obj):
+        # prefer states which the view resolved in bulk over asking the scheduler for each row
+        states = self.context.get('states') or {}
+        if obj.job_id in states:
+            return states[obj.job_id]
+        return obj.state
+
 
 class KeySerializer(ModelSerializer):
     """Serialize a :class:`~api.models.Key` model."""
@@ -334,3 +353,21 @@ class PushSerializer(ModelSerializer):
         model = models.Push
         fields = ['uuid', 'owner', 'app', 'sha', 'fingerprint', 'receive_user', 'receive_repo',
                   'ssh_connection', 'ssh_original_command', 'created', 'updated']
+
+
+class OperationSerializer(ModelSerializer):
+    """Serialize a :class:`~api.models.Operation` model."""
+
+    app = serializers.SlugRelatedField(slug_field='id', read_only=True)
+    owner = serializers.ReadOnlyField(source='owner.username')
+    params = JSONFieldSerializer(read_only=True)
+    result = JSONFieldSerializer(read_only=True)
+    created = serializers.DateTimeField(format=settings.DEIS_DATETIME_FORMAT, read_only=True)
+    updated = serializers.DateTimeField(format=settings.DEIS_DATETIME_FORMAT, read_only=True)
+
+    class Meta:
+        """Metadata options for a :class:`OperationSerializer`."""
+        model = models.Operation
+        fields = ['uuid', 'owner', 'app', 'type', 'params', 'phase', 'progress', 'result',
+                  'created', 'updated']
+        read_only_fields = ['type', 'phase', 'progress']
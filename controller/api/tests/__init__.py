@@ -61,3 +61,12 @@ from .test_release import *  # noqa
 from .test_scheduler import *  # noqa
 from .test_users import *  # noqa
 from .test_limits import *  # noqa
+from .test_operation import *  # noqa
+from .test_logs import *  # noqa
+from .test_etcd_client import *  # noqa
+from .test_outbox import *  # noqa
+from .test_etcd_resync import *  # noqa
+from .test_reconciler import *  # noqa
+from .test_query_plans import *  # noqa
+from .test_query_budget import *  # noqa
+from .test_pagination import *  # noqa
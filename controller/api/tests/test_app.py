@@ -16,7 +16,9 @@ from django.contrib.auth.models import User
 from django.test import TestCase
 from rest_framework.authtoken.models import Token
 
+from api.logs import sink
 from api.models import App
+from api.utils import tail
 
 
 def mock_import_repository_task(*args, **kwargs):
@@ -107,6 +109,7 @@ class AppTest(TestCase):
             os.mkdir(settings.DEIS_LOG_DIR)
         path = os.path.join(settings.DEIS_LOG_DIR, app_id + '.log')
         # HACK: remove app lifecycle logs
+        sink.flush()
         if os.path.exists(path):
             os.remove(path)
         url = '/v1/apps/{app_id}/logs'.format(**locals())
@@ -128,9 +131,109 @@ class AppTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data, FAKE_LOG_DATA.splitlines(True)[4])
 
+        # test streaming plain text, and following the log as it grows
+        response = self.client.get(url + "?log_lines=2", HTTP_ACCEPT='text/plain',
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(''.join(response.streaming_content),
+                         ''.join(FAKE_LOG_DATA.splitlines(True)[3:]))
+        with self.settings(DEIS_LOG_FOLLOW_TIMEOUT=0.5):
+            response = self.client.get(url + "?log_lines=1&follow=true",
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            content = iter(response.streaming_content)
+            self.assertEqual(next(content), FAKE_LOG_DATA.splitlines(True)[4])
+            with open(path, 'a') as f:
+                f.write('more\n')
+            self.assertEqual(''.join(content), 'more\n')
+        # each process only lets a few clients follow logs at once
+        with self.settings(DEIS_LOG_FOLLOWERS=1, DEIS_LOG_FOLLOW_TIMEOUT=0):
+            following = self.client.get(url + "?follow=true",
+                                        HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(following.status_code, 200)
+            response = self.client.get(url + "?follow=true",
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 503)
+            # the slot is given up once the response is done
+            ''.join(following.streaming_content)
+            response = self.client.get(url + "?follow=true",
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 200)
+            ''.join(response.streaming_content)
+        response = self.client.get(url + "?log_lines=many",
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 400)
+
+        # test limiting logs to a range of time
+        stamped = ['2015-06-01T12:0{}:00UTC web.1: line {}\n'.format(i, i) for i in xrange(5)]
+        with open(path, 'w') as f:
+            f.write(''.join(stamped))
+        response = self.client.get(url + "?since=2015-06-01T12:01:00Z&until=2015-06-01T12:03:00Z",
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, ''.join(stamped[1:3]))
+        response = self.client.get(url + "?since=2015-06-01T12:02:00&log_lines=1",
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.data, stamped[4])
+        response = self.client.get(url + "?since=yesterday",
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url + "?since=2015-06-01T12:02:00&follow=true",
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 400)
+
+        # test filtering logs
+        lines = ['2015-06-01T12:00:00UTC deis[api]: autotest scaled containers web=2\n',
+                 '2015-06-01T12:00:01UTC {}[web.1]: GET / 200\n'.format(app_id),
+                 '2015-06-01T12:00:02UTC {}[web.2]: GET /a+b 500\n'.format(app_id),
+                 '2015-06-01T12:00:03UTC {}[worker.1]: ERROR timeout\n'.format(app_id)]
+        with open(path, 'w') as f:
+            f.write(''.join(lines))
+        for query, expected in (('source=deis', lines[:1]),
+                                ('source=app', lines[1:]),
+                                ('process=web', lines[1:3]),
+                                ('process=web.2', lines[2:3]),
+                                ('match=/a%2Bb', lines[2:3]),
+                                ('regex=500|ERROR', lines[2:]),
+                                ('regex=500|ERROR&log_lines=1', lines[3:]),
+                                ('source=app&since=2015-06-01T12:00:02Z', lines[2:])):
+            response = self.client.get(url + '?' + query,
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, ''.join(expected), query)
+        # filters look back from the end of the range, so the newest matches are always found
+        with self.settings(DEIS_LOG_SCAN_LIMIT=len(lines[2]) + len(lines[3])):
+            response = self.client.get(url + '?regex=500|ERROR&until=2015-06-01T12:00:04Z',
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.data, ''.join(lines[2:]))
+        for query in ('source=router', 'regex=(', 'regex=(a%2B)%2B$',
+                      'process=web&follow=true'):
+            response = self.client.get(url + '?' + query,
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 400, query)
+
         os.remove(path)
         # TODO: test run needs an initial build
 
+    def test_tail(self):
+        """Test reading the end of a file backwards in blocks"""
+        if not os.path.exists(settings.DEIS_LOG_DIR):
+            os.mkdir(settings.DEIS_LOG_DIR)
+        path = os.path.join(settings.DEIS_LOG_DIR, 'tail-test.log')
+        lines = ['line {}\n'.format(i) for i in xrange(100)]
+        with open(path, 'w') as f:
+            f.write(''.join(lines))
+        for n in (0, 1, 5, 99, 100, 1000):
+            expected = ''.join(lines[-n:] if n else [])
+            self.assertEqual(''.join(tail(path, n, block_size=7)), expected)
+        # a last line without a newline still counts as a line
+        with open(path, 'a') as f:
+            f.write('partial')
+        self.assertEqual(''.join(tail(path, 2, block_size=3)), 'line 99\npartial')
+        os.remove(path)
+        with self.assertRaises(IOError):
+            tail(path, 10)
+
     def test_app_release_notes_in_logs(self):
         """Verifies that an app's release summary is dumped into the logs."""
         url = '/v1/apps'
@@ -17,7 +17,7 @@ import etcd
 from rest_framework.authtoken.models import Token
 
 import api.exceptions
-from api.models import App, Config
+from api.models import App, Config, Container
 
 
 def mock_status_ok(*args, **kwargs):
@@ -50,6 +50,60 @@ class MockEtcdClient:
         }
         return etcd.EtcdResult(None, node)
 
+    def write(self, key, value, **kwargs):
+        pass
+
+    def delete(self, key, **kwargs):
+        pass
+
+    def read(self, key, *args, **kwargs):
+        # every container of the app has been published
+        nodes = [{'key': '/deis/services/{}/{}'.format(self.app, c.job_id),
+                  'value': '127.0.0.1:1234'} for c in Container.objects.filter(app__id=self.app)]
+        result = etcd.EtcdResult(None, {'key': key, 'dir': True, 'nodes': nodes})
+        result.etcd_index = 1
+        return result
+
+
+class DictEtcdClient(object):
+    """Keeps etcd keys in a dict, recording every write and delete."""
+
+    def __init__(self):
+        self.data = {}
+        self.dirs = set()
+        self.calls = []
+
+    def get(self, key, **kwargs):
+        if key not in self.data:
+            raise KeyError(key)
+        return etcd.EtcdResult(None, {'key': key, 'value': self.data[key]})
+
+    def read(self, key, **kwargs):
+        nodes = [{'key': k, 'value': v} for k, v in self.data.items()
+                 if k.startswith(key + '/')]
+        nodes.extend({'key': k, 'dir': True} for k in self.dirs if k.startswith(key + '/'))
+        if not nodes:
+            raise KeyError(key)
+        return etcd.EtcdResult(None, {'key': key, 'dir': True, 'nodes': nodes})
+
+    def write(self, key, value, **kwargs):
+        self.calls.append(('write', key))
+        if 'prevValue' in kwargs and self.data.get(key) != kwargs['prevValue']:
+            raise ValueError('Compare failed')
+        if kwargs.get('dir'):
+            self.dirs.add(key)
+        else:
+            self.data[key] = value.decode('utf-8')
+
+    def delete(self, key, **kwargs):
+        self.calls.append(('delete', key))
+        if not kwargs.get('recursive'):
+            del self.data[key]
+            return
+        for k in [k for k in self.data if k == key or k.startswith(key + '/')]:
+            del self.data[k]
+        self.dirs = set(k for k in self.dirs if k != key and not k.startswith(key + '/'))
+
 
 class ConfigTest(TransactionTestCase):
 
@@ -64,6 +118,8 @@ class ConfigTest(TransactionTestCase):
         response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
         self.assertEqual(response.status_code, 201)
         self.app = App.objects.all()[0]
+        # some tests swap in a mock etcd client
+        self.addCleanup(setattr, api.models, '_etcd_client', api.models._etcd_client)
 
     @mock.patch('requests.post', mock_status_ok)
     def test_config(self):
@@ -512,6 +568,35 @@ class ConfigTest(TransactionTestCase):
         response = self.client.delete(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
         self.assertEqual(response.status_code, 405)
 
+    @mock.patch('api.models.publish_release')
+    def test_deploy_options(self, mock_publish_release):
+        """
+        Test that deploy options are checked when set and are kept out of the app's environment
+        """
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        app_id = response.data['id']
+        url = '/v1/apps/{app_id}/builds'.format(**locals())
+        body = {'image': 'autotest/example'}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        url = '/v1/apps/{app_id}/config'.format(**locals())
+        for value in ('two', '-1', '1.5', '%'):
+            body = {'values': json.dumps({'DEPLOY_MAX_SURGE': value})}
+            response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                        HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 400, value)
+        body = {'values': json.dumps({'DEPLOY_MAX_SURGE': '25%', 'DEPLOY_MAX_UNAVAILABLE': '1',
+                                      'NEW_URL1': 'http://localhost:8080/'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['values']['DEPLOY_MAX_SURGE'], '25%')
+        env = mock_publish_release.call_args[0][1]
+        self.assertEqual(env, {'NEW_URL1': 'http://localhost:8080/'})
+
     def test_config_owner_is_requesting_user(self):
         """
         Ensure that setting the config value is owned by the requesting user
@@ -555,7 +640,7 @@ class ConfigTest(TransactionTestCase):
         return self.client.post(url, json.dumps(body), content_type='application/json',
                                 HTTP_AUTHORIZATION='token {}'.format(self.token))
 
-    @mock.patch('requests.get', mock_status_ok)
+    @mock.patch('requests.Session.get', mock_status_ok)
     @mock.patch('time.sleep', lambda func: func)
     def test_app_healthcheck_good(self):
         """
@@ -566,7 +651,7 @@ class ConfigTest(TransactionTestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(self.app.release_set.latest().version, 3)
 
-    @mock.patch('requests.get', mock_status_not_found)
+    @mock.patch('requests.Session.get', mock_status_not_found)
     @mock.patch('api.models.get_etcd_client', lambda func: func)
     @mock.patch('time.sleep', lambda func: func)
     def test_app_healthcheck_bad(self):
@@ -588,7 +673,7 @@ class ConfigTest(TransactionTestCase):
             self.app.logs().count("app failed health check (got '404', expected: '200')"),
             4)
 
-    @mock.patch('requests.get', mock_status_not_found)
+    @mock.patch('requests.Session.get', mock_status_not_found)
     @mock.patch('api.models.get_etcd_client', lambda func: func)
     @mock.patch('time.sleep')
     def test_app_backoff_interval(self, mock_time):
@@ -610,7 +695,7 @@ class ConfigTest(TransactionTestCase):
                                 HTTP_AUTHORIZATION='token {}'.format(self.token))
         self.assertEqual(mock_time.call_count, 5)
 
-    @mock.patch('requests.get', mock_status_ok)
+    @mock.patch('requests.Session.get', mock_status_ok)
     @mock.patch('time.sleep')
     def test_app_healthcheck_initial_delay(self, mock_time):
         """
@@ -640,7 +725,7 @@ class ConfigTest(TransactionTestCase):
                          HTTP_AUTHORIZATION='token {}'.format(self.token))
         mock_time.assert_called_with(10)
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.get')
     @mock.patch('time.sleep', lambda func: func)
     def test_app_healthcheck_timeout(self, mock_request):
         """
@@ -655,7 +740,7 @@ class ConfigTest(TransactionTestCase):
                          HTTP_AUTHORIZATION='token {}'.format(self.token))
         mock_request.assert_called_with('http://127.0.0.1:1234/', timeout=10)
 
-    @mock.patch('requests.get', mock_request_connection_error)
+    @mock.patch('requests.Session.get', mock_request_connection_error)
     @mock.patch('time.sleep', lambda func: func)
     def test_app_healthcheck_connection_error(self):
         """
@@ -671,3 +756,54 @@ class ConfigTest(TransactionTestCase):
         self.assertEqual(
             response.data,
             {'detail': 'aborting, app containers failed to respond to health check'})
+
+    def test_config_publish_diff(self):
+        """Only config keys which changed or were removed should be sent to etcd."""
+        client = DictEtcdClient()
+        root = '/deis/config/{}/'.format(self.app)
+
+        def set_config(values):
+            url = '/v1/apps/{}/config'.format(self.app)
+            body = {'values': json.dumps(values)}
+            client.calls = []
+            response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                        HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 201)
+
+        with mock.patch('api.models._etcd_client', client):
+            # etcd has nothing for the app yet, so every key is written
+            set_config({'A': '1', 'B': '2', 'C': 'ç'})
+            self.assertEqual(len(client.calls), 3)
+            self.assertEqual(client.data, {root + 'a': '1', root + 'b': '2', root + 'c': 'ç'})
+            set_config({'B': '3', 'C': None})
+            self.assertEqual(sorted(client.calls),
+                             [('delete', root + 'c'), ('write', root + 'b')])
+            self.assertEqual(client.data, {root + 'a': '1', root + 'b': '3'})
+            # publishing again has nothing left to send
+            set_config({})
+            self.assertEqual(client.calls, [])
+
+    def test_app_healthcheck_waits_for_publisher(self):
+        """
+        The controller should watch etcd for the publisher to announce new containers rather than
+        sleeping for a fixed amount of time.
+        """
+        app = self.app
+        release = app.release_set.latest()
+        containers = [Container(app=app, release=release, type='web', num=n) for n in (1, 2)]
+        job_ids = [c.job_id for c in containers]
+        key = '/deis/services/{}'.format(app)
+        # only the first container has been published so far
+        listing = etcd.EtcdResult(None, {'key': key, 'dir': True, 'nodes': [
+            {'key': key + '/' + job_ids[0], 'value': '127.0.0.1:1234'}]})
+        listing.etcd_index = 7
+        change = etcd.EtcdResult('set', {'key': key + '/' + job_ids[1],
+                                         'value': '127.0.0.1:1235', 'modifiedIndex': 8})
+        client = mock.Mock()
+        client.read.side_effect = [listing, change]
+        with mock.patch('api.models._etcd_client', client), mock.patch('time.sleep') as sleep:
+            app._wait_for_services(containers)
+        self.assertFalse(sleep.called)
+        self.assertEqual(client.read.call_count, 2)
+        self.assertEqual(client.read.call_args[1]['waitIndex'], 8)
+        self.assertTrue(client.read.call_args[1]['wait'])
@@ -9,13 +9,18 @@ from __future__ import unicode_literals
 import json
 import mock
 import requests
+import threading
+import time
 
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from scheduler.mock import MockSchedulerClient
 from scheduler.states import TransitionError
 from rest_framework.authtoken.models import Token
 
-from api.models import App, Build, Container, Release
+from api.models import App, Build, Container, Release, _container_executor
 
 
 def mock_import_repository_task(*args, **kwargs):
@@ -170,6 +175,105 @@ class ContainerTest(TransactionTestCase):
         response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
         self.assertEqual(response.status_code, 200)
 
+    def test_container_list_states_in_bulk(self):
+        """Test that listing containers resolves every state with one scheduler call"""
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        app_id = response.data['id']
+        url = "/v1/apps/{app_id}/builds".format(**locals())
+        body = {'image': 'autotest/example', 'sha': 'a'*40,
+                'procfile': json.dumps({'web': 'node server.js', 'worker': 'node worker.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        url = "/v1/apps/{app_id}/scale".format(**locals())
+        body = {'web': 4, 'worker': 2}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 204)
+        url = "/v1/apps/{app_id}/containers".format(**locals())
+        with mock.patch('scheduler.mock.MockSchedulerClient.state') as mock_state, \
+                mock.patch('scheduler.mock.MockSchedulerClient.states',
+                           wraps=MockSchedulerClient('', '', {}, '').states) as mock_states:
+            response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(set(c['state'] for c in response.data['results']), set(['up']))
+        self.assertEqual(mock_states.call_count, 1)
+        self.assertFalse(mock_state.called)
+
+    def test_container_fan_out_is_bounded(self):
+        """Test that an app never has more container operations in flight than allowed"""
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        app = App.objects.get(id=response.data['id'])
+        lock = threading.Lock()
+        counts = {'running': 0, 'peak': 0, 'calls': 0}
+
+        def task():
+            with lock:
+                counts['running'] += 1
+                counts['calls'] += 1
+                counts['peak'] = max(counts['peak'], counts['running'])
+            time.sleep(0.01)
+            with lock:
+                counts['running'] -= 1
+
+        with self.settings(DEIS_APP_CONTAINER_CONCURRENCY=3):
+            app._fan_out([task] * 12)
+        self.assertEqual(counts['calls'], 12)
+        self.assertLessEqual(counts['peak'], 3)
+        # a changed limit applies to the app's next fan-out
+        counts['peak'] = 0
+        with self.settings(DEIS_APP_CONTAINER_CONCURRENCY=1):
+            app._fan_out([task] * 4)
+        self.assertEqual(counts['calls'], 16)
+        self.assertEqual(counts['peak'], 1)
+        # and nothing is kept around for the app once it is done
+        self.assertEqual(_container_executor['slots'], {})
+
+    # with a single slot per app, scheduler calls for the app happen one at a time
+    @override_settings(DEIS_APP_CONTAINER_CONCURRENCY=1)
+    def test_container_start_is_pipelined(self):
+        """Test that each container is started as soon as it has been created"""
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        app_id = response.data['id']
+        url = "/v1/apps/{app_id}/builds".format(**locals())
+        body = {'image': 'autotest/example', 'sha': 'a'*40,
+                'procfile': json.dumps({'web': 'node server.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        calls = []
+        scheduler = MockSchedulerClient('', '', {}, '')
+        real_create, real_start = scheduler.create, scheduler.start
+
+        def create(name, image, command, **kwargs):
+            calls.append(('create', name.split('.')[-1]))
+            real_create(name, image, command, **kwargs)
+
+        def start(name):
+            calls.append(('start', name.split('.')[-1]))
+            real_start(name)
+
+        url = "/v1/apps/{app_id}/scale".format(**locals())
+        body = {'web': 3}
+        with mock.patch('scheduler.mock.MockSchedulerClient.create', side_effect=create), \
+                mock.patch('scheduler.mock.MockSchedulerClient.start', side_effect=start):
+            response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                        HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(calls), 4)
+        # each container is started right after its own create
+        self.assertEqual(calls[0][0], 'create')
+        self.assertEqual(calls[1], ('start', calls[0][1]))
+        self.assertEqual(calls[2][0], 'create')
+        self.assertEqual(calls[3], ('start', calls[2][1]))
+
     @mock.patch('requests.post', mock_import_repository_task)
     def test_container_api_docker(self):
         url = '/v1/apps'
@@ -673,3 +777,74 @@ class ContainerTest(TransactionTestCase):
                                     HTTP_AUTHORIZATION='token {}'.format(self.token))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data), container_set.filter(type='web', num=1).count())
+
+    def test_container_writes_are_bulk(self):
+        """Test that scaling, deploying and tearing down write container rows in bulk"""
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        # the app is loaded before its build is released, and scaling starts from that release
+        app = App.objects.get(id=response.data['id'])
+        url = "/v1/apps/{}/builds".format(app.id)
+        body = {'image': 'autotest/example', 'sha': 'a'*40,
+                'procfile': json.dumps({'web': 'node server.js', 'worker': 'node worker.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+
+        def container_writes(queries):
+            writes = ('INSERT INTO "api_container"', 'UPDATE "api_container"',
+                      'DELETE FROM "api_container"')
+            return [w.split()[0] for q in queries for w in writes if w in q['sql']]
+
+        with CaptureQueriesContext(connection) as queries:
+            app.scale(self.user, {'web': 20, 'worker': 10})
+        self.assertEqual(container_writes(queries), ['INSERT'])
+        self.assertEqual(sorted(app.container_set.filter(type='web').values_list(
+            'num', flat=True)), range(1, 21))
+        # a new release deploys a copy of every container and removes the old ones
+        release = app.release_set.latest()
+        with CaptureQueriesContext(connection) as queries:
+            app.deploy(self.user, release.new(self.user, release.config, release.build))
+        self.assertEqual(container_writes(queries), ['INSERT', 'DELETE'])
+        self.assertEqual(app.container_set.count(), 30)
+        self.assertEqual(set(c.release.version for c in app.container_set.all()),
+                         {release.version + 1})
+        # scaling down removes the newest containers at once
+        with CaptureQueriesContext(connection) as queries:
+            app.scale(self.user, {'web': 5, 'worker': 0})
+        self.assertEqual(container_writes(queries), ['DELETE'])
+        self.assertEqual(sorted(app.container_set.values_list('num', flat=True)), range(1, 6))
+
+    def test_container_queries_are_constant(self):
+        """Test that scaling and deploying make as many queries for few containers as for many"""
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        app_id = response.data['id']
+        url = "/v1/apps/{}/builds".format(app_id)
+        body = {'image': 'autotest/example', 'sha': 'a'*40,
+                'procfile': json.dumps({'web': 'node server.js', 'worker': 'node worker.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+
+        def count_queries(operation, *args):
+            # operations start out from a freshly loaded app
+            app = App.objects.get(id=app_id)
+            with CaptureQueriesContext(connection) as queries:
+                operation(app, *args)
+            return len(queries)
+
+        def deploy(app):
+            release = app.get_latest_release()
+            app.deploy(self.user, release.new(self.user, release.config, release.build))
+
+        few = count_queries(App.scale, self.user, {'web': 2, 'worker': 1})
+        self.assertEqual(count_queries(App.scale, self.user, {'web': 22, 'worker': 11}), few)
+        many = count_queries(deploy)
+        count_queries(App.scale, self.user, {'web': 2, 'worker': 1})
+        self.assertEqual(count_queries(deploy), many)
+        few = count_queries(App.restart)
+        count_queries(App.scale, self.user, {'web': 22, 'worker': 11})
+        self.assertEqual(count_queries(App.restart), few)
@@ -0,0 +1,89 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+import socket
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+import mock
+
+from api.etcd_client import EtcdClient, EtcdUnavailable, _EndpointClient
+
+
+def _closed_port():
+    """Return a local port nothing is listening on."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@override_settings(ETCD_ENDPOINTS=[('etcd-1', 4001), ('etcd-2', 4001), ('etcd-3', 4001)])
+class EtcdClientTest(SimpleTestCase):
+
+    """Tests connecting to etcd lazily and failing over between endpoints"""
+
+    def setUp(self):
+        self.up = set()
+        self.calls = []
+
+        def read(client, key, **kwargs):
+            self.calls.append(client._host)
+            if client._host not in self.up:
+                raise EtcdUnavailable(client._host)
+            return client._host
+        patcher = mock.patch.object(_EndpointClient, 'read', autospec=True, side_effect=read)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connects_lazily(self):
+        client = EtcdClient()
+        self.assertEqual(client._clients, {})
+        self.up.add('etcd-1')
+        self.assertEqual(client.read('/deis'), 'etcd-1')
+        self.assertEqual(list(client._clients), [('etcd-1', 4001)])
+
+    def test_failover(self):
+        client = EtcdClient()
+        self.up.add('etcd-2')
+        self.assertEqual(client.read('/deis'), 'etcd-2')
+        self.assertEqual(self.calls, ['etcd-1', 'etcd-2'])
+        # the endpoint which answered is tried first from then on
+        self.calls = []
+        self.assertEqual(client.read('/deis'), 'etcd-2')
+        self.assertEqual(self.calls, ['etcd-2'])
+        self.up = {'etcd-1'}
+        self.calls = []
+        self.assertEqual(client.read('/deis'), 'etcd-1')
+        self.assertEqual(self.calls, ['etcd-2', 'etcd-3', 'etcd-1'])
+
+    def test_unavailable(self):
+        client = EtcdClient()
+        with self.assertRaises(EtcdUnavailable):
+            client.read('/deis')
+        self.assertEqual(self.calls, ['etcd-1', 'etcd-2', 'etcd-3'])
+        # etcd is left alone for a while once every endpoint has failed
+        self.up.add('etcd-3')
+        self.calls = []
+        with self.assertRaises(EtcdUnavailable):
+            client.read('/deis')
+        self.assertEqual(self.calls, [])
+        with self.settings(DEIS_ETCD_RETRY_INTERVAL=0):
+            client._down_until = 0
+            self.assertEqual(client.read('/deis'), 'etcd-3')
+
+
+class EtcdConnectionTest(SimpleTestCase):
+
+    """Tests talking to an etcd endpoint which is down"""
+
+    def test_connection_refused(self):
+        with self.settings(ETCD_ENDPOINTS=[('127.0.0.1', _closed_port())]):
+            with self.assertRaises(EtcdUnavailable):
+                EtcdClient().write('/deis/test', 'value')
@@ -0,0 +1,94 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TransactionTestCase
+import mock
+
+from api.models import App, Config, Domain, Key
+from api.tests.test_config import DictEtcdClient
+from api.tests.test_key import RSA_PUBKEY
+from api.utils import fingerprint
+
+
+class EtcdResyncTest(TransactionTestCase):
+
+    """Tests publishing the controller's state to a rebuilt etcd"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.etcd = DictEtcdClient()
+        patcher = mock.patch('api.models._etcd_client', self.etcd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = App.objects.create(owner=self.user, id='autotest')
+        Config.objects.create(owner=self.user, app=self.app, values={'FOO': 'old'})
+        Config.objects.create(owner=self.user, app=self.app, values={'FOO': 'bar', 'BAZ': '1'})
+        Domain.objects.create(owner=self.user, app=self.app, domain='autotest.example.com')
+        Key.objects.create(owner=self.user, id='autotest@box.local', public=RSA_PUBKEY)
+        self.expected = {
+            '/deis/builder/users/autotest/{}'.format(fingerprint(RSA_PUBKEY)): RSA_PUBKEY,
+            '/deis/config/autotest/foo': 'bar',
+            '/deis/config/autotest/baz': '1',
+            '/deis/domains/autotest.example.com': 'autotest',
+            '/deis/routing': ('{"certs":[],"domains":{"autotest.example.com":"autotest"},'
+                              '"version":1}'),
+        }
+
+    def _resync(self, **options):
+        self.etcd.calls = []
+        out = StringIO()
+        call_command('etcd_resync', stdout=out, **options)
+        return out.getvalue()
+
+    def test_resync_empty_etcd(self):
+        self.etcd.data, self.etcd.dirs = {}, set()
+        out = self._resync()
+        self.assertEqual(self.etcd.data, self.expected)
+        self.assertEqual(self.etcd.dirs, {'/deis/services/autotest'})
+        self.assertIn('/deis/config: 2 written, 0 removed', out)
+        self.assertIn('Made 6 changes to etcd', out)
+        # etcd is in line with the database now, so there is nothing more to do
+        out = self._resync()
+        self.assertEqual(self.etcd.calls, [])
+        self.assertIn('Made 0 changes to etcd', out)
+
+    def test_resync_stale_etcd(self):
+        self.etcd.data.update({
+            '/deis/config/autotest/foo': 'old',
+            '/deis/config/autotest/gone': 'x',
+            '/deis/config/deleted/foo': 'x',
+            '/deis/domains/deleted.example.com': 'deleted',
+            '/deis/services/deleted/deleted_v1.web.1': '10.0.0.1:5000',
+            '/deis/services/autotest/autotest_v2.web.1': '10.0.0.2:5000',
+        })
+        self.etcd.dirs.add('/deis/services/deleted')
+        self._resync()
+        self.assertEqual(sorted(self.etcd.calls), [
+            ('delete', '/deis/config/autotest/gone'),
+            ('delete', '/deis/config/deleted'),
+            ('delete', '/deis/domains/deleted.example.com'),
+            ('delete', '/deis/services/deleted'),
+            ('write', '/deis/config/autotest/foo'),
+            ('write', '/deis/routing'),
+        ])
+        # containers published by the hosts running them are left alone
+        self.expected['/deis/services/autotest/autotest_v2.web.1'] = '10.0.0.2:5000'
+        self.assertEqual(self.etcd.data, self.expected)
+
+    def test_resync_dry_run(self):
+        self.etcd.data, self.etcd.dirs = {}, set()
+        out = self._resync(dry_run=True)
+        self.assertEqual(self.etcd.calls, [])
+        self.assertEqual(self.etcd.data, {})
+        self.assertIn('Found 6 changes to etcd', out)
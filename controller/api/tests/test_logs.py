@@ -0,0 +1,357 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+import mock
+
+from api import logs
+from api.logs import LogSink, QueueHandler
+
+
+class ListHandler(logging.Handler):
+    """Keeps every record it handles, waiting for go to be set before each one."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.go = threading.Event()
+
+    def emit(self, record):
+        self.go.wait(5)
+        self.records.append(record)
+
+
+@override_settings(DEIS_LOG_FLUSH_INTERVAL=3600)
+class LogSinkTest(SimpleTestCase):
+
+    """Tests buffering writes to app log files"""
+
+    def setUp(self):
+        self.sink = LogSink()
+        self.paths = [os.path.join(settings.DEIS_LOG_DIR, 'sink-test-{}.log'.format(i))
+                      for i in xrange(3)]
+
+    def tearDown(self):
+        for path in self.paths:
+            self.sink.discard(path)
+            if os.path.exists(path):
+                os.remove(path)
+        self.sink.close()
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_writes_are_buffered(self):
+        path = self.paths[0]
+        self.sink.write(path, b'one\n')
+        self.sink.write(path, b'two\n')
+        self.assertFalse(os.path.exists(path))
+        self.sink.flush(path)
+        self.assertEqual(self._read(path), 'one\ntwo\n')
+        with self.settings(DEIS_LOG_BUFFER_SIZE=8):
+            self.sink.write(path, b'three\n')
+            self.sink.write(path, b'four\n')
+        self.assertEqual(self._read(path), 'one\ntwo\nthree\nfour\n')
+
+    def test_open_files_are_bounded(self):
+        with self.settings(DEIS_LOG_OPEN_FILES=2):
+            for path in self.paths:
+                self.sink.write(path, b'line\n')
+                self.sink.flush(path)
+        self.assertEqual(list(self.sink._files), self.paths[1:])
+        # writing to a closed file opens it again
+        self.sink.write(self.paths[0], b'again\n')
+        self.sink.flush()
+        self.assertEqual(self._read(self.paths[0]), 'line\nagain\n')
+
+    def test_removed_file_is_reopened(self):
+        path = self.paths[0]
+        self.sink.write(path, b'before\n')
+        self.sink.flush()
+        os.remove(path)
+        self.sink.write(path, b'after\n')
+        self.sink.flush()
+        self.assertEqual(self._read(path), 'after\n')
+
+
+@override_settings(DEIS_LOG_INDEX_INTERVAL=1024)
+class LogSegmentTest(SimpleTestCase):
+
+    """Tests sealing app logs into indexed segments and reading ranges of time from them"""
+
+    start = datetime(2015, 6, 1)
+
+    def setUp(self):
+        if not os.path.exists(settings.DEIS_LOG_DIR):
+            os.mkdir(settings.DEIS_LOG_DIR)
+        self.path = os.path.join(settings.DEIS_LOG_DIR, 'segment-test.log')
+        self.minute = 0
+
+    def tearDown(self):
+        logs.remove(self.path)
+
+    def _write(self, count):
+        """Append count lines to the log, one minute apart, and return them."""
+        lines = []
+        for _ in xrange(count):
+            stamp = self.start + timedelta(minutes=self.minute)
+            lines.append('{}UTC deis[api]: line {}\n'.format(
+                stamp.strftime('%Y-%m-%dT%H:%M:%S'), self.minute).encode('utf-8'))
+            self.minute += 1
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(lines))
+        return lines
+
+    def _at(self, minutes):
+        return self.start + timedelta(minutes=minutes)
+
+    def test_seal(self):
+        lines = self._write(120)
+        segment = logs.seal(self.path)
+        self.assertEqual(logs.segments(self.path), [segment])
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(list(logs._read_segment(segment)), lines)
+        # every member of the segment can be read on its own
+        with open(logs._index_path(segment)) as f:
+            index = json.load(f)
+        self.assertEqual(index['start'], '2015-06-01T00:00:00')
+        self.assertEqual(index['end'], '2015-06-01T01:59:00')
+        self.assertGreater(len(index['members']), 1)
+        stamp, offset = index['members'][-1][:2]
+        self.assertEqual(next(logs._read_segment(segment, offset))[:19], stamp)
+        # an empty log is left alone
+        self.assertIsNone(logs.seal(self.path))
+        self.assertEqual(logs.segments(self.path), [segment])
+
+    def test_read_range(self):
+        lines = self._write(120)
+        logs.seal(self.path)
+        lines += self._write(120)
+        logs.seal(self.path)
+        lines += self._write(120)
+        self.assertEqual(list(logs.read(self.path)), lines)
+        self.assertEqual(list(logs.read(self.path, self._at(100), self._at(300))),
+                         lines[100:300])
+        self.assertEqual(list(logs.read(self.path, since=self._at(250))), lines[250:])
+        self.assertEqual(list(logs.read(self.path, until=self._at(30))), lines[:30])
+        aware = timezone.make_aware(self._at(150), timezone.utc)
+        self.assertEqual(list(logs.read(self.path, since=aware)), lines[150:])
+        self.assertEqual(list(logs.read(self.path, since=self._at(1000))), [])
+        with self.assertRaises(IOError):
+            logs.read(self.path + '.missing')
+
+    def test_read_seeks_to_range(self):
+        self._write(120)
+        first = logs.seal(self.path)
+        self._write(120)
+        second = logs.seal(self.path)
+        self._write(20)
+        with mock.patch('api.logs._read_segment', wraps=logs._read_segment) as read_segment:
+            list(logs.read(self.path, self._at(200), self._at(210)))
+        # the first segment is skipped and the second is read from a member near the range
+        self.assertEqual(len(read_segment.call_args_list), 1)
+        segment, offset = read_segment.call_args[0]
+        self.assertEqual(segment, second)
+        self.assertGreater(offset, 0)
+        self.assertNotEqual(first, second)
+
+    def test_old_segments_are_pruned(self):
+        with self.settings(DEIS_LOG_SEGMENTS=2):
+            for _ in xrange(3):
+                self._write(10)
+                logs.seal(self.path)
+        self.assertEqual(len(logs.segments(self.path)), 2)
+        self.assertEqual(next(logs.read(self.path))[:19], '2015-06-01T00:10:00')
+
+    def test_rotate(self):
+        self._write(10)
+        with self.settings(DEIS_LOG_SEGMENT_SIZE=1024):
+            self.assertIsNone(logs.rotate(self.path))
+            self._write(100)
+            segment = logs.rotate(self.path).result()
+        self.assertEqual(logs.segments(self.path), [segment])
+        # the sink rotates logs it writes to as well
+        sink = LogSink()
+        with self.settings(DEIS_LOG_SEGMENT_SIZE=8):
+            sink.write(self.path, b'more than eight bytes\n')
+            sink.flush()
+        sink.close()
+        logs.wait_sealed()
+        self.assertEqual(len(logs.segments(self.path)), 2)
+        self.assertTrue(all(s.endswith('.gz') for s in logs.segments(self.path)))
+
+    def test_set_aside_log_is_read_until_sealed(self):
+        lines = self._write(120)
+        raw = logs._set_aside(self.path)
+        lines += self._write(10)
+        self.assertEqual(logs.segments(self.path), [raw])
+
+        def check():
+            self.assertEqual(list(logs.read(self.path)), lines)
+            self.assertEqual(list(logs.read(self.path, self._at(100), self._at(125))),
+                             lines[100:125])
+            self.assertEqual(list(logs.backwards(self.path)), lines[::-1])
+            self.assertEqual(b''.join(logs.tail(self.path, 15)), b''.join(lines[-15:]))
+
+        check()
+        # once sealed, its segment is read instead
+        segment = logs._seal(self.path, raw)
+        self.assertEqual(logs.segments(self.path), [segment])
+        check()
+
+    def test_read_lines_out_of_order(self):
+        # two processes wrote out their buffers a few seconds apart
+        stamps = [self.start + timedelta(seconds=s) for s in xrange(0, 2000, 10)]
+        for i in xrange(0, len(stamps) - 1, 2):
+            stamps[i], stamps[i + 1] = stamps[i + 1], stamps[i]
+        lines = ['{}UTC deis[api]: line\n'.format(
+            s.strftime('%Y-%m-%dT%H:%M:%S')).encode('utf-8') for s in stamps]
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(lines[:100]))
+        with self.settings(DEIS_LOG_INDEX_INTERVAL=256, DEIS_LOG_MAX_DISORDER=10):
+            logs.seal(self.path)
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(lines[100:]))
+            for since, until in ((500, 700), (990, 1010), (1500, 1800)):
+                since, until = self._at(0) + timedelta(seconds=since), \
+                    self._at(0) + timedelta(seconds=until)
+                expected = [l for l, s in zip(lines, stamps) if since <= s < until]
+                self.assertEqual(list(logs.read(self.path, since, until)), expected)
+                self.assertEqual(list(logs.backwards(self.path, since, until)), expected[::-1])
+
+    def test_tail_reaches_into_segments(self):
+        lines = self._write(20)
+        logs.seal(self.path)
+        lines += self._write(2)
+        self.assertEqual(b''.join(logs.tail(self.path, 5)), b''.join(lines[-5:]))
+        self.assertEqual(b''.join(logs.tail(self.path, 1)), lines[-1])
+        self.assertEqual(b''.join(logs.tail(self.path, 100)), b''.join(lines))
+
+    def test_backwards(self):
+        lines = self._write(120)
+        logs.seal(self.path)
+        lines += self._write(120)
+        logs.seal(self.path)
+        lines += self._write(120)
+        self.assertEqual(list(logs.backwards(self.path)), lines[::-1])
+        self.assertEqual(list(logs.backwards(self.path, self._at(100), self._at(300))),
+                         lines[299:99:-1])
+        self.assertEqual(list(logs.backwards(self.path, since=self._at(250))), lines[:249:-1])
+        self.assertEqual(list(logs.backwards(self.path, until=self._at(30))), lines[29::-1])
+        self.assertEqual(list(logs.backwards(self.path, since=self._at(1000))), [])
+        with self.assertRaises(IOError):
+            logs.backwards(self.path + '.missing')
+
+    def test_backwards_reads_only_what_is_needed(self):
+        lines = self._write(120)
+        logs.seal(self.path)
+        lines += self._write(120)
+        second = logs.seal(self.path)
+        lines += self._write(120)
+        with mock.patch('api.logs._segment_backwards',
+                        wraps=logs._segment_backwards) as segment_backwards:
+            found = list(itertools.islice(logs.backwards(self.path, until=self._at(200)), 10))
+            self.assertEqual(found, lines[199:189:-1])
+            self.assertEqual(list(logs.backwards(self.path, self._at(130), self._at(140))),
+                             lines[139:129:-1])
+        # the first segment is never read, and the second only up to the members needed
+        self.assertEqual([c[0][0] for c in segment_backwards.call_args_list], [second] * 2)
+
+
+class GrepTest(SimpleTestCase):
+
+    """Tests filtering app log lines"""
+
+    lines = [
+        b'2015-06-01T12:00:00UTC deis[api]: autotest created initial release\n',
+        b'2015-06-01T12:00:01UTC myapp[web.1]: GET /200.html 200\n',
+        b'2015-06-01T12:00:02UTC myapp[web.12]: GET /500.html 500\n',
+        b'2015-06-01T12:00:03UTC myapp[worker.1]: ERROR: could not connect\n',
+        b'  continued without a prefix\n',
+    ]
+
+    def grep(self, **kwargs):
+        return [self.lines.index(l) for l in logs.grep(self.lines, **kwargs)]
+
+    def test_filters(self):
+        self.assertEqual(self.grep(), [0, 1, 2, 3, 4])
+        self.assertEqual(self.grep(tag='deis'), [0])
+        self.assertEqual(self.grep(tag='myapp'), [1, 2, 3])
+        self.assertEqual(self.grep(process='web'), [1, 2])
+        self.assertEqual(self.grep(process='web.1'), [1])
+        self.assertEqual(self.grep(pattern=re.compile(b'ERROR|500')), [2, 3])
+        self.assertEqual(self.grep(tag='myapp', process='worker', pattern=re.compile(b'ERROR')),
+                         [3])
+
+    def test_scan_limit(self):
+        limit = sum(len(l) for l in self.lines[:2])
+        self.assertEqual(self.grep(limit=limit), [0, 1])
+        self.assertEqual(self.grep(limit=limit, process='web.12'), [])
+
+    def test_timeout(self):
+        with mock.patch('api.logs.time.time', side_effect=itertools.count()):
+            self.assertEqual(self.grep(timeout=2.5), [0, 1])
+
+    def test_compile_pattern(self):
+        for pattern in (br'ERROR|500', br'GET \S+ 5\d{2}', br'\d{3} \d+ms', br'(?i)(a|b)*c',
+                        br'https?://\S+', re.escape(b'/a+b?')):
+            self.assertIsNotNone(logs.compile_pattern(pattern))
+        for pattern in (br'(', br'(a+)+$', br'(?:.*){3}x', br'(\w+)\1', br'a(?=b)', br'(?!a)',
+                        br'(a|bc)*', br'.*a.*b', br'.*.*=', br'\d+ \d{1,3}ms'):
+            with self.assertRaises(ValueError):
+                logs.compile_pattern(pattern)
+        self.assertEqual(self.grep(pattern=logs.compile_pattern(b'worker')), [3])
+
+    def test_adversarial_pattern_on_a_long_line(self):
+        line = b'x' * 100000
+        with self.assertRaises(ValueError):
+            logs.compile_pattern(br'.*.*=')
+        # the one repeat allowed backtracks over the start of the line only
+        start = time.time()
+        self.assertEqual(list(logs.grep([line], pattern=logs.compile_pattern(br'.*='))), [])
+        self.assertLess(time.time() - start, 1)
+
+
+class QueueHandlerTest(SimpleTestCase):
+
+    """Tests handing log records to a handler on a background thread"""
+
+    def test_records_are_handed_over(self):
+        handler = QueueHandler('api.tests.test_logs.ListHandler')
+        record = logging.makeLogRecord({'msg': 'hello'})
+        # emitting does not wait for the target
+        handler.emit(record)
+        self.assertEqual(handler.target.records, [])
+        handler.target.go.set()
+        handler.flush()
+        self.assertEqual(handler.target.records, [record])
+
+    def test_full_queue_drops_records(self):
+        handler = QueueHandler('api.tests.test_logs.ListHandler', maxsize=1)
+        records = [logging.makeLogRecord({'msg': str(i)}) for i in xrange(5)]
+        for record in records:
+            handler.emit(record)
+        handler.target.go.set()
+        handler.flush()
+        handled = [r.getMessage() for r in handler.target.records]
+        self.assertIn('0', handled)
+        self.assertLess(len(handled), 5)
+        self.assertIn('dropped', handled[-2])
@@ -0,0 +1,252 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import json
+import mock
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import operations
+from api.models import App, Operation
+
+
+@override_settings(DEIS_OPERATION_WORKERS=0)
+class OperationTest(TransactionTestCase):
+
+    """Tests asynchronous operations on applications"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.token = Token.objects.get(user=self.user).key
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        self.app_id = response.data['id']
+        url = "/v1/apps/{self.app_id}/builds".format(**locals())
+        body = {'image': 'autotest/example', 'sha': 'a'*40,
+                'procfile': json.dumps({'web': 'node server.js', 'worker': 'node worker.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+
+    def test_scale_async(self):
+        url = "/v1/apps/{self.app_id}/scale".format(**locals())
+        body = {'web': 4}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['type'], 'scale')
+        self.assertEqual(response.data['app'], self.app_id)
+        self.assertEqual(response.data['params'], {'structure': {'web': 4}})
+        uuid = response.data['uuid']
+        self.assertTrue(response['Location'].endswith('/v1/operations/{}'.format(uuid)))
+        # follow the operation until it is done
+        url = '/v1/operations/{}'.format(uuid)
+        response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['phase'], 'succeeded')
+        self.assertIn('scaled containers web=4', response.data['progress'])
+        url = "/v1/apps/{self.app_id}/containers".format(**locals())
+        response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(len(response.data['results']), 4)
+        response = self.client.get('/v1/operations',
+                                   HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_scale_async_failure(self):
+        url = "/v1/apps/{self.app_id}/scale".format(**locals())
+        body = {'nope': 1}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        operation = Operation.objects.get(uuid=response.data['uuid'])
+        self.assertEqual(operation.phase, Operation.FAILED)
+        self.assertEqual(operation.result,
+                         {'detail': 'Container type nope does not exist in application'})
+
+    def test_build_and_config_async(self):
+        url = "/v1/apps/{self.app_id}/builds".format(**locals())
+        body = {'image': 'autotest/example', 'sha': 'b'*40,
+                'procfile': json.dumps({'web': 'node server.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['type'], 'build')
+        self.assertEqual(response.data['result'], {'release': 3})
+        url = "/v1/apps/{self.app_id}/config".format(**locals())
+        body = {'values': json.dumps({'NEW_URL1': 'http://localhost:8080/'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Deis-Release'], '4')
+        self.assertEqual(response.data['type'], 'deploy')
+        self.assertEqual(response.data['phase'], 'succeeded')
+
+    def test_restart_async(self):
+        url = "/v1/apps/{self.app_id}/containers/web/restart".format(**locals())
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['params'], {'type': 'web'})
+        self.assertEqual(response.data['phase'], 'succeeded')
+        self.assertEqual(response.data['result'],
+                         {'containers': ['{}.web.1'.format(self.app_id)]})
+
+    def test_destroy_async(self):
+        url = "/v1/apps/{self.app_id}".format(**locals())
+        response = self.client.delete(url, HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                      HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['type'], 'destroy')
+        self.assertFalse(App.objects.filter(id=self.app_id).exists())
+        # the operation outlives the app it deleted
+        url = '/v1/operations/{}'.format(response.data['uuid'])
+        response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['phase'], 'succeeded')
+        self.assertEqual(response.data['app'], None)
+
+    def test_operation_owner(self):
+        url = "/v1/apps/{self.app_id}/scale".format(**locals())
+        body = {'web': 2}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        url = '/v1/operations/{}'.format(response.data['uuid'])
+        unauthorized_user = User.objects.get(username='autotest2')
+        unauthorized_token = Token.objects.get(user=unauthorized_user).key
+        response = self.client.get(url,
+                                   HTTP_AUTHORIZATION='token {}'.format(unauthorized_token))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DEIS_OPERATION_WORKERS=2, DEIS_OPERATION_POLL_INTERVAL=0.1)
+class OperationWorkerTest(TransactionTestCase):
+
+    """Tests operation workers claiming and running queued operations"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.token = Token.objects.get(user=self.user).key
+        url = '/v1/apps'
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        self.app = App.objects.get(id=response.data['id'])
+        url = "/v1/apps/{}/builds".format(self.app.id)
+        body = {'image': 'autotest/example', 'sha': 'a'*40,
+                'procfile': json.dumps({'web': 'node server.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        # run this test's own workers, and stop them before the next test
+        self.pool = operations.WorkerPool()
+        patcher = mock.patch('api.operations._pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.pool.stop)
+
+    def queue(self, app=None):
+        return Operation.objects.create(owner=self.user, app=app or self.app, type='restart')
+
+    def restart_async(self):
+        url = "/v1/apps/{}/containers/restart".format(self.app.id)
+        response = self.client.post(url, HTTP_AUTHORIZATION='token {}'.format(self.token),
+                                    HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        return response.data['uuid']
+
+    def wait(self, uuid, timeout=30):
+        """Wait for an operation to be done, and return it."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            operation = Operation.objects.get(uuid=uuid)
+            if operation.phase in (Operation.SUCCEEDED, Operation.FAILED):
+                return operation
+            time.sleep(0.05)
+        self.fail('operation {} is still {}'.format(uuid, operation.phase))
+
+    def test_claim(self):
+        other = App.objects.create(owner=self.user, id='autotest-other')
+        first, second, third = self.queue(), self.queue(), self.queue(app=other)
+        self.assertEqual(self.pool._claim(), first)
+        # the app's next operation waits for the first one, but other apps' do not
+        self.assertEqual(self.pool._claim(), third)
+        self.assertIsNone(self.pool._claim())
+        first.run()
+        self.assertEqual(self.pool._claim(), second)
+
+    def test_lapsed_lease_is_requeued(self):
+        # a worker died while running an operation, which blocks the app's later ones
+        crashed, later = self.queue(), self.queue()
+        Operation.objects.filter(uuid=crashed.uuid).update(
+            phase=Operation.RUNNING, lease_expires=timezone.now() - timedelta(seconds=1))
+        claimed = self.pool._claim()
+        self.assertEqual(claimed, crashed)
+        self.assertGreater(claimed.lease_expires, timezone.now())
+        self.assertIsNone(self.pool._claim())
+        claimed.run()
+        self.assertEqual(self.pool._claim(), later)
+
+    def test_workers_run_operations_of_an_app_in_turn(self):
+        runs, lock = [], threading.Lock()
+        restart = App.restart
+
+        def slow_restart(app, **kwargs):
+            started = time.time()
+            time.sleep(0.2)
+            containers = restart(app, **kwargs)
+            with lock:
+                runs.append((started, time.time()))
+            return containers
+
+        with mock.patch.object(App, 'restart', slow_restart):
+            uuids = [self.restart_async() for _ in xrange(3)]
+            for uuid in uuids:
+                self.assertEqual(self.wait(uuid).phase, Operation.SUCCEEDED)
+        self.assertEqual(len(runs), 3)
+        runs.sort()
+        for (_, finished), (started, _) in zip(runs, runs[1:]):
+            self.assertGreaterEqual(started, finished)
+
+    @override_settings(DEIS_OPERATION_LEASE=0.6)
+    def test_lease_is_renewed_while_running(self):
+        restart = App.restart
+        calls = []
+
+        def slow_restart(app, **kwargs):
+            calls.append(app)
+            time.sleep(1.5)
+            return restart(app, **kwargs)
+
+        with mock.patch.object(App, 'restart', slow_restart):
+            uuid = self.restart_async()
+            while Operation.objects.get(uuid=uuid).phase == Operation.PENDING:
+                time.sleep(0.05)
+            # another worker never takes over the operation while it is still being run
+            while Operation.objects.get(uuid=uuid).phase == Operation.RUNNING:
+                self.assertIsNone(operations.WorkerPool()._claim())
+                time.sleep(0.1)
+        self.assertEqual(Operation.objects.get(uuid=uuid).phase, Operation.SUCCEEDED)
+        self.assertEqual(len(calls), 1)
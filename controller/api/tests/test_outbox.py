@@ -0,0 +1,242 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, DatabaseError
+from django.test import TransactionTestCase
+from django.utils import timezone
+import mock
+from rest_framework.authtoken.models import Token
+
+from api import outbox
+from api.etcd_client import EtcdUnavailable
+from api.models import App, Domain, EtcdChange, Lease
+from api.tests.test_config import DictEtcdClient
+
+
+class OutboxTest(TransactionTestCase):
+
+    """Tests publishing model changes to etcd through the outbox"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.token = Token.objects.get(user=self.user).key
+        self.etcd = DictEtcdClient()
+        self.down = mock.Mock()
+        for method in ('read', 'write', 'delete'):
+            getattr(self.down, method).side_effect = EtcdUnavailable('etcd is down')
+
+    def _post(self, url, body=None):
+        response = self.client.post(url, json.dumps(body or {}), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def _recover(self):
+        """Bring etcd back and publish everything that is waiting."""
+        EtcdChange.objects.update(next_attempt=timezone.now())
+        with mock.patch('api.models._etcd_client', self.etcd):
+            while outbox.drain():
+                pass
+
+    def test_changes_survive_etcd_outage(self):
+        with mock.patch('api.models._etcd_client', self.down):
+            app_id = self._post('/v1/apps').data['id']
+            self._post('/v1/apps/{}/config'.format(app_id),
+                       {'values': json.dumps({'FOO': 'bar'})})
+        # nothing was lost, and the first failure put the rest off rather than trying each one
+        changes = list(EtcdChange.objects.all())
+        # the new app's initial config is queued alongside the one we set
+        self.assertEqual([c.path for c in changes], ['/deis/services/{}'.format(app_id),
+                                                     '/deis/config/{}'.format(app_id),
+                                                     '/deis/config/{}'.format(app_id)])
+        self.assertTrue(all(c.next_attempt > timezone.now() for c in changes))
+        self.assertEqual(changes[0].attempts, 1)
+        self.assertIn('etcd is down', changes[0].error)
+        self.assertEqual(self.down.write.call_count, 1)
+        self._recover()
+        self.assertEqual(EtcdChange.objects.count(), 0)
+        self.assertEqual(self.etcd.data, {'/deis/config/{}/foo'.format(app_id): 'bar'})
+        self.assertEqual(self.etcd.calls, [('write', '/deis/services/{}'.format(app_id)),
+                                           ('write', '/deis/config/{}/foo'.format(app_id))])
+
+    def test_changes_to_a_path_coalesce(self):
+        with mock.patch('api.models._etcd_client', self.down):
+            app_id = self._post('/v1/apps').data['id']
+            for i in range(3):
+                self._post('/v1/apps/{}/config'.format(app_id),
+                           {'values': json.dumps({'FOO': str(i), 'BAR{}'.format(i): 'x'})})
+        self.assertEqual(EtcdChange.objects.filter(action=EtcdChange.CONFIG).count(), 4)
+        self._recover()
+        # only the latest config was published
+        root = '/deis/config/{}/'.format(app_id)
+        self.assertEqual(self.etcd.data, {root + 'foo': '2', root + 'bar0': 'x',
+                                          root + 'bar1': 'x', root + 'bar2': 'x'})
+        self.assertEqual(len([c for c in self.etcd.calls if c[1].startswith(root)]), 4)
+
+    def test_failed_change_backs_off(self):
+        broken = mock.Mock()
+        broken.read.side_effect = KeyError
+        broken.write.side_effect = ValueError('bad value')
+        with mock.patch('api.models._etcd_client', broken):
+            self._post('/v1/apps')
+            change = EtcdChange.objects.get(action=EtcdChange.WRITE)
+            self.assertEqual(change.attempts, 1)
+            self.assertEqual(change.error, 'bad value')
+            self.assertEqual(change.claim, '')
+            # it is not due again yet
+            self.assertEqual(outbox.drain(), 0)
+            EtcdChange.objects.update(next_attempt=timezone.now())
+            self.assertEqual(outbox.drain(), 1)
+        change = EtcdChange.objects.get(action=EtcdChange.WRITE)
+        self.assertEqual(change.attempts, 2)
+        self.assertGreater(change.next_attempt, timezone.now())
+
+    def _queue(self, *changes):
+        for action, path in changes:
+            EtcdChange.objects.create(path=path, action=action, value='x',
+                                      options={'recursive': True} if action == 'delete' else {})
+
+    def test_failed_change_holds_back_related_paths(self):
+        self.etcd.data['/deis/certs/x/key'] = 'x'
+        broken = mock.Mock(wraps=self.etcd)
+
+        def write(key, value, **kwargs):
+            if key.endswith('/cert'):
+                raise ValueError('bad cert')
+            return self.etcd.write(key, value, **kwargs)
+
+        broken.write.side_effect = write
+        self._queue((EtcdChange.WRITE, '/deis/certs/x/cert'),
+                    (EtcdChange.DELETE, '/deis/certs/x'),
+                    (EtcdChange.WRITE, '/deis/certsandmore'))
+        with mock.patch('api.models._etcd_client', broken):
+            self.assertEqual(outbox.drain(), 3)
+        # the delete waits for the write before it, while unrelated changes carry on
+        self.assertEqual(broken.delete.call_count, 0)
+        self.assertEqual(broken.write.call_count, 2)
+        write, delete = EtcdChange.objects.all()
+        self.assertEqual(write.attempts, 1)
+        self.assertEqual(delete.next_attempt, write.next_attempt)
+        self._recover()
+        # the write did not come back after the delete
+        self.assertEqual(self.etcd.data, {'/deis/certsandmore': 'x'})
+        self.assertEqual(EtcdChange.objects.count(), 0)
+
+    def test_failing_change_is_given_up(self):
+        broken = mock.Mock(wraps=self.etcd)
+        broken.write.side_effect = ValueError('bad value')
+        self._queue((EtcdChange.WRITE, '/deis/domains/x'),
+                    (EtcdChange.DELETE, '/deis/domains'))
+        with mock.patch('api.models._etcd_client', broken), \
+                mock.patch('api.outbox.MAX_ATTEMPTS', 2):
+            outbox.drain()
+            self.assertEqual(EtcdChange.objects.count(), 2)
+            EtcdChange.objects.update(next_attempt=timezone.now())
+            outbox.drain()
+            # the second failure was the last, and the delete was let through
+            self.assertEqual(broken.write.call_count, 2)
+            self.assertEqual(broken.delete.call_count, 1)
+        self.assertEqual(EtcdChange.objects.count(), 0)
+
+    def test_publishers_take_turns(self):
+        self._queue((EtcdChange.WRITE, '/deis/domains/x'))
+        self.assertTrue(Lease.acquire('etcd-outbox', 'elsewhere', 60))
+        with mock.patch('api.models._etcd_client', self.etcd):
+            self.assertEqual(outbox.drain(), 0)
+            Lease.release('etcd-outbox', 'elsewhere')
+            self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(self.etcd.data, {'/deis/domains/x': 'x'})
+
+    def test_changes_commit_with_model_changes(self):
+        with mock.patch('api.models._etcd_client', self.etcd):
+            app = App.objects.create(owner=self.user, id='autotest')
+            with mock.patch('api.models.EtcdChange.objects.create',
+                            side_effect=DatabaseError('crashed')):
+                with self.assertRaises(DatabaseError):
+                    Domain.objects.create(owner=self.user, app=app, domain='autotest.example.com')
+        # the domain was rolled back along with its change to etcd
+        self.assertFalse(Domain.objects.filter(domain='autotest.example.com').exists())
+
+    def test_publisher_is_told_once_committed(self):
+        def committed():
+            self.assertFalse(connection.in_atomic_block)
+            self.assertEqual(EtcdChange.objects.filter(path__contains='example.com').count(), 1)
+
+        with mock.patch('api.models._etcd_client', self.etcd):
+            app = App.objects.create(owner=self.user, id='autotest')
+            with mock.patch('api.outbox.notify', side_effect=committed) as notify:
+                Domain.objects.create(owner=self.user, app=app, domain='autotest.example.com')
+        # once for the domain and the routing snapshot together
+        self.assertEqual(notify.call_count, 1)
+
+
+class RoutingSnapshotTest(TransactionTestCase):
+
+    """Tests publishing the routing snapshot once per batch of domain and certificate changes"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.etcd = DictEtcdClient()
+        patcher = mock.patch('api.models._etcd_client', self.etcd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = App.objects.create(owner=self.user, id='autotest')
+
+    def _publish(self):
+        self.etcd.calls = []
+        EtcdChange.objects.update(next_attempt=timezone.now())
+        while outbox.drain():
+            pass
+        return [c for c in self.etcd.calls if c[1] == settings.DEIS_ROUTING_SNAPSHOT_KEY]
+
+    def _snapshot(self):
+        return json.loads(self.etcd.data[settings.DEIS_ROUTING_SNAPSHOT_KEY])
+
+    def test_snapshot_published_once_per_batch(self):
+        for i in range(3):
+            Domain.objects.create(owner=self.user, app=self.app,
+                                  domain='{}.example.com'.format(i))
+        # the rebuild waits for more changes to come along
+        self.assertNotIn(settings.DEIS_ROUTING_SNAPSHOT_KEY, self.etcd.data)
+        pending = EtcdChange.objects.filter(action=EtcdChange.SNAPSHOT)
+        self.assertEqual(len(set(pending.values_list('next_attempt', flat=True))), 1)
+        self.assertEqual(self._publish(), [('write', settings.DEIS_ROUTING_SNAPSHOT_KEY)])
+        self.assertEqual(self._snapshot(), {
+            'version': 1, 'certs': [],
+            'domains': {'0.example.com': 'autotest', '1.example.com': 'autotest',
+                        '2.example.com': 'autotest'}})
+        Domain.objects.get(domain='1.example.com').delete()
+        self.assertEqual(len(self._publish()), 1)
+        self.assertEqual(self._snapshot()['version'], 2)
+        self.assertNotIn('1.example.com', self._snapshot()['domains'])
+
+    def test_unchanged_snapshot_not_published(self):
+        Domain.objects.create(owner=self.user, app=self.app, domain='autotest.example.com')
+        self._publish()
+        Domain.objects.create(owner=self.user, app=self.app, domain='other.example.com')
+        Domain.objects.get(domain='other.example.com').delete()
+        self.assertEqual(self._publish(), [])
+        self.assertEqual(self._snapshot()['version'], 1)
+
+    def test_snapshot_version_follows_published(self):
+        # the key was published by another controller, or before etcd was restored
+        self.etcd.data[settings.DEIS_ROUTING_SNAPSHOT_KEY] = json.dumps(
+            {'version': 5, 'certs': [], 'domains': {}})
+        Domain.objects.create(owner=self.user, app=self.app, domain='autotest.example.com')
+        self._publish()
+        self.assertEqual(self._snapshot(), {
+            'version': 6, 'certs': [], 'domains': {'autotest.example.com': 'autotest'}})
+        self.assertEqual(EtcdChange.objects.count(), 0)
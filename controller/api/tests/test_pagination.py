@@ -0,0 +1,94 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from rest_framework.authtoken.models import Token
+
+from api.models import App, Build, Config, Container, Domain, Release
+
+
+class PaginationTest(TransactionTestCase):
+
+    """Tests paging through application resources by cursor and by page number"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.token = Token.objects.get(user=self.user).key
+        self.app = App.objects.create(owner=self.user, id='autotest')
+        Build.objects.bulk_create([
+            Build(owner=self.user, app=self.app, image='autotest/example', sha=str(i) * 40)
+            for i in xrange(10)])
+        builds = list(self.app.build_set.all())
+        # objects created at the same moment are still ordered, by their primary key
+        Build.objects.filter(pk__in=[b.pk for b in builds[2:6]]).update(
+            created=builds[2].created)
+        config = Config.objects.create(owner=self.user, app=self.app)
+        release = Release.objects.create(owner=self.user, app=self.app, version=1,
+                                         build=builds[0], config=config)
+        Container.objects.bulk_create([
+            Container(owner=self.user, app=self.app, release=release, type='web', num=i)
+            for i in xrange(1, 8)])
+        Domain.objects.bulk_create([
+            Domain(owner=self.user, app=self.app, domain='{}.example.com'.format(i))
+            for i in xrange(5)])
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def walk(self, url, key):
+        """Follow the next links from the first page, then the previous links back."""
+        pages = [self.get(url)]
+        self.assertIsNone(pages[0]['previous'])
+        self.assertNotIn('count', pages[0])
+        while pages[-1]['next']:
+            pages.append(self.get(pages[-1]['next']))
+        forwards = [[obj[key] for obj in page['results']] for page in pages]
+        page = pages[-1]
+        backwards = [[obj[key] for obj in page['results']]]
+        while page['previous']:
+            page = self.get(page['previous'])
+            backwards.insert(0, [obj[key] for obj in page['results']])
+        self.assertEqual(backwards, forwards)
+        return forwards
+
+    def test_cursor_pages(self):
+        url = '/v1/apps/{}'.format(self.app.id)
+        builds = self.app.build_set.order_by('-created', '-uuid')
+        self.assertEqual(self.walk(url + '/builds?cursor=&page_size=3', 'uuid'),
+                         [[b.uuid for b in builds[i:i + 3]] for i in xrange(0, 10, 3)])
+        containers = self.app.container_set.order_by('created', 'uuid')
+        nums = list(containers.values_list('num', flat=True))
+        self.assertEqual(self.walk(url + '/containers?cursor=&page_size=4', 'num'),
+                         [nums[:4], nums[4:]])
+        self.assertEqual(self.walk(url + '/containers/web?cursor=&page_size=7', 'num'), [nums])
+        domains = ['{}.example.com'.format(i) for i in xrange(5)]
+        self.assertEqual(self.walk(url + '/domains?cursor=&page_size=2', 'domain'),
+                         [domains[:2], domains[2:4], domains[4:]])
+        self.assertEqual(self.walk(url + '/releases?cursor=', 'version'), [[1]])
+
+    def test_page_numbers(self):
+        """Clients which predate cursors page through the same stable ordering by number."""
+        url = '/v1/apps/{}/builds'.format(self.app.id)
+        builds = self.app.build_set.order_by('-created', '-uuid')
+        for page in xrange(1, 5):
+            data = self.get(url + '?page={}&page_size=3'.format(page))
+            self.assertEqual(data['count'], 10)
+            self.assertEqual([b['uuid'] for b in data['results']],
+                             [b.uuid for b in builds[(page - 1) * 3:page * 3]])
+
+    def test_invalid_cursor(self):
+        url = '/v1/apps/{}/builds?cursor='.format(self.app.id)
+        for cursor in ('garbage', 'WzEsIDIsIDNd', '%E2%98%83'):
+            response = self.client.get(url + cursor,
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(response.status_code, 404)
@@ -0,0 +1,101 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+import json
+import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from api.middleware import query_budget
+from api.tests.test_key import ECDSA_PUBKEY, RSA_PUBKEY, RSA_PUBKEY2
+
+
+@override_settings(DEIS_QUERY_COUNT=True)
+class QueryBudgetTest(TransactionTestCase):
+
+    """Tests that requests make a fixed number of queries, within their budget"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.token = Token.objects.get(user=self.user).key
+        response = self.client.post('/v1/apps', HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        self.app_id = response.data['id']
+        body = {'image': 'autotest/example', 'sha': 'a' * 40,
+                'procfile': json.dumps({'web': 'node server.js', 'worker': 'node worker.js'})}
+        self.request('post', '/builds', body)
+
+    def request(self, method, path, body=None):
+        """Send a request about the app, and return the number of queries it made."""
+        url = path if path.startswith('/v1') else '/v1/apps/{}{}'.format(self.app_id, path)
+        kwargs = {'HTTP_AUTHORIZATION': 'token {}'.format(self.token)}
+        if body is not None:
+            kwargs.update(data=json.dumps(body), content_type='application/json')
+        response = getattr(self.client, method)(url, **kwargs)
+        self.assertIn(response.status_code, (200, 201, 204), response.data)
+        view = response.renderer_context['view']
+        endpoint = '{} {}'.format(method.upper(), view.__class__.__name__)
+        self.assertLessEqual(response.query_count, query_budget(endpoint), url)
+        return response.query_count
+
+    def test_lists_make_fixed_queries(self):
+        lists = ['/containers', '/releases', '/builds', '/domains', '/v1/apps', '/v1/keys',
+                 '/v1/users/']
+
+        def add(i):
+            self.request('post', '/config', {'values': json.dumps({'NUM': str(i)})})
+            self.request('post', '/domains', {'domain': 'test-domain-{}.example.com'.format(i)})
+            self.request('post', '/v1/apps')
+            self.request('post', '/v1/keys', {'id': 'key-{}'.format(i),
+                                              'public': (RSA_PUBKEY2, ECDSA_PUBKEY)[i]})
+            User.objects.create_user('user-{}'.format(i))
+
+        self.request('post', '/scale', {'web': 1})
+        self.request('post', '/v1/keys', {'id': 'key', 'public': RSA_PUBKEY})
+        add(0)
+        few = [self.request('get', url) for url in lists]
+        self.request('post', '/scale', {'web': 10, 'worker': 5})
+        add(1)
+        self.assertEqual([self.request('get', url) for url in lists], few)
+
+    def test_actions_make_fixed_queries(self):
+        self.request('post', '/scale', {'web': 1})
+
+        def act(scale):
+            return [self.request('post', '/containers/restart'),
+                    self.request('post', '/config', {'values': json.dumps({'NUM': scale})}),
+                    self.request('post', '/scale', {'web': scale})]
+
+        few = act(3)
+        # acting on more containers, and adding more of them at once, makes as many queries
+        self.assertEqual(act(15), few)
+
+    def test_over_budget_is_logged(self):
+        with override_settings(DEIS_QUERY_BUDGETS={'GET AppViewSet': 0}), \
+                mock.patch('api.middleware.logger') as mock_logger:
+            response = self.client.get('/v1/apps',
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertGreater(response.query_count, 0)
+            self.assertEqual(mock_logger.warning.call_count, 1)
+            self.assertIn('GET AppViewSet', mock_logger.warning.call_args[0][0])
+            self.client.get('/v1/keys', HTTP_AUTHORIZATION='token {}'.format(self.token))
+            self.assertEqual(mock_logger.warning.call_count, 1)
+
+    def test_queries_are_not_counted_by_default(self):
+        with override_settings(DEIS_QUERY_COUNT=False):
+            response = self.client.get('/v1/apps',
+                                       HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response, 'query_count'))
+        self.assertFalse(connection.use_debug_cursor)
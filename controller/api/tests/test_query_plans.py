@@ -0,0 +1,136 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import re
+import threading
+
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.db.backends.util import CursorWrapper
+from django.test import TransactionTestCase
+from guardian.models import UserObjectPermission
+import mock
+from rest_framework.authtoken.models import Token
+
+from api.models import App, Build, Config, Container, Release
+
+
+# the number of users owning apps, of apps, and of each of their builds, configs, releases
+# and containers
+OWNERS = 50
+APPS = 200
+ROWS_PER_APP = 10
+
+
+def _plan_problems(sql, params):
+    """Return the steps of the plan for a query which read a table in full."""
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = [row[-1] for row in cursor.fetchall()]
+        # a table read through an index without a search term is read in full, too, and
+        # rows sorted outside of an index were all read before the first one is returned
+        pattern = r'^SCAN (?:TABLE )?(?:api|guardian)_|^USE TEMP B-TREE FOR ORDER BY'
+    else:
+        # tables of a few thousand rows may be read in full by choice, so rule that out, and
+        # only a table which no index can serve the query from is still read in full
+        cursor.execute('SET enable_seqscan = off')
+        try:
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.execute('RESET enable_seqscan')
+        pattern = r'Seq Scan on (?:api|guardian)_'
+    return [step for step in plan if re.search(pattern, step.strip(' ->'))]
+
+
+@contextmanager
+def recorded_selects():
+    """Record the SELECT statements this thread runs, with their parameters."""
+    selects, thread = [], threading.current_thread()
+    execute = CursorWrapper.execute
+
+    def record(self, sql, params=None):
+        if sql.startswith('SELECT') and threading.current_thread() is thread:
+            selects.append((sql, params))
+        return execute(self, sql, params)
+
+    with mock.patch.object(CursorWrapper, 'execute', record):
+        yield selects
+
+
+class QueryPlanTest(TransactionTestCase):
+
+    """Tests that the queries behind each endpoint are served from indexes"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest2')
+        self.token = Token.objects.get(user=self.user).key
+        User.objects.bulk_create([User(username='user-{}'.format(i)) for i in xrange(OWNERS)])
+        owners = list(User.objects.filter(username__startswith='user-'))
+        apps = [App(owner=owners[i % OWNERS], id='app-{}'.format(i)) for i in xrange(APPS)]
+        App.objects.bulk_create(apps)
+        # the user owns one app and may use a few others, which others may use too
+        self.app = App.objects.create(owner=self.user, id='autotest2-app')
+        permission = Permission.objects.get(codename='use_app')
+        UserObjectPermission.objects.bulk_create([
+            UserObjectPermission(user=user, permission=permission, content_object=app)
+            for user in (self.user, User.objects.get(username='autotest3'))
+            for app in apps[:10] + [self.app]])
+        builds, configs = [], []
+        for app in apps + [self.app]:
+            for i in xrange(ROWS_PER_APP):
+                builds.append(Build(owner=app.owner, app=app, image='autotest/example',
+                                    sha='a' * 40, procfile={'web': 'node server.js'}))
+                configs.append(Config(owner=app.owner, app=app, values={'NUM': str(i)}))
+        Build.objects.bulk_create(builds)
+        Config.objects.bulk_create(configs)
+        # number the releases and containers of each app from one
+        releases = [Release(owner=b.owner, app=b.app, version=i % ROWS_PER_APP + 1, summary='',
+                            build=b, config=c) for i, (b, c) in enumerate(zip(builds, configs))]
+        Release.objects.bulk_create(releases)
+        Container.objects.bulk_create([
+            Container(owner=r.owner, app=r.app, release=r, type='web', num=r.version)
+            for r in releases])
+        # let the query planner know how the data is spread out
+        connection.cursor().execute('ANALYZE')
+
+    def assertIndexed(self, url):
+        with recorded_selects() as selects:
+            response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 200, response.data)
+        for sql, params in selects:
+            problems = _plan_problems(sql, params)
+            self.assertEqual(problems, [], '{} runs {} with {}'.format(url, sql, problems))
+
+    def test_app_endpoints(self):
+        self.assertIndexed('/v1/apps')
+        self.assertIndexed('/v1/apps/{}'.format(self.app.id))
+        self.assertIndexed('/v1/apps/{}/perms'.format(self.app.id))
+
+    def test_release_endpoints(self):
+        url = '/v1/apps/{}'.format(self.app.id)
+        self.assertIndexed(url + '/config')
+        self.assertIndexed(url + '/builds')
+        self.assertIndexed(url + '/builds?cursor=')
+        self.assertIndexed(url + '/builds/{}'.format(self.app.build_set.all()[0].uuid))
+        self.assertIndexed(url + '/releases')
+        self.assertIndexed(self.client.get(
+            url + '/releases?cursor=&page_size=3',
+            HTTP_AUTHORIZATION='token {}'.format(self.token)).data['next'])
+        self.assertIndexed(url + '/releases/v1')
+
+    def test_container_endpoints(self):
+        url = '/v1/apps/{}/containers'.format(self.app.id)
+        self.assertIndexed(url)
+        self.assertIndexed(url + '?cursor=&page_size=3')
+        self.assertIndexed(url + '/web')
+        self.assertIndexed(url + '/web/1')
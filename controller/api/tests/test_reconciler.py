@@ -0,0 +1,184 @@
+"""
+Unit tests for the Deis api app.
+
+Run the tests with "./manage.py test api"
+"""
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import json
+import mock
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from scheduler.mock import jobs
+from scheduler.states import JobState
+
+from api import reconciler
+from api.models import App, Container, ContainerStatus, Lease
+
+
+class ReconcilerTest(TransactionTestCase):
+
+    """Tests recording the state of containers on the scheduler"""
+
+    fixtures = ['tests.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='autotest')
+        self.token = Token.objects.get(user=self.user).key
+        # only see the jobs scheduled by this test
+        patcher = mock.patch.dict(jobs, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        response = self.client.post('/v1/apps', HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        self.app = App.objects.get(id=response.data['id'])
+        url = '/v1/apps/{}/builds'.format(self.app.id)
+        body = {'image': 'autotest/example', 'sha': 'a' * 40,
+                'procfile': json.dumps({'web': 'node server.js', 'worker': 'node worker.js'})}
+        response = self.client.post(url, json.dumps(body), content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 201)
+        url = '/v1/apps/{}/scale'.format(self.app.id)
+        response = self.client.post(url, json.dumps({'web': 2, 'worker': 1}),
+                                    content_type='application/json',
+                                    HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(response.status_code, 204)
+        # the containers have been around for longer than a reconcile interval
+        Container.objects.update(created=timezone.now() - timedelta(hours=1))
+        self.containers = list(Container.objects.all())
+
+    def test_reconcile_records_states(self):
+        self.assertEqual(reconciler.reconcile(), {})
+        statuses = ContainerStatus.objects.all()
+        self.assertEqual(len(statuses), 3)
+        for status in statuses:
+            self.assertEqual(status.state, 'up')
+            self.assertEqual(status.app, self.app)
+            self.assertIsNotNone(status.container)
+            self.assertIsNotNone(status.seen)
+            # new statuses are only served once a later pass has looked at them again
+            self.assertIsNone(status.checked)
+        reconciler.reconcile()
+        # container states are now served without asking the scheduler
+        with mock.patch('scheduler.mock.MockSchedulerClient.states') as mock_states, \
+                mock.patch('scheduler.mock.MockSchedulerClient.state') as mock_state:
+            states = self.app.container_states(self.containers)
+            self.assertEqual(self.containers[0].state, 'up')
+            url = '/v1/apps/{}/containers'.format(self.app.id)
+            response = self.client.get(url, HTTP_AUTHORIZATION='token {}'.format(self.token))
+        self.assertEqual(set(states.values()), {'up'})
+        self.assertEqual(set(c['state'] for c in response.data['results']), {'up'})
+        self.assertFalse(mock_states.called)
+        self.assertFalse(mock_state.called)
+
+    def test_stale_states_are_looked_up(self):
+        reconciler.reconcile()
+        ContainerStatus.objects.update(checked=timezone.now() - timedelta(hours=1))
+        jobs[self.containers[0].job_id]['state'] = JobState.down
+        self.assertEqual(self.app.container_states(self.containers)[self.containers[0].job_id],
+                         'down')
+        # acting on containers forgets their recorded states
+        reconciler.reconcile()
+        self.app.restart(type='worker')
+        worker, web = Container.objects.get(type='worker'), Container.objects.filter(type='web')[0]
+        self.assertIsNone(ContainerStatus.objects.get(job_id=worker.job_id).checked)
+        self.assertIsNotNone(ContainerStatus.objects.get(job_id=web.job_id).checked)
+
+    def test_reconcile_flags_drift(self):
+        missing = self.containers[0]
+        jobs[missing.job_id]['state'] = JobState.destroyed
+        orphan = '{}_v9.web.1'.format(self.app.id)
+        jobs[orphan] = {'state': JobState.up}
+        jobs['unknown_v1.web.1'] = {'state': JobState.up}
+        jobs['{}_v2.run.1'.format(self.app.id)] = {'state': JobState.up}
+        with mock.patch('api.reconciler.log_event') as mock_log:
+            drift = reconciler.reconcile()
+            self.assertEqual(drift, {
+                missing.job_id: ContainerStatus.MISSING,
+                orphan: ContainerStatus.ORPHANED,
+                'unknown_v1.web.1': ContainerStatus.ORPHANED,
+            })
+            self.assertEqual(mock_log.call_count, 2)
+            # drift is only reported when it is first found
+            reconciler.reconcile()
+            self.assertEqual(mock_log.call_count, 2)
+        status = ContainerStatus.objects.get(job_id=missing.job_id)
+        self.assertEqual((status.state, status.container), ('destroyed', missing))
+        status = ContainerStatus.objects.get(job_id=orphan)
+        self.assertEqual((status.app, status.container), (self.app, None))
+        self.assertIsNone(ContainerStatus.objects.get(job_id='unknown_v1.web.1').app)
+        # once the orphans are gone and the container is back, there is nothing to flag
+        del jobs[orphan], jobs['unknown_v1.web.1']
+        jobs[missing.job_id]['state'] = JobState.up
+        self.assertEqual(reconciler.reconcile(), {})
+        self.assertEqual(ContainerStatus.objects.count(), 3)
+        self.assertEqual(ContainerStatus.objects.get(job_id=missing.job_id).drift, '')
+
+    def test_new_containers_are_not_missing(self):
+        Container.objects.update(created=timezone.now())
+        jobs[self.containers[0].job_id]['state'] = JobState.destroyed
+        self.assertEqual(reconciler.reconcile(), {})
+
+    def test_reconcile_without_listing(self):
+        jobs['{}_v9.web.1'.format(self.app.id)] = {'state': JobState.up}
+        with mock.patch('scheduler.mock.MockSchedulerClient.list',
+                        side_effect=NotImplementedError):
+            self.assertEqual(reconciler.reconcile(), {})
+        self.assertEqual(ContainerStatus.objects.count(), 3)
+
+    def test_states_forgotten_during_a_pass_stay_forgotten(self):
+        reconciler.reconcile()
+        ContainerStatus.objects.update(checked=timezone.now() - timedelta(seconds=1))
+        worker, web = Container.objects.get(type='worker'), Container.objects.filter(type='web')[0]
+        jobs[worker.job_id]['state'] = JobState.down
+        observe = reconciler._observe
+
+        def acting(containers):
+            observed = observe(containers)
+            # both containers are acted on while the pass is under way
+            self.app._forget_states([worker, web])
+            jobs[worker.job_id]['state'] = jobs[web.job_id]['state'] = JobState.crashed
+            return observed
+
+        with mock.patch('api.reconciler._observe', side_effect=acting):
+            reconciler.reconcile()
+        self.assertIsNone(ContainerStatus.objects.get(job_id=worker.job_id).checked)
+        self.assertIsNone(ContainerStatus.objects.get(job_id=web.job_id).checked)
+        self.assertEqual(ContainerStatus.objects.filter(checked__isnull=False).count(), 1)
+        states = self.app.container_states([worker, web])
+        self.assertEqual(set(states.values()), {'crashed'})
+
+    def test_one_process_claims_each_pass(self):
+        self.assertTrue(reconciler._due())
+        self.assertFalse(reconciler._due())
+        Lease.objects.update(expires=timezone.now())
+        self.assertTrue(reconciler._due())
+
+    def test_containers_acted_on_during_their_first_pass_are_looked_up(self):
+        worker = Container.objects.get(type='worker')
+        # the job has not reached the scheduler yet when the pass looks
+        jobs[worker.job_id]['state'] = JobState.destroyed
+        observe = reconciler._observe
+
+        def acting(containers):
+            observed = observe(containers)
+            # the container is started while the pass is under way, before it has a status
+            self.app._forget_states([worker])
+            jobs[worker.job_id]['state'] = JobState.up
+            return observed
+
+        with mock.patch('api.reconciler._observe', side_effect=acting):
+            reconciler.reconcile()
+        self.assertEqual(ContainerStatus.objects.get(job_id=worker.job_id).state, 'destroyed')
+        self.assertEqual(self.app.container_states([worker]), {worker.job_id: 'up'})
+        self.assertEqual(Container.objects.get(pk=worker.pk).state, 'up')
+        # the next pass records, and serves, the state as it is now
+        reconciler.reconcile()
+        status = ContainerStatus.objects.get(job_id=worker.job_id)
+        self.assertEqual(status.state, 'up')
+        self.assertIsNotNone(status.checked)
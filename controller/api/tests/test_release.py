@@ -14,7 +14,7 @@ from django.contrib.auth.models import User
 from django.test import TransactionTestCase
 from rest_framework.authtoken.models import Token
 
-from api.models import Release
+from api.models import App, Release
 
 
 def mock_import_repository_task(*args, **kwargs):
@@ -240,6 +240,30 @@ class ReleaseTest(TransactionTestCase):
         release = Release.objects.get(uuid=release3['uuid'])
         self.assertEqual(str(release), "{}-v3".format(release3['app']))
 
+    @mock.patch('requests.post', mock_import_repository_task)
+    def test_latest_release(self):
+        """Test that an app points at its latest release as releases come and go."""
+        release3 = self.test_release()
+        app = App.objects.get(id=release3['app'])
+        self.assertEqual(app.latest_release.uuid, release3['uuid'])
+        # saving an app loaded before a new release does not point it back
+        stale = App.objects.get(id=app.id)
+        release3 = app.get_latest_release()
+        release4 = release3.new(self.user, release3.config, release3.build)
+        self.assertEqual(app.get_latest_release(), release4)
+        stale.save()
+        self.assertEqual(App.objects.get(id=app.id).latest_release, release4)
+        # its cached release lasts until the app's next operation refreshes it
+        self.assertEqual(stale.get_latest_release(), release3)
+        stale.refresh_latest_release()
+        self.assertEqual(stale.get_latest_release(), release4)
+        # once the latest release goes, the one before it takes its place
+        release4.delete()
+        app = App.objects.get(id=app.id)
+        self.assertIsNone(app.latest_release)
+        self.assertEqual(app.get_latest_release(), release3)
+        self.assertEqual(App.objects.get(id=app.id).latest_release, release3)
+
     @mock.patch('requests.post', mock_import_repository_task)
     def test_release_summary(self):
         """Test the text summary of a release."""
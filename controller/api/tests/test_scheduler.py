@@ -6,14 +6,24 @@ Run the tests with "./manage.py test api"
 
 from __future__ import unicode_literals
 
+import BaseHTTPServer
+import httplib
 import json
+import socket
+import SocketServer
+import threading
+import urllib
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TransactionTestCase
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import override_settings
+import mock
 from rest_framework.authtoken.models import Token
 
-from scheduler import chaos
+import scheduler
+from scheduler import chaos, fleet, k8s
+from scheduler.states import JobState
 
 
 class SchedulerTest(TransactionTestCase):
@@ -393,3 +403,363 @@ class SchedulerTest(TransactionTestCase):
         self.assertEqual(response.status_code, 503)
         self.assertEqual(response.data, {'detail': 'exit code 1'})
         self.assertEqual(response.get('content-type'), 'application/json')
+
+
+class FleetPollerTest(SimpleTestCase):
+    """Tests waiting on fleet units through the shared cluster state poller"""
+
+    def setUp(self):
+        self.poll_interval = fleet.POLL_INTERVAL
+        fleet.POLL_INTERVAL = 0.01
+
+    def tearDown(self):
+        fleet.POLL_INTERVAL = self.poll_interval
+
+    def test_waiters_share_polls(self):
+        polls = []
+        lock = threading.Lock()
+
+        def get_all_states():
+            with lock:
+                polls.append(None)
+                # every unit comes up on the third poll
+                active = 'active' if len(polls) >= 3 else 'activating'
+            return [{'name': 'app_v1.web.{}.service'.format(i), 'systemdLoadState': 'loaded',
+                     'systemdActiveState': active} for i in xrange(20)]
+
+        client = fleet.FleetHTTPClient('/tmp/test-poller.sock', None, None, None)
+        errors = []
+
+        def wait(i):
+            try:
+                client._wait_for_job_state('app_v1.web.{}'.format(i), JobState.up)
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(fleet.FleetHTTPClient, '_get_all_states',
+                               side_effect=get_all_states):
+            threads = [threading.Thread(target=wait, args=(i,)) for i in xrange(20)]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+        self.assertEqual(errors, [])
+        # polls are shared between waiters rather than made for each of them
+        self.assertLess(len(polls), 20)
+
+    def test_wait_for_destroy(self):
+        poller = fleet.get_poller('/tmp/test-destroy.sock')
+        with mock.patch.object(fleet.FleetHTTPClient, '_get_all_states', return_value=[]):
+            self.assertIsNone(poller.wait_for('app_v1.web.1', lambda s: s is None, 5))
+        with mock.patch.object(fleet.FleetHTTPClient, '_get_all_states',
+                               side_effect=RuntimeError('fleet is down')):
+            with self.assertRaises(RuntimeError):
+                poller.wait_for('app_v1.web.1', lambda s: s is None, 0.1)
+
+
+class SchedulerClientTest(SimpleTestCase):
+    """Tests sharing scheduler clients and their connections"""
+
+    def test_client_registry(self):
+        client = scheduler.get_client('scheduler.mock', 'target', '', {}, '')
+        self.assertIs(client, scheduler.get_client('scheduler.mock', 'target', '', {}, ''))
+        self.assertIsNot(client, scheduler.get_client('scheduler.chaos', 'target', '', {}, ''))
+        # a forked process builds its own clients
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(client, scheduler.get_client('scheduler.mock', 'target', '', {}, ''))
+
+    def test_fleet_connection_per_thread(self):
+        client = fleet.FleetHTTPClient('/tmp/test-conn.sock', None, None, None)
+        conns = []
+        t = threading.Thread(target=lambda: conns.append(client.conn))
+        t.start()
+        t.join()
+        self.assertIs(client.conn, client.conn)
+        self.assertIsNot(client.conn, conns[0])
+
+    def test_fleet_reconnect(self):
+        client = fleet.FleetHTTPClient('/tmp/test-conn.sock', None, None, None)
+        conn = client.conn
+        # pretend fleet dropped a kept-alive connection
+        conn.sock = mock.Mock()
+        response = mock.Mock(status=200)
+        response.read.return_value = '{"machines": []}'
+        with mock.patch.object(conn, 'request', side_effect=[httplib.BadStatusLine(''), None]), \
+                mock.patch.object(conn, 'getresponse', return_value=response), \
+                mock.patch.object(conn, 'close') as close:
+            self.assertEqual(client._get_machines(), {'machines': []})
+        self.assertTrue(close.called)
+
+    def test_fleet_list(self):
+        client = fleet.FleetHTTPClient('/tmp/test-conn.sock', None, None, None)
+        units = [
+            {'name': 'app_v2.web.1.service', 'systemdLoadState': 'loaded',
+             'systemdActiveState': 'active', 'systemdSubState': 'running'},
+            {'name': 'app_v2.worker_high.1.service', 'systemdLoadState': 'loaded',
+             'systemdActiveState': 'activating', 'systemdSubState': 'start-pre'},
+            # platform units are not app containers
+            {'name': 'deis-router@1.service', 'systemdLoadState': 'loaded',
+             'systemdActiveState': 'active', 'systemdSubState': 'running'},
+        ]
+        with mock.patch.object(fleet.FleetHTTPClient, '_get_all_states', return_value=units):
+            self.assertEqual(client.list(), {'app_v2.web.1': JobState.up,
+                                             'app_v2.worker_high.1': JobState.down})
+
+    def test_fleet_states(self):
+        client = fleet.FleetHTTPClient('/tmp/test-conn.sock', None, None, None)
+        units = [{'name': 'app_v2.web.1.service', 'systemdLoadState': 'loaded',
+                  'systemdActiveState': 'active', 'systemdSubState': 'running'}]
+        # units missing from the bulk states, such as ones not yet scheduled, are looked up
+        with mock.patch.object(fleet.FleetHTTPClient, '_get_all_states', return_value=units), \
+                mock.patch.object(fleet.FleetHTTPClient, 'state',
+                                  return_value=JobState.created) as state:
+            self.assertEqual(client.states(['app_v2.web.1', 'app_v2.web.2']),
+                             {'app_v2.web.1': JobState.up, 'app_v2.web.2': JobState.created})
+        state.assert_called_once_with('app_v2.web.2')
+
+
+class FakeKubeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers k8s API requests from the routes of the server it belongs to."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        self.server.requests.append((self.command, self.path, body))
+        path, _, query = self.path.partition('?')
+        if (self.command, path) in self.server.dropped:
+            # hang up without answering, as a server going away would
+            self.close_connection = 1
+            return
+        if 'watch=true' in query:
+            return self._stream(self.server.watches.get(path, []))
+        status, data = self.server.routes.get((self.command, path), (404, {}))
+        data = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, events):
+        """Send watch events one chunk at a time, then end the watch."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in events:
+            data = json.dumps(event) + '\n'
+            self.wfile.write('{:x}\r\n{}\r\n'.format(len(data), data))
+            self.wfile.flush()
+        self.wfile.write('0\r\n\r\n')
+
+    do_GET = do_PUT = do_POST = do_DELETE = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeKubeAPIServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An in-process stand-in for the k8s API server."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeKubeHandler)
+        self.connections = 0
+        self.requests = []
+        self.routes = {}
+        self.watches = {}
+        self.dropped = set()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def client(self):
+        with override_settings(K8S_MASTER='127.0.0.1', REGISTRY_PORT='5000'):
+            client = k8s.KubeHTTPClient(None, None, None, None)
+        client.pool = k8s.ConnectionPool('127.0.0.1:{}'.format(self.server_address[1]))
+        return client
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on a watch or a kept-alive connection are expected
+        pass
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class KubeHTTPClientTest(SimpleTestCase):
+    """Tests the k8s scheduler against a fake API server"""
+
+    def setUp(self):
+        self.server = FakeKubeAPIServer()
+        self.client = self.server.client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connections_are_kept_alive(self):
+        self.server.routes[('GET', '/api/v1/namespaces/app/pods')] = (200, {'items': []})
+        for _ in xrange(10):
+            status, data, reason = self.client._get_pods('app')
+            self.assertEqual(status, 200)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_request_errors(self):
+        with self.assertRaises(RuntimeError) as e:
+            self.client._get_pods('nope')
+        self.assertTrue(str(e.exception).startswith('Failed to get Pods: 404'))
+        # a failed request does not cost the connection
+        self.assertEqual(self.client._get_rc_status('rc', 'nope'), 404)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_reconnect_after_server_drops_connection(self):
+        self.server.routes[('GET', '/api/v1/namespaces/app/events')] = (200, {'items': []})
+        self.client._get_events('app')
+        # pretend the server timed out the idle connection
+        [conn.sock.shutdown(2) for conn in self.client.pool._idle]
+        status, data, reason = self.client._get_events('app')
+        self.assertEqual(status, 200)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_creates_are_sent_once(self):
+        path = '/api/v1/namespaces/app/pods'
+        self.server.routes[('GET', path)] = (200, {'items': []})
+        self.server.routes[('POST', path)] = (201, {})
+        self.client._get_pods('app')
+        [conn.sock.shutdown(2) for conn in self.client.pool._idle]
+        # a create does not go out on a kept-alive connection the server may have dropped
+        status, data, reason = self.client._request('POST', '/namespaces/app/pods', body='{}')
+        self.assertEqual(status, 201)
+        self.assertEqual(self.server.connections, 2)
+        # nor is it sent again when the server hangs up before answering
+        self.server.dropped.add(('POST', path))
+        with self.assertRaises((socket.error, httplib.HTTPException)):
+            self.client._request('POST', '/namespaces/app/pods', body='{}')
+        self.assertEqual([r[0] for r in self.server.requests].count('POST'), 2)
+        # while a read on a kept-alive connection is retried once
+        self.server.dropped.add(('GET', path))
+        with self.assertRaises((socket.error, httplib.HTTPException)):
+            self.client._get_pods('app')
+        self.assertEqual([r[0] for r in self.server.requests].count('GET'), 3)
+
+    def _rollout(self, events):
+        """Serve a replication controller scaled to two pods, along with the given events."""
+        rc = {'metadata': {'name': 'app-v2-web', 'resourceVersion': '1'},
+              'spec': {'replicas': 2, 'selector': {'name': 'app', 'version': 'v2',
+                                                   'type': 'web'}}}
+        self.server.routes[('PUT', '/api/v1/namespaces/app/replicationcontrollers/app-v2-web')] = \
+            (200, rc)
+        listing = {'metadata': {'resourceVersion': '10'}, 'items': []}
+        self.server.routes[('GET', '/api/v1/namespaces/app/pods')] = (200, listing)
+        self.server.routes[('GET', '/api/v1/namespaces/app/events')] = (200, listing)
+
+        def pod(name, phase, version):
+            return {'metadata': {'name': name, 'resourceVersion': version},
+                    'status': {'phase': phase}}
+
+        self.server.watches['/api/v1/namespaces/app/pods'] = [
+            {'type': 'ADDED', 'object': pod('app-v2-web-a', 'Pending', '11')},
+            {'type': 'ADDED', 'object': pod('app-v2-web-b', 'Pending', '12')},
+            {'type': 'MODIFIED', 'object': pod('app-v2-web-a', 'Running', '13')},
+            {'type': 'MODIFIED', 'object': pod('app-v2-web-b', 'Running', '14')},
+        ]
+        self.server.watches['/api/v1/namespaces/app/events'] = [
+            {'type': 'ADDED', 'object': {
+                'metadata': {'name': 'event-{}'.format(i), 'resourceVersion': str(20 + i)},
+                'involvedObject': {'name': 'app-v2-web-{}'.format(name)},
+                'source': {'component': 'scheduler'},
+                'reason': reason, 'message': 'pod {}: {}'.format(name, reason)}}
+            for i, (name, reason) in enumerate(events)]
+        return rc
+
+    def test_rollout_is_watched(self):
+        rc = self._rollout([('a', 'scheduled'), ('b', 'scheduled')])
+        self.client._scale_rc(rc, 'app')
+        paths = [path for method, path, body in self.server.requests if method == 'GET']
+        # pods are only ever requested through the rc's label selector
+        selector = urllib.urlencode({'labelSelector': 'name=app,type=web,version=v2'})
+        self.assertTrue(all(selector in path for path in paths if '/pods' in path))
+        watches = [path for path in paths if 'watch=true' in path]
+        self.assertEqual(len(watches), 3)
+        self.assertTrue(all('resourceVersion=10' in path for path in watches))
+
+    def test_rollout_scheduling_failure(self):
+        rc = self._rollout([('a', 'scheduled'), ('b', 'failedScheduling')])
+        with self.assertRaises(RuntimeError) as e:
+            self.client._scale_rc(rc, 'app')
+        self.assertEqual(str(e.exception), 'pod b: failedScheduling')
+
+    def test_rollout_timeouts(self):
+        rc = self._rollout([('a', 'scheduled'), ('b', 'scheduled')])
+        for results, stage in [([False], 'created'), ([True, False], 'scheduled'),
+                               ([True, True, False], 'running')]:
+            with mock.patch.object(self.client, '_watch_until', side_effect=results):
+                with self.assertRaises(RuntimeError) as e:
+                    self.client._scale_rc(dict(rc), 'app')
+            self.assertEqual(str(e.exception),
+                             'timed out waiting for pods of app-v2-web to be ' + stage)
+
+    def test_watch_resumes_after_expiry(self):
+        self.server.routes[('GET', '/api/v1/namespaces/app/pods')] = \
+            (200, {'metadata': {'resourceVersion': '10'}, 'items': []})
+        self.server.watches['/api/v1/namespaces/app/pods'] = [
+            {'type': 'ERROR', 'object': {'code': 410, 'message': 'too old resource version'}},
+        ]
+        done = self.client._watch_until('/namespaces/app/pods', {'labelSelector': 'name=app'},
+                                        lambda pods: False, 0.5)
+        self.assertFalse(done)
+        # the expired watch made us list the pods again
+        lists = [path for method, path, body in self.server.requests
+                 if 'watch=true' not in path]
+        self.assertGreater(len(lists), 1)
+
+    def _deploy(self, desired, **kwargs):
+        """Deploy over an rc with the given number of replicas and return the scaling steps."""
+        old_rc = {'metadata': {'name': 'app-v1-web'}, 'spec': {'replicas': desired}}
+        new_rc = {'metadata': {'name': 'app-v2-web'}}
+        with mock.patch.object(self.client, '_get_old_rc', return_value=old_rc), \
+                mock.patch.object(self.client, '_create_rc', return_value=new_rc), \
+                mock.patch.object(self.client, '_delete_rc'), \
+                mock.patch.object(self.client, '_scale_app') as scale_app:
+            self.client.deploy('app_v2.web', 'image', 'start web', aname='app', **kwargs)
+        return [(name[4:6], num) for name, num, namespace in
+                [c[0] for c in scale_app.call_args_list]]
+
+    def test_deploy_one_at_a_time(self):
+        self.assertEqual(self._deploy(3), [('v2', 1), ('v1', 2), ('v2', 2), ('v1', 1),
+                                           ('v2', 3), ('v1', 0)])
+
+    def test_deploy_with_surge(self):
+        self.assertEqual(self._deploy(10, maxSurge='50%', maxUnavailable=2),
+                         [('v2', 5), ('v1', 3), ('v2', 10), ('v1', 0)])
+        self.client.options = {'maxSurge': 0, 'maxUnavailable': 1}
+        self.assertEqual(self._deploy(2), [('v1', 1), ('v2', 1), ('v1', 0), ('v2', 2)])
+
+    def test_deploy_options_of_zero_override_scheduler_options(self):
+        self.client.options = {'maxSurge': 2, 'maxUnavailable': 2}
+        # the app forbids dropping below the desired count, whatever the scheduler allows
+        self.assertEqual(self._deploy(3, maxSurge=1, maxUnavailable=0),
+                         [('v2', 1), ('v1', 2), ('v2', 2), ('v1', 1), ('v2', 3), ('v1', 0)])
+        self.assertEqual(self._deploy(2, maxSurge=0, maxUnavailable=1),
+                         [('v1', 1), ('v2', 1), ('v1', 0), ('v2', 2)])
+
+    def test_deploy_rollback(self):
+        old_rc = {'metadata': {'name': 'app-v1-web'}, 'spec': {'replicas': 4}}
+        new_rc = {'metadata': {'name': 'app-v2-web'}}
+        with mock.patch.object(self.client, '_get_old_rc', return_value=old_rc), \
+                mock.patch.object(self.client, '_create_rc', return_value=new_rc), \
+                mock.patch.object(self.client, '_delete_rc') as delete_rc, \
+                mock.patch.object(self.client, '_scale_app',
+                                  side_effect=[None, RuntimeError('pod failed'), None, None,
+                                               None]) as scale_app:
+            with self.assertRaises(RuntimeError):
+                self.client.deploy('app_v2.web', 'image', 'start web', aname='app',
+                                   maxSurge=2)
+        delete_rc.assert_called_once_with('app-v2-web', 'app')
+        scale_app.assert_called_with('app-v1-web', 4, 'app')
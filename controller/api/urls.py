@@ -66,6 +66,11 @@ urlpatterns = patterns(
         views.AppViewSet.as_view({'get': 'retrieve', 'post': 'update', 'delete': 'destroy'})),
     url(r'^apps/?',
         views.AppViewSet.as_view({'get': 'list', 'post': 'create'})),
+    # asynchronous operations
+    url(r'^operations/(?P<uuid>[-_\w]+)/?',
+        views.OperationViewSet.as_view({'get': 'retrieve'})),
+    url(r'^operations/?',
+        views.OperationViewSet.as_view({'get': 'list'})),
     # key
     url(r'^keys/(?P<id>.+)/?',
         views.KeyViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'})),
@@ -3,7 +3,9 @@ Helper functions used by the Deis server.
 """
 import base64
 import hashlib
+import os
 import random
+import time
 
 
 def generate_app_name():
@@ -116,6 +118,73 @@ def encode(obj):
         return obj
 
 
+def _tail_offset(f, lines, block_size):
+    """Return the offset in f at which its last lines begin, reading backwards from the end."""
+    f.seek(0, os.SEEK_END)
+    end = pos = f.tell()
+    if lines <= 0:
+        return end
+    found = 0
+    while pos > 0:
+        size = min(block_size, pos)
+        pos -= size
+        f.seek(pos)
+        block = f.read(size)
+        idx = len(block)
+        while True:
+            idx = block.rfind(b'\n', 0, idx)
+            if idx == -1:
+                break
+            # a newline at the very end closes the last line rather than starting a new one
+            if pos + idx == end - 1:
+                continue
+            found += 1
+            if found == lines:
+                return pos + idx + 1
+    return 0
+
+
+def tail(path, lines, follow=False, block_size=4096, poll_interval=1, timeout=None):
+    """
+    Return an iterator over the last lines of the file at path, like ``tail -n``.
+
+    The file is read in blocks of block_size bytes, so memory use does not grow with the size of
+    the file or the number of lines. With follow, data appended to the file is passed on as it
+    arrives, for up to timeout seconds. The file is opened right away, so a missing file raises
+    an IOError here rather than during iteration.
+    """
+    f = open(path, 'rb')
+
+    def _tail(f):
+        try:
+            f.seek(_tail_offset(f, lines, block_size))
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+            deadline = time.time() + timeout if timeout is not None else None
+            while follow and (deadline is None or time.time() < deadline):
+                block = f.read(block_size)
+                if block:
+                    yield block
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    stat = None
+                if stat and (stat.st_ino != os.fstat(f.fileno()).st_ino or
+                             stat.st_size < f.tell()):
+                    # the file was rotated or truncated, so carry on from the start of the new one
+                    f.close()
+                    f = open(path, 'rb')
+                    continue
+                time.sleep(poll_interval)
+        finally:
+            f.close()
+
+    return _tail(f)
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
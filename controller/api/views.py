@@ -1,10 +1,14 @@
 """
 RESTful view classes for presenting Deis API objects.
 """
+import re
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
 from guardian.shortcuts import assign_perm, get_objects_for_user, \
     get_users_with_perms, remove_perm
 from rest_framework import mixins, renderers, status
@@ -14,7 +18,17 @@ from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.authtoken.models import Token
 
-from api import authentication, models, permissions, serializers, viewsets
+from api import authentication, logs, models, operations, pagination, permissions, \
+    serializers, viewsets
+
+
+class PlainTextRenderer(renderers.BaseRenderer):
+    """Renders text as is, for clients which ask for it."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
 
 
 class UserRegistrationViewSet(GenericViewSet,
@@ -45,7 +59,8 @@ class UserManagementViewSet(GenericViewSet):
             else:
                 raise PermissionDenied()
 
-        target_obj.delete()
+        with models.etcd_changes():
+            target_obj.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def passwd(self, request, **kwargs):
@@ -117,9 +132,22 @@ class BaseDeisViewSet(viewsets.OwnerViewSet):
         except RuntimeError as e:
             return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+    def prefers_async(self):
+        """Whether the client asked for the request to be carried out asynchronously."""
+        return 'respond-async' in self.request.META.get('HTTP_PREFER', '')
+
+    def accepted(self, operation, headers=None):
+        """Acknowledge a queued operation, pointing the client at where to follow it."""
+        headers = headers or {}
+        headers['Location'] = self.request.build_absolute_uri(
+            '/v1/operations/{}'.format(operation.uuid))
+        return Response(serializers.OperationSerializer(operation).data,
+                        status=status.HTTP_202_ACCEPTED, headers=headers)
+
 
 class AppResourceViewSet(BaseDeisViewSet):
     """A viewset for objects which are attached to an application."""
+    related_fields = ('owner', 'app')
 
     def get_app(self):
         app = get_object_or_404(models.App, id=self.kwargs['id'])
@@ -128,11 +156,30 @@ class AppResourceViewSet(BaseDeisViewSet):
 
     def get_queryset(self, **kwargs):
         app = self.get_app()
-        return self.model.objects.filter(app=app)
+        return self.model.objects.filter(app=app).select_related(*self.related_fields)
 
     def get_object(self, **kwargs):
         return self.get_queryset(**kwargs).latest('created')
 
+    def paginate_queryset(self, queryset):
+        """
+        Page through objects after a cursor when the client sends one, even an empty one for
+        the first page, and by page number otherwise for clients which predate cursors.
+        """
+        queryset = queryset.order_by(*pagination.keyset_ordering(queryset.model))
+        if pagination.CURSOR_PARAM not in self.request.query_params:
+            return super(AppResourceViewSet, self).paginate_queryset(queryset)
+        page_size = self.get_paginate_by()
+        if not page_size:
+            return None
+        return pagination.paginate_by_keyset(
+            queryset, self.request.query_params[pagination.CURSOR_PARAM], page_size)
+
+    def get_pagination_serializer(self, page):
+        if isinstance(page, pagination.KeysetPage):
+            self.pagination_serializer_class = pagination.KeysetPaginationSerializer
+        return super(AppResourceViewSet, self).get_pagination_serializer(page)
+
     def create(self, request, **kwargs):
         request.data['app'] = self.get_app()
         return super(AppResourceViewSet, self).create(request, **kwargs)
@@ -149,22 +196,62 @@ class ReleasableViewSet(AppResourceViewSet):
     """
     def get_object(self):
         """Retrieve the object based on the latest release's value"""
-        return getattr(self.get_app().release_set.latest(), self.model.__name__.lower())
+        return getattr(self.get_app().get_latest_release(), self.model.__name__.lower())
+
+    def create(self, request, **kwargs):
+        response = super(ReleasableViewSet, self).create(request, **kwargs)
+        # the release is rolled out by an operation worker if the client asked for it
+        operation = getattr(self, 'operation', None)
+        if operation is not None:
+            return self.accepted(operation, self.get_success_headers(response.data))
+        return response
 
     def get_success_headers(self, data, **kwargs):
         headers = super(ReleasableViewSet, self).get_success_headers(data)
-        headers.update({'Deis-Release': self.release.version})
-        headers.update({'X-Deis-Release': self.release.version})  # DEPRECATED
+        # asynchronous builds only know about their release once the operation has run
+        release = getattr(self, 'release', None)
+        if release is not None:
+            headers.update({'Deis-Release': release.version})
+            headers.update({'X-Deis-Release': release.version})  # DEPRECATED
         return headers
 
 
+def _log_options(params):
+    """Return the range and filters to read app logs with, or raise ValueError if one is bad."""
+    options = {}
+    for param in ('since', 'until'):
+        if params.get(param):
+            try:
+                options[param] = parse_datetime(params[param])
+            except ValueError:
+                options[param] = None
+            if options[param] is None:
+                raise ValueError('{} must be an ISO 8601 date and time'.format(param))
+    if params.get('process'):
+        options['process'] = params['process']
+    if params.get('source'):
+        if params['source'] not in ('deis', 'app'):
+            raise ValueError('source must be either deis or app')
+        options['source'] = params['source']
+    pattern = re.escape(params['match']) if params.get('match') else params.get('regex')
+    if pattern:
+        options['pattern'] = logs.compile_pattern(pattern.encode('utf-8'))
+    return options
+
+
 class AppViewSet(BaseDeisViewSet):
     """A viewset for interacting with App objects."""
     model = models.App
     serializer_class = serializers.AppSerializer
 
     def get_queryset(self, *args, **kwargs):
-        return self.model.objects.all(*args, **kwargs)
+        return self.model.objects.all(*args, **kwargs).select_related(*self.related_fields)
+
+    def get_renderers(self):
+        renderers = super(AppViewSet, self).get_renderers()
+        if self.action == 'logs':
+            renderers.append(PlainTextRenderer())
+        return renderers
 
     def list(self, request, *args, **kwargs):
         """
@@ -174,7 +261,7 @@ class AppViewSet(BaseDeisViewSet):
         """
         queryset = super(AppViewSet, self).get_queryset(**kwargs) | \
             get_objects_for_user(self.request.user, 'api.use_app')
-        instance = self.filter_queryset(queryset)
+        instance = self.filter_queryset(queryset.select_related(*self.related_fields))
         page = self.paginate_queryset(instance)
         if page is not None:
             serializer = self.get_pagination_serializer(page)
@@ -192,6 +279,9 @@ class AppViewSet(BaseDeisViewSet):
             for target, count in request.data.viewitems():
                 new_structure[target] = int(count)
             models.validate_app_structure(new_structure)
+            if self.prefers_async():
+                return self.accepted(
+                    operations.submit(request.user, app, 'scale', {'structure': new_structure}))
             app.scale(request.user, new_structure)
         except (TypeError, ValueError) as e:
             return Response({'detail': 'Invalid scaling format: {}'.format(e)},
@@ -202,12 +292,36 @@ class AppViewSet(BaseDeisViewSet):
             return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def destroy(self, request, **kwargs):
+        if not self.prefers_async():
+            return super(AppViewSet, self).destroy(request, **kwargs)
+        app = self.get_object()
+        return self.accepted(operations.submit(request.user, app, 'destroy'))
+
     def logs(self, request, **kwargs):
         app = self.get_object()
+        log_lines = request.query_params.get('log_lines', str(settings.LOG_LINES))
+        follow = request.query_params.get('follow', '').lower() in ('1', 'true')
+        try:
+            options = _log_options(request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if follow and options:
+            return Response({'detail': 'follow cannot be combined with a range or filters'},
+                            status=status.HTTP_400_BAD_REQUEST)
         try:
-            return Response(app.logs(request.query_params.get('log_lines',
-                                     str(settings.LOG_LINES))),
+            # clients asking for plain text get the logs streamed as they are read
+            if follow or 'text/plain' in request.META.get('HTTP_ACCEPT', ''):
+                return StreamingHttpResponse(
+                    app.stream_logs(log_lines, follow, **options),
+                    content_type='text/plain')
+            return Response(app.logs(log_lines, **options),
                             status=status.HTTP_200_OK, content_type='text/plain')
+        except ValueError:
+            return Response({'detail': 'log_lines must be an integer'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except RuntimeError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except EnvironmentError:
             return Response("No logs for {}".format(app.id),
                             status=status.HTTP_204_NO_CONTENT,
@@ -242,7 +356,11 @@ class BuildViewSet(ReleasableViewSet):
     serializer_class = serializers.BuildSerializer
 
     def post_save(self, build):
-        self.release = build.create(self.request.user)
+        if self.prefers_async():
+            self.operation = operations.submit(self.request.user, build.app, 'build',
+                                               {'build': build.uuid})
+        else:
+            self.release = build.create(self.request.user)
         super(BuildViewSet, self).post_save(build)
 
 
@@ -252,8 +370,12 @@ class ConfigViewSet(ReleasableViewSet):
     serializer_class = serializers.ConfigSerializer
 
     def post_save(self, config):
-        release = config.app.release_set.latest()
+        release = config.app.get_latest_release()
         self.release = release.new(self.request.user, config=config, build=release.build)
+        if self.prefers_async():
+            self.operation = operations.submit(self.request.user, config.app, 'deploy',
+                                               {'release': self.release.uuid})
+            return
         try:
             config.app.deploy(self.request.user, self.release)
         except RuntimeError:
@@ -265,6 +387,7 @@ class ContainerViewSet(AppResourceViewSet):
     """A viewset for interacting with Container objects."""
     model = models.Container
     serializer_class = serializers.ContainerSerializer
+    related_fields = ('owner', 'app', 'release')
 
     def get_queryset(self, **kwargs):
         qs = super(ContainerViewSet, self).get_queryset(**kwargs)
@@ -279,15 +402,50 @@ class ContainerViewSet(AppResourceViewSet):
         qs = self.get_queryset(**kwargs)
         return qs.get(num=self.kwargs['num'])
 
+    def get_serializer_context(self):
+        context = super(ContainerViewSet, self).get_serializer_context()
+        context['states'] = getattr(self, 'states', None)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """
+        Resolve the state of every listed container with a single scheduler call instead of
+        one call per serialized container.
+        """
+        instance = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(instance)
+        containers = page.object_list if page is not None else instance
+        self.states = self.get_app().container_states(containers)
+        if page is not None:
+            serializer = self.get_pagination_serializer(page)
+        else:
+            serializer = self.get_serializer(instance, many=True)
+        return Response(serializer.data)
+
     def restart(self, *args, **kwargs):
+        if self.prefers_async():
+            params = {k: v for k, v in kwargs.items() if k in ('type', 'num')}
+            return self.accepted(
+                operations.submit(self.request.user, self.get_app(), 'restart', params))
         try:
-            containers = self.get_app().restart(**kwargs)
+            app = self.get_app()
+            containers = app.restart(**kwargs).select_related(*self.related_fields)
+            self.states = app.container_states(containers)
             serializer = self.get_serializer(containers, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
+class OperationViewSet(BaseDeisViewSet):
+    """A viewset for following the progress of asynchronous Operation objects."""
+    model = models.Operation
+    lookup_field = 'uuid'
+    related_fields = ('owner', 'app')
+    permission_classes = [IsAuthenticated, permissions.IsOwner]
+    serializer_class = serializers.OperationSerializer
+
+
 class DomainViewSet(AppResourceViewSet):
     """A viewset for interacting with Domain objects."""
     model = models.Domain
@@ -332,7 +490,7 @@ class ReleaseViewSet(AppResourceViewSet):
         """
         app = self.get_app()
         try:
-            release = app.release_set.latest()
+            release = app.get_latest_release()
             version_to_rollback_to = release.version - 1
             if request.data.get('version'):
                 version_to_rollback_to = int(request.data['version'])
@@ -381,12 +539,12 @@ class BuildHookViewSet(BaseHookViewSet):
         request.data['owner'] = self.user
         super(BuildHookViewSet, self).create(request, *args, **kwargs)
         # return the application databag
-        response = {'release': {'version': app.release_set.latest().version},
+        response = {'release': {'version': self.release.version},
                     'domains': ['.'.join([app.id, settings.DEIS_DOMAIN])]}
         return Response(response, status=status.HTTP_200_OK)
 
     def post_save(self, build):
-        build.create(self.user)
+        self.release = build.create(self.user)
 
 
 class ConfigHookViewSet(BaseHookViewSet):
@@ -400,7 +558,7 @@ class ConfigHookViewSet(BaseHookViewSet):
         # check the user is authorized for this app
         if not permissions.is_app_user(request, app):
             raise PermissionDenied()
-        config = app.release_set.latest().config
+        config = app.get_latest_release().config
         serializer = self.get_serializer(config)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -480,4 +638,5 @@ class UserView(BaseDeisViewSet):
     permission_classes = [permissions.IsAdmin]
 
     def get_queryset(self):
-        return self.model.objects.exclude(username='AnonymousUser')
+        return self.model.objects.exclude(username='AnonymousUser').prefetch_related(
+            'groups', 'user_permissions')
@@ -12,9 +12,12 @@ class OwnerViewSet(viewsets.ModelViewSet):
     the `model` attribute shortcut.
     """
     permission_classes = [IsAuthenticated, permissions.IsOwner]
+    # relations which are serialized along with each object, and so loaded in the same query
+    related_fields = ('owner',)
 
     def get_queryset(self):
-        return self.model.objects.filter(owner=self.request.user)
+        return self.model.objects.filter(owner=self.request.user).select_related(
+            *self.related_fields)
 
     def perform_create(self, serializer):
         obj = serializer.save(owner=self.request.user)
@@ -108,6 +108,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'api.middleware.QueryCountMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -251,7 +252,9 @@ LOGGING = {
             'class': 'django.utils.log.AdminEmailHandler'
         },
         'rsyslog': {
-            'class': 'logging.handlers.SysLogHandler',
+            # hand records to syslog on a background thread so callers never block on it
+            'class': 'api.logs.QueueHandler',
+            'target': 'logging.handlers.SysLogHandler',
             'address': SYSLOG_ADDRESS,
             'facility': 'local0',
         },
@@ -277,17 +280,98 @@ LOGGING = {
 TEST_RUNNER = 'api.tests.SilentDjangoTestSuiteRunner'
 
 # etcd settings
-ETCD_HOST, ETCD_PORT = os.environ.get('ETCD', '127.0.0.1:4001').split(',')[0].split(':')
+# ETCD may list several comma-separated endpoints, which are failed over between in turn
+ETCD_ENDPOINTS = [(host, int(port)) for host, port in (
+    e.strip().split(':') for e in os.environ.get('ETCD', '127.0.0.1:4001').split(','))]
+ETCD_HOST, ETCD_PORT = ETCD_ENDPOINTS[0]
+# seconds a request to etcd may spend trying endpoints, and how long to wait before trying again
+# once all of them have failed
+DEIS_ETCD_TIMEOUT = 10
+DEIS_ETCD_RETRY_INTERVAL = 5
+# changes to etcd are published in batches of up to DEIS_ETCD_OUTBOX_BATCH, checking for changes
+# recorded by other processes every DEIS_ETCD_OUTBOX_POLL_INTERVAL seconds
+DEIS_ETCD_OUTBOX_BATCH = 100
+DEIS_ETCD_OUTBOX_POLL_INTERVAL = 5
+# a snapshot of all domains and certificates is published to DEIS_ROUTING_SNAPSHOT_KEY, at most
+# once every DEIS_ROUTING_SNAPSHOT_DELAY seconds, for routers to reload once per batch of changes
+DEIS_ROUTING_SNAPSHOT_KEY = '/deis/routing'
+DEIS_ROUTING_SNAPSHOT_DELAY = 2
+# the state of every container on the scheduler is recorded every DEIS_RECONCILE_INTERVAL seconds
+# (0 disables it), and served for DEIS_CONTAINER_STATE_MAX_AGE seconds instead of asking again
+DEIS_RECONCILE_INTERVAL = 30
+DEIS_CONTAINER_STATE_MAX_AGE = 60
 
 # default deis settings
 DEIS_LOG_DIR = os.path.abspath(os.path.join(__file__, '..', '..', 'logs'))
 LOG_LINES = 1000
+# seconds a client may follow an app's logs for in a single request, and how many clients may
+# follow logs at once in each controller process. Each follower ties up a request worker for as
+# long as it lasts, so followers beyond that are turned away with 503 SERVICE UNAVAILABLE
+DEIS_LOG_FOLLOW_TIMEOUT = 60
+DEIS_LOG_FOLLOWERS = 2
+# app events are buffered and written out in batches of up to this many bytes, at least every
+# DEIS_LOG_FLUSH_INTERVAL seconds, keeping up to DEIS_LOG_OPEN_FILES log files open at once
+DEIS_LOG_BUFFER_SIZE = 65536
+DEIS_LOG_FLUSH_INTERVAL = 1
+DEIS_LOG_OPEN_FILES = 128
+# every process buffers its own events, so a line may be written after lines stamped up to this
+# many seconds later
+DEIS_LOG_MAX_DISORDER = 5
+# once an app's log grows past DEIS_LOG_SEGMENT_SIZE bytes it is compressed into a segment, indexed
+# every DEIS_LOG_INDEX_INTERVAL bytes, and only the newest DEIS_LOG_SEGMENTS segments are kept
+DEIS_LOG_SEGMENT_SIZE = 4194304
+DEIS_LOG_INDEX_INTERVAL = 65536
+DEIS_LOG_SEGMENTS = 10
+# filtering an app's logs scans back through at most this many bytes, for at most this many seconds
+DEIS_LOG_SCAN_LIMIT = 16777216
+DEIS_LOG_SCAN_TIMEOUT = 5
 TEMPDIR = tempfile.mkdtemp(prefix='deis')
 DEIS_DOMAIN = 'deisapp.local'
 
 # standard datetime format used for logging, model timestamps, etc.
 DEIS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S%Z'
 
+# number of background threads per controller process which carry out asynchronous operations
+# (scale, deploy, restart and delete requests sent with "Prefer: respond-async").
+# When set to 0, such operations are carried out within the request instead.
+DEIS_OPERATION_WORKERS = 4
+# seconds an idle operation worker waits before checking for operations queued elsewhere
+DEIS_OPERATION_POLL_INTERVAL = 5
+# seconds a running operation is leased to its worker. The worker keeps renewing the lease while
+# the operation runs; once it lapses, say because the process died, the operation is queued again
+DEIS_OPERATION_LEASE = 60
+
+# maximum number of container operations (create, start, stop, destroy) a controller process
+# sends to the scheduler at once, and how many of those a single app may use
+DEIS_CONTAINER_CONCURRENCY = 50
+DEIS_APP_CONTAINER_CONCURRENCY = 20
+
+# start each new container as soon as it has been created, rather than waiting for the whole
+# batch to be created first
+DEIS_PIPELINE_CONTAINER_START = True
+
+# maximum number of requests a controller process sends to etcd at once when publishing config
+DEIS_ETCD_CONCURRENCY = 10
+
+# seconds to wait for the publisher to announce new containers in etcd before healthchecking them
+DEIS_HEALTHCHECK_PUBLISH_TIMEOUT = 20
+
+# requests which make more than this many database queries are logged; DEIS_QUERY_BUDGETS sets
+# budgets for particular endpoints, named after the request method and view ("POST AppViewSet").
+# Counting slows every query down, so it only happens with DEBUG or DEIS_QUERY_COUNT on, and it
+# leaves out queries made on other threads, such as when containers are acted on in parallel
+DEIS_QUERY_COUNT = False
+DEIS_QUERY_BUDGET = 30
+DEIS_QUERY_BUDGETS = {
+    # creating an app, scaling it, deploying and tearing down record their changes to etcd and
+    # to the states of containers as well
+    'POST AppViewSet': 45,
+    'DELETE AppViewSet': 60,
+    'POST BuildViewSet': 40,
+    'POST ConfigViewSet': 80,
+    'POST ContainerViewSet': 50,
+}
+
 # names which apps cannot reserve for routing
 DEIS_RESERVED_NAMES = ['deis']
 
@@ -26,6 +26,13 @@ class Dispatcher(object):
 
     def __init__(self):
         self.django_handler = get_wsgi_application()
+        # pick up any operations which were queued before this process started
+        from api import operations, outbox, reconciler
+        operations.start()
+        # publish changes to etcd without holding up requests
+        outbox.start()
+        # keep track of what the scheduler runs, so requests need not ask it
+        reconciler.start()
         self.static_handler = static.Cling(os.path.dirname(os.path.dirname(__file__)))
 
     def __call__(self, environ, start_response):
@@ -1,3 +1,38 @@
+import importlib
+import json
+import os
+import re
+import threading
+
+
+# the name of the job scheduled for an app container, such as "myapp_v2.web.1"
+JOB_NAME = re.compile(r'^(?P<app>[a-z0-9-]+)_v(?P<version>[0-9]+)\.(?P<type>[a-z0-9_-]+)\.'
+                      r'(?P<num>[0-9]+)$')
+
+_registry = {'pid': None, 'clients': {}}
+_registry_lock = threading.Lock()
+
+
+def get_client(module, target, auth, options, pkey):
+    """
+    Return this process' client for the given scheduler backend, building it on first use.
+
+    Clients are shared by every thread in the process, so backends keep any connections they
+    hold per thread.
+    """
+    key = (module, target, auth, json.dumps(options, sort_keys=True), pkey)
+    with _registry_lock:
+        # connections do not survive a fork, so every process builds its own clients
+        if _registry['pid'] != os.getpid():
+            _registry['pid'] = os.getpid()
+            _registry['clients'] = {}
+        client = _registry['clients'].get(key)
+        if client is None:
+            mod = importlib.import_module(module)
+            client = mod.SchedulerClient(target, auth, options, pkey)
+            _registry['clients'][key] = client
+        return client
+
 
 class AbstractSchedulerClient(object):
     """
@@ -30,6 +65,22 @@ class AbstractSchedulerClient(object):
         """Display the given job's running state."""
         raise NotImplementedError
 
+    def states(self, names):
+        """Display the running state of several jobs at once.
+
+        Returns a dict mapping each job name to its :class:`~scheduler.states.JobState`.
+        Backends should override this to answer with a single round trip to the scheduler.
+        """
+        return {name: self.state(name) for name in names}
+
+    def list(self):
+        """List the running state of every app container job the scheduler knows of.
+
+        Returns a dict mapping each job name to its :class:`~scheduler.states.JobState`, fetched
+        in bulk. Backends which cannot list their jobs raise :class:`NotImplementedError`.
+        """
+        raise NotImplementedError
+
     def stop(self, name):
         """Stop a container."""
         raise NotImplementedError
@@ -3,20 +3,24 @@ import copy
 import cStringIO
 import httplib
 import json
+import os
 import paramiko
 import re
 import socket
+import threading
 import time
 
 from django.conf import settings
 
-from . import AbstractSchedulerClient
+from . import AbstractSchedulerClient, JOB_NAME
 from .states import JobState
 
 
 MATCH = re.compile(
     '(?P<app>[a-z0-9-]+)_?(?P<version>v[0-9]+)?\.?(?P<c_type>[a-z-_]+)?.(?P<c_num>[0-9]+)')
 RETRIES = 3
+# seconds between two fetches of the cluster state while anyone is waiting on a unit
+POLL_INTERVAL = 1
 
 
 class UHTTPConnection(httplib.HTTPConnection):
@@ -33,26 +37,133 @@ class UHTTPConnection(httplib.HTTPConnection):
         self.sock = sock
 
 
+class ClusterStatePoller(object):
+    """
+    Fetches the state of every unit on the cluster on behalf of all threads waiting on a unit.
+
+    A single background thread polls fleet once per POLL_INTERVAL for as long as anyone is
+    waiting, so the number of requests sent to fleet does not grow with the number of waiters.
+    """
+
+    def __init__(self, target):
+        self._client = FleetHTTPClient(target, None, None, None)
+        self._cond = threading.Condition()
+        self._units = {}
+        # number of polls started, and the number of the poll the current snapshot comes from
+        self._polls = 0
+        self._generation = 0
+        self._waiters = 0
+        self._thread = None
+
+    def wait_for(self, name, predicate, timeout):
+        """
+        Block until predicate holds for the named unit's state, then return that state.
+
+        The predicate is passed the unit's state from fleet, or None if fleet has no state for
+        it. Only snapshots taken after the call began are considered.
+        """
+        unit = '{}.service'.format(name)
+        deadline = time.time() + timeout
+        with self._cond:
+            self._waiters += 1
+            try:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._poll, name='fleet-state-poller')
+                    self._thread.daemon = True
+                    self._thread.start()
+                first = self._polls + 1
+                while True:
+                    if self._generation >= first:
+                        state = self._units.get(unit)
+                        if predicate(state):
+                            return state
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError('timeout waiting for unit {}'.format(unit))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+
+    def _poll(self):
+        while True:
+            with self._cond:
+                if not self._waiters:
+                    self._thread = None
+                    return
+                self._polls += 1
+                generation = self._polls
+            try:
+                units = {s['name']: s for s in self._client._get_all_states()}
+            except Exception:
+                units = None
+            if units is not None:
+                with self._cond:
+                    self._units = units
+                    self._generation = generation
+                    self._cond.notify_all()
+            time.sleep(POLL_INTERVAL)
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def get_poller(target):
+    """Return this process' cluster state poller for the fleet API at target."""
+    with _pollers_lock:
+        # threads do not survive a fork, so every process gets its own pollers
+        if _pollers.get('pid') != os.getpid():
+            _pollers.clear()
+            _pollers['pid'] = os.getpid()
+        if target not in _pollers:
+            _pollers[target] = ClusterStatePoller(target)
+        return _pollers[target]
+
+
 class FleetHTTPClient(AbstractSchedulerClient):
 
     def __init__(self, target, auth, options, pkey):
         super(FleetHTTPClient, self).__init__(target, auth, options, pkey)
-        # single global connection
-        self.conn = UHTTPConnection(self.target)
+        # every thread keeps its own persistent connection
+        self._local = threading.local()
 
     # connection helpers
 
-    def _request_unit(self, method, name, body=None):
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = UHTTPConnection(self.target)
+        return conn
+
+    def _request(self, method, url, body=None):
+        """
+        Send a request over this thread's connection and return the response and its body.
+
+        A connection which fails is closed so that the next request opens a fresh one. Requests
+        on a kept-alive connection which fleet has since dropped are retried once.
+        """
         headers = {'Content-Type': 'application/json'}
-        self.conn.request(method, '/v1-alpha/units/{name}.service'.format(**locals()),
-                                  headers=headers, body=json.dumps(body))
-        return self.conn.getresponse()
+        for attempt in xrange(2):
+            conn = self.conn
+            reused = conn.sock is not None
+            try:
+                conn.request(method, url, headers=headers, body=body)
+                resp = conn.getresponse()
+                return resp, resp.read()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if attempt or not reused:
+                    raise
+
+    def _request_unit(self, method, name, body=None):
+        return self._request(method, '/v1-alpha/units/{name}.service'.format(**locals()),
+                             json.dumps(body))
 
     def _get_unit(self, name):
         for attempt in xrange(RETRIES):
             try:
-                resp = self._request_unit('GET', name)
-                data = resp.read()
+                resp, data = self._request_unit('GET', name)
                 if not 200 <= resp.status <= 299:
                     errmsg = "Failed to retrieve unit: {} {} - {}".format(
                         resp.status, resp.reason, data)
@@ -65,8 +176,7 @@ class FleetHTTPClient(AbstractSchedulerClient):
     def _put_unit(self, name, body):
         for attempt in xrange(RETRIES):
             try:
-                resp = self._request_unit('PUT', name, body)
-                data = resp.read()
+                resp, data = self._request_unit('PUT', name, body)
                 if not 200 <= resp.status <= 299:
                     errmsg = "Failed to create unit: {} {} - {}".format(
                         resp.status, resp.reason, data)
@@ -77,11 +187,7 @@ class FleetHTTPClient(AbstractSchedulerClient):
                     raise
 
     def _delete_unit(self, name):
-        headers = {'Content-Type': 'application/json'}
-        self.conn.request('DELETE', '/v1-alpha/units/{name}.service'.format(**locals()),
-                          headers=headers)
-        resp = self.conn.getresponse()
-        data = resp.read()
+        resp, data = self._request('DELETE', '/v1-alpha/units/{name}.service'.format(**locals()))
         if resp.status not in (404, 204):
             errmsg = "Failed to delete unit: {} {} - {}".format(
                 resp.status, resp.reason, data)
@@ -89,25 +195,37 @@ class FleetHTTPClient(AbstractSchedulerClient):
         return data
 
     def _get_state(self, name=None):
-        headers = {'Content-Type': 'application/json'}
         url = '/v1-alpha/state'
         if name:
             url += '?unitName={name}.service'.format(**locals())
-        self.conn.request('GET', url, headers=headers)
-        resp = self.conn.getresponse()
-        data = resp.read()
+        resp, data = self._request('GET', url)
         if resp.status not in (200,):
             errmsg = "Failed to retrieve state: {} {} - {}".format(
                 resp.status, resp.reason, data)
             raise RuntimeError(errmsg)
         return json.loads(data)
 
+    def _get_all_states(self):
+        """Return the state of every unit on the cluster, following fleet's pagination."""
+        states = []
+        token = None
+        while True:
+            url = '/v1-alpha/state'
+            if token:
+                url += '?nextPageToken={token}'.format(**locals())
+            resp, data = self._request('GET', url)
+            if resp.status not in (200,):
+                errmsg = "Failed to retrieve state: {} {} - {}".format(
+                    resp.status, resp.reason, data)
+                raise RuntimeError(errmsg)
+            page = json.loads(data)
+            states.extend(page.get('states', []))
+            token = page.get('nextPageToken')
+            if not token:
+                return states
+
     def _get_machines(self):
-        headers = {'Content-Type': 'application/json'}
-        url = '/v1-alpha/machines'
-        self.conn.request('GET', url, headers=headers)
-        resp = self.conn.getresponse()
-        data = resp.read()
+        resp, data = self._request('GET', '/v1-alpha/machines')
         if resp.status not in (200,):
             errmsg = "Failed to retrieve machines: {} {} - {}".format(
                 resp.status, resp.reason, data)
@@ -177,12 +295,9 @@ class FleetHTTPClient(AbstractSchedulerClient):
 
     def _wait_for_container_state(self, name):
         # wait for container to get scheduled
-        for _ in xrange(30):
-            states = self._get_state(name)
-            if states and len(states.get('states', [])) == 1:
-                return states.get('states')[0]
-            time.sleep(1)
-        else:
+        try:
+            return get_poller(self.target).wait_for(name, lambda s: s is not None, 30)
+        except RuntimeError:
             raise RuntimeError('container timeout while retrieving state')
 
     def _wait_for_container_running(self, name):
@@ -193,20 +308,22 @@ class FleetHTTPClient(AbstractSchedulerClient):
             raise RuntimeError('container failed to start')
 
     def _wait_for_job_state(self, name, state):
+        def _reached(unit_state):
+            try:
+                return unit_state is not None and self._job_state(unit_state) == state
+            except KeyError:
+                return False
+
         # we bump to 20 minutes here to match the timeout on the router and in the app unit files
-        for _ in xrange(1200):
-            if self.state(name) == state:
-                return
-            time.sleep(1)
-        else:
+        try:
+            get_poller(self.target).wait_for(name, _reached, 1200)
+        except RuntimeError:
             raise RuntimeError('timeout waiting for job state: {}'.format(state))
 
     def _wait_for_destroy(self, name):
-        for _ in xrange(30):
-            if not self._get_state(name):
-                break
-            time.sleep(1)
-        else:
+        try:
+            get_poller(self.target).wait_for(name, lambda s: s is None, 30)
+        except RuntimeError:
             raise RuntimeError('timeout on container destroy')
 
     def stop(self, name):
@@ -336,26 +453,12 @@ class FleetHTTPClient(AbstractSchedulerClient):
 
     def state(self, name):
         """Display the given job's running state."""
-        systemdActiveStateMap = {
-            'active': 'up',
-            'reloading': 'down',
-            'inactive': 'created',
-            'failed': 'crashed',
-            'activating': 'down',
-            'deactivating': 'down',
-        }
         try:
             # NOTE (bacongobbler): this call to ._get_unit() acts as a pre-emptive check to
             # determine if the job no longer exists (will raise a RuntimeError on 404)
             self._get_unit(name)
             state = self._wait_for_container_state(name)
-            activeState = state['systemdActiveState']
-            # FIXME (bacongobbler): when fleet loads a job, sometimes it'll automatically start and
-            # stop the container, which in our case will return as 'failed', even though
-            # the container is perfectly fine.
-            if activeState == 'failed' and state['systemdLoadState'] == 'loaded':
-                return JobState.created
-            return getattr(JobState, systemdActiveStateMap[activeState])
+            return self._job_state(state)
         except KeyError:
             # failed retrieving a proper response from the fleet API
             return JobState.error
@@ -364,6 +467,57 @@ class FleetHTTPClient(AbstractSchedulerClient):
             # which means it does not exist
             return JobState.destroyed
 
+    def states(self, names):
+        """Display the running state of several jobs with a single fleet API call."""
+        try:
+            unit_states = {s['name']: s for s in self._get_all_states()}
+        except RuntimeError:
+            return {name: JobState.error for name in names}
+        states = {}
+        for name in names:
+            state = unit_states.get('{}.service'.format(name))
+            if state is None:
+                # fleet has no state for units which are submitted but not yet scheduled or
+                # loaded, so look for the unit itself before calling it destroyed
+                states[name] = self.state(name)
+                continue
+            try:
+                states[name] = self._job_state(state)
+            except KeyError:
+                states[name] = JobState.error
+        return states
+
+    def list(self):
+        """List the running state of every app container job with a single fleet API call."""
+        states = {}
+        for state in self._get_all_states():
+            name = state['name'].rsplit('.service', 1)[0]
+            if not JOB_NAME.match(name):
+                # platform units and other units deis did not schedule
+                continue
+            try:
+                states[name] = self._job_state(state)
+            except KeyError:
+                states[name] = JobState.error
+        return states
+
+    def _job_state(self, state):
+        systemdActiveStateMap = {
+            'active': 'up',
+            'reloading': 'down',
+            'inactive': 'created',
+            'failed': 'crashed',
+            'activating': 'down',
+            'deactivating': 'down',
+        }
+        activeState = state['systemdActiveState']
+        # FIXME (bacongobbler): when fleet loads a job, sometimes it'll automatically start and
+        # stop the container, which in our case will return as 'failed', even though
+        # the container is perfectly fine.
+        if activeState == 'failed' and state['systemdLoadState'] == 'loaded':
+            return JobState.created
+        return getattr(JobState, systemdActiveStateMap[activeState])
+
 SchedulerClient = FleetHTTPClient
 
 
@@ -1,10 +1,14 @@
 import copy
 import httplib
 import json
+import math
 import random
 import re
+import socket
 import string
+import threading
 import time
+import urllib
 
 from django.conf import settings
 from docker import Client
@@ -96,6 +100,62 @@ POD_DELETE = '''{
 RETRIES = 3
 MATCH = re.compile(
     r'(?P<app>[a-z0-9-]+)_?(?P<version>v[0-9]+)?\.?(?P<c_type>[a-z-_]+)')
+# maximum number of idle keep-alive connections kept open to the k8s API server
+POOL_SIZE = 10
+# requests which may safely be sent again if the server drops the connection before answering
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE'])
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of keep-alive HTTP connections to a single host."""
+
+    def __init__(self, host, maxsize=POOL_SIZE):
+        self.host = host
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def get(self, fresh=False):
+        """Return an idle connection, or a new one if none is idle or fresh is set."""
+        if not fresh:
+            with self._lock:
+                if self._idle:
+                    return self._idle.pop()
+        return httplib.HTTPConnection(self.host)
+
+    def put(self, conn):
+        """Hand a connection back once its response has been read in full."""
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+def _iter_lines(resp):
+    """Yield the lines of a streamed response body as they arrive."""
+    if not resp.chunked:
+        for line in iter(resp.fp.readline, ''):
+            yield line
+        return
+    # httplib only reads chunked bodies in full, so take the chunks apart ourselves
+    buf = ''
+    while True:
+        size = int(resp.fp.readline().split(';')[0], 16)
+        if size == 0:
+            break
+        buf += resp.fp.read(size)
+        resp.fp.read(2)
+        while '\n' in buf:
+            line, buf = buf.split('\n', 1)
+            yield line
+    if buf:
+        yield buf
+
+
+def _live_pods(pods):
+    """Return the given pods which are not being deleted."""
+    return [pod for pod in pods.values() if not pod['metadata'].get('deletionTimestamp')]
 
 
 class KubeHTTPClient(AbstractSchedulerClient):
@@ -106,21 +166,48 @@ class KubeHTTPClient(AbstractSchedulerClient):
         self.port = "8080"
         self.registry = settings.REGISTRY_HOST+":"+settings.REGISTRY_PORT
         self.apiversion = "v1"
-        self.conn = httplib.HTTPConnection(self.target+":"+self.port)
+        self.pool = ConnectionPool(self.target+":"+self.port)
+
+    def _request(self, method, path, body=None, error=None):
+        """
+        Send a request to the API server and return its status, body and reason.
+
+        Connections are taken from and returned to the pool. A failing connection is thrown
+        away, and an idempotent request on a kept-alive connection the server has since dropped
+        is retried once on a fresh one. Other requests, such as creating a pod, may have been
+        carried out before the connection dropped, so they are sent once on a fresh connection
+        instead. If error is given, a RuntimeError starting with it is raised for any response
+        outside of 2xx.
+        """
+        path = '/api/'+self.apiversion+path
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        idempotent = method in IDEMPOTENT_METHODS
+        for attempt in xrange(2):
+            conn = self.pool.get(fresh=attempt > 0 or not idempotent)
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, headers=headers, body=body)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if attempt or not reused:
+                    raise
+                continue
+            if resp.will_close:
+                conn.close()
+            else:
+                self.pool.put(conn)
+            break
+        status, reason = resp.status, resp.reason
+        if error and not 200 <= status <= 299:
+            raise RuntimeError("{}: {} {} - {}".format(error, status, reason, data))
+        return (status, data, reason)
 
     def _get_old_rc(self, name, app_type):
-        con_app = httplib.HTTPConnection(self.target+":"+self.port)
-        con_app.request('GET', '/api/'+self.apiversion +
-                        '/namespaces/'+name+'/replicationcontrollers')
-        resp = con_app.getresponse()
-        data = resp.read()
-        reason = resp.reason
-        status = resp.status
-        con_app.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to get Replication Controllers: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
+        status, data, reason = self._request(
+            'GET', '/namespaces/'+name+'/replicationcontrollers',
+            error='Failed to get Replication Controllers')
         parsed_json = json.loads(data)
         exists = False
         prev_rc = []
@@ -136,27 +223,14 @@ class KubeHTTPClient(AbstractSchedulerClient):
             return 0
 
     def _get_rc_status(self, name, namespace):
-        conn_rc = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_rc.request('GET', '/api/'+self.apiversion+'/' +
-                        'namespaces/'+namespace+'/replicationcontrollers/'+name)
-        resp = conn_rc.getresponse()
-        status = resp.status
-        conn_rc.close()
+        status, data, reason = self._request(
+            'GET', '/namespaces/'+namespace+'/replicationcontrollers/'+name)
         return status
 
     def _get_rc_(self, name, namespace):
-        conn_rc_resver = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_rc_resver.request('GET', '/api/'+self.apiversion+'/' +
-                               'namespaces/'+namespace+'/replicationcontrollers/'+name)
-        resp = conn_rc_resver.getresponse()
-        data = resp.read()
-        reason = resp.reason
-        status = resp.status
-        conn_rc_resver.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to get Replication Controller:{} {} {} - {}".format(
-                name, status, reason, data)
-            raise RuntimeError(errmsg)
+        status, data, reason = self._request(
+            'GET', '/namespaces/'+namespace+'/replicationcontrollers/'+name,
+            error='Failed to get Replication Controller '+name)
         parsed_json = json.loads(data)
         return parsed_json
 
@@ -164,16 +238,25 @@ class KubeHTTPClient(AbstractSchedulerClient):
         app_name = kwargs.get('aname', {})
         app_type = name.split(".")[1]
         old_rc = self._get_old_rc(app_name, app_type)
-        new_rc = self._create_rc(name, image, command, **kwargs)
         desired = int(old_rc["spec"]["replicas"])
+        # work out the limits first, so bad ones fail the deploy before anything has changed
+        surge, unavailable = self._rollout_limits(desired, **kwargs)
+        new_rc = self._create_rc(name, image, command, **kwargs)
         old_rc_name = old_rc["metadata"]["name"]
         new_rc_name = new_rc["metadata"]["name"]
         try:
-            count = 1
-            while desired >= count:
-                new_rc = self._scale_app(new_rc_name, count, app_name)
-                old_rc = self._scale_app(old_rc_name, desired-count, app_name)
-                count += 1
+            new_count, old_count = 0, desired
+            while new_count < desired or old_count > 0:
+                # bring up as many new pods as the surge allows; _scale_app returns once they run
+                target = min(desired, desired + surge - old_count)
+                if target > new_count:
+                    new_count = target
+                    self._scale_app(new_rc_name, new_count, app_name)
+                # then retire as many old pods as availability allows
+                target = max(0, desired - unavailable - new_count)
+                if target < old_count:
+                    old_count = target
+                    self._scale_app(old_rc_name, old_count, app_name)
         except Exception as e:
             self._scale_app(new_rc["metadata"]["name"], 0, app_name)
             self._delete_rc(new_rc["metadata"]["name"], app_name)
@@ -182,83 +265,144 @@ class KubeHTTPClient(AbstractSchedulerClient):
             raise RuntimeError(err)
         self._delete_rc(old_rc_name, app_name)
 
-    def _get_events(self, namespace):
-        con_get = httplib.HTTPConnection(self.target+":"+self.port)
-        con_get.request('GET', '/api/'+self.apiversion+'/namespaces/'+namespace+'/events')
-        resp = con_get.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_get.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to get events: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
-        return (status, data, reason)
+    def _rollout_limits(self, desired, **kwargs):
+        """
+        Return how many pods a rollout may add above, and take away below, the desired count.
+
+        maxSurge and maxUnavailable are read from the app's deploy options, falling back to
+        SCHEDULER_OPTIONS. Either may be a number of pods or a percentage of the desired count.
+        By default pods are replaced one at a time without ever dropping below the desired count.
+        """
+        options = self.options or {}
+
+        def _limit(key, default, rounding):
+            value = kwargs[key] if kwargs.get(key) is not None else options.get(key, default)
+            value = str(value).strip()
+            if value.endswith('%'):
+                return int(rounding(desired * float(value[:-1]) / 100))
+            return int(value)
+
+        surge = _limit('maxSurge', 1, math.ceil)
+        unavailable = _limit('maxUnavailable', 0, math.floor)
+        if surge <= 0 and unavailable <= 0:
+            # the rollout could never make any progress
+            surge = 1
+        return max(surge, 0), max(unavailable, 0)
 
-    def _get_schedule_status(self, name, num, namespace):
-        pods = []
-        for _ in xrange(120):
-            count = 0
-            pods = []
-            status, data, reason = self._get_pods(namespace)
-            parsed_json = json.loads(data)
-            for pod in parsed_json['items']:
-                if pod['metadata']['generateName'] == name+'-':
-                    count += 1
-                    pods.append(pod['metadata']['name'])
-            if count == num:
-                break
-            time.sleep(1)
-        for _ in xrange(120):
+    def _get_events(self, namespace):
+        return self._request('GET', '/namespaces/'+namespace+'/events',
+                             error='Failed to get events')
+
+    def _watch(self, path, params):
+        """
+        Follow the watch API at path and yield each event as it arrives.
+
+        Watches hold their connection open for as long as they last, so they get a connection of
+        their own rather than one from the pool.
+        """
+        timeout = params.get('timeoutSeconds')
+        conn = httplib.HTTPConnection(self.pool.host, timeout=timeout and timeout + 5)
+        try:
+            conn.request('GET', '/api/'+self.apiversion+path+'?'+urllib.urlencode(params))
+            resp = conn.getresponse()
+            if not 200 <= resp.status <= 299:
+                errmsg = "Failed to watch {}: {} {} - {}".format(
+                    path, resp.status, resp.reason, resp.read())
+                raise RuntimeError(errmsg)
+            for line in _iter_lines(resp):
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+    def _watch_until(self, path, params, done, timeout):
+        """
+        Wait until done() holds for the objects at path matching the given query params.
+
+        The objects are listed once and then kept up to date from the watch API, resuming from
+        the last resourceVersion seen, so this wakes up on actual changes instead of polling.
+        done() is passed a dict of the objects by name. Returns whether it held before timeout
+        seconds were up.
+        """
+        deadline = time.time() + timeout
+        items = None
+        while True:
+            if items is None:
+                status, data, reason = self._request(
+                    'GET', path+'?'+urllib.urlencode(params), error='Failed to list '+path)
+                listing = json.loads(data)
+                items = {o['metadata']['name']: o for o in listing.get('items') or []}
+                version = listing['metadata']['resourceVersion']
+            if done(items):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            watch = dict(params, watch='true', resourceVersion=version,
+                         timeoutSeconds=int(remaining) + 1)
+            try:
+                for event in self._watch(path, watch):
+                    if event['type'] == 'ERROR':
+                        # our resourceVersion is too old to resume from, so list again
+                        items = None
+                        break
+                    obj = event['object']
+                    version = obj['metadata']['resourceVersion']
+                    if event['type'] == 'DELETED':
+                        items.pop(obj['metadata']['name'], None)
+                    else:
+                        items[obj['metadata']['name']] = obj
+                    if done(items):
+                        return True
+                    if time.time() >= deadline:
+                        return False
+            except (socket.error, httplib.HTTPException):
+                # resume from the last resourceVersion seen
+                pass
+
+    def _get_schedule_status(self, name, num, namespace, selector):
+        pods = {}
+
+        def _created(items):
+            pods.clear()
+            pods.update(items)
+            return len(_live_pods(items)) == num
+
+        if not self._watch_until('/namespaces/'+namespace+'/pods',
+                                 {'labelSelector': selector}, _created, 120):
+            raise RuntimeError('timed out waiting for pods of {} to be created'.format(name))
+
+        def _scheduled(events):
             count = 0
-            status, data, reason = self._get_events(namespace)
-            parsed_json = json.loads(data)
-            for event in parsed_json['items']:
+            for event in events.values():
                 if(event['involvedObject']['name'] in pods and
-                   event['source']['component'] == 'scheduler'):
+                   event['source'].get('component') == 'scheduler'):
                     if event['reason'] == 'scheduled':
                         count += 1
                     else:
                         raise RuntimeError(event['message'])
-            if count == num:
-                break
-            time.sleep(1)
+            return count == num
+
+        if not self._watch_until('/namespaces/'+namespace+'/events',
+                                 {'fieldSelector': 'involvedObject.kind=Pod'}, _scheduled, 120):
+            raise RuntimeError('timed out waiting for pods of {} to be scheduled'.format(name))
 
     def _scale_rc(self, rc, namespace):
         name = rc['metadata']['name']
         num = rc["spec"]["replicas"]
-        headers = {'Content-Type': 'application/json'}
-        conn_scalepod = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_scalepod.request('PUT', '/api/'+self.apiversion+'/namespaces/'+namespace+'/' +
-                              'replicationcontrollers/'+name, headers=headers, body=json.dumps(rc))
-        resp = conn_scalepod.getresponse()
-        data = resp.read()
-        reason = resp.reason
-        status = resp.status
-        conn_scalepod.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to scale Replication Controller:{} {} {} - {}".format(
-                name, status, reason, data)
-            raise RuntimeError(errmsg)
-        resource_ver = rc['metadata']['resourceVersion']
-        for _ in xrange(30):
-            js_template = self._get_rc_(name, namespace)
-            if js_template["metadata"]["resourceVersion"] != resource_ver:
-                break
-            time.sleep(1)
-        self._get_schedule_status(name, num, namespace)
-        for _ in xrange(120):
-            count = 0
-            status, data, reason = self._get_pods(namespace)
-            parsed_json = json.loads(data)
-            for pod in parsed_json['items']:
-                if(pod['metadata']['generateName'] == name+'-' and
-                   pod['status']['phase'] == 'Running'):
-                    count += 1
-            if count == num:
-                break
-            time.sleep(1)
+        self._request('PUT', '/namespaces/'+namespace+'/replicationcontrollers/'+name,
+                      body=json.dumps(rc), error='Failed to scale Replication Controller '+name)
+        selector = ','.join('{}={}'.format(*label)
+                            for label in sorted(rc['spec']['selector'].items()))
+        self._get_schedule_status(name, num, namespace, selector)
+
+        def _running(items):
+            return len([pod for pod in _live_pods(items)
+                        if pod['status'].get('phase') == 'Running']) == num
+
+        if not self._watch_until('/namespaces/'+namespace+'/pods',
+                                 {'labelSelector': selector}, _running, 120):
+            raise RuntimeError('timed out waiting for pods of {} to be running'.format(name))
 
     def _scale_app(self, name, num, namespace):
         js_template = self._get_rc_(name, namespace)
@@ -321,19 +465,9 @@ class KubeHTTPClient(AbstractSchedulerClient):
         if cpu:
             cpu = float(cpu)/1024
             containers[0]["resources"]["limits"]["cpu"] = cpu
-        headers = {'Content-Type': 'application/json'}
-        conn_rc = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_rc.request('POST', '/api/'+self.apiversion+'/namespaces/'+app_name+'/' +
-                        'replicationcontrollers', headers=headers, body=json.dumps(js_template))
-        resp = conn_rc.getresponse()
-        data = resp.read()
-        reason = resp.reason
-        status = resp.status
-        conn_rc.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to create Replication Controller:{} {} {} - {}".format(
-                name, status, reason, data)
-            raise RuntimeError(errmsg)
+        status, data, reason = self._request(
+            'POST', '/namespaces/'+app_name+'/replicationcontrollers',
+            body=json.dumps(js_template), error='Failed to create Replication Controller '+name)
         create = False
         for _ in xrange(30):
             if not create and self._get_rc_status(name, app_name) == 404:
@@ -363,18 +497,8 @@ class KubeHTTPClient(AbstractSchedulerClient):
             raise RuntimeError(err)
 
     def _get_service(self, name, namespace):
-        con_get = httplib.HTTPConnection(self.target+":"+self.port)
-        con_get.request('GET', '/api/'+self.apiversion+'/namespaces/'+namespace+'/services/'+name)
-        resp = con_get.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_get.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to get Service: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
-        return (status, data, reason)
+        return self._request('GET', '/namespaces/'+namespace+'/services/'+name,
+                             error='Failed to get Service')
 
     def _create_service(self, name, app_name, app_type):
         random.seed(app_name)
@@ -404,15 +528,8 @@ class KubeHTTPClient(AbstractSchedulerClient):
         l['type'] = app_type
         l["name"] = appname
         template = string.Template(SERVICE_TEMPLATE).substitute(l)
-        headers = {'Content-Type': 'application/json'}
-        conn_serv = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_serv.request('POST', '/api/'+self.apiversion+'/namespaces/'+app_name+'/services',
-                          headers=headers, body=copy.deepcopy(template))
-        resp = conn_serv.getresponse()
-        data = resp.read()
-        reason = resp.reason
-        status = resp.status
-        conn_serv.close()
+        status, data, reason = self._request('POST', '/namespaces/'+app_name+'/services',
+                                             body=copy.deepcopy(template))
         if status == 409:
             status, data, reason = self._get_service(appname, app_name)
             srv = json.loads(data)
@@ -420,21 +537,10 @@ class KubeHTTPClient(AbstractSchedulerClient):
                 return
             srv['spec']['selector']['type'] = app_type
             srv['spec']['ports'][0]['targetPort'] = port
-            headers = {'Content-Type': 'application/json'}
-            conn_scalepod = httplib.HTTPConnection(self.target+":"+self.port)
-            conn_scalepod.request('PUT', '/api/'+self.apiversion+'/namespaces/'+app_name+'/' +
-                                  'services/'+appname, headers=headers, body=json.dumps(srv))
-            resp = conn_scalepod.getresponse()
-            data = resp.read()
-            reason = resp.reason
-            status = resp.status
-            conn_scalepod.close()
-            if not 200 <= status <= 299:
-                errmsg = "Failed to update the Service:{} {} {} - {}".format(
-                    name, status, reason, data)
-                raise RuntimeError(errmsg)
+            self._request('PUT', '/namespaces/'+app_name+'/services/'+appname,
+                          body=json.dumps(srv), error='Failed to update the Service '+name)
         elif not 200 <= status <= 299:
-            errmsg = "Failed to create Service:{} {} {} - {}".format(
+            errmsg = "Failed to create Service {}: {} {} - {}".format(
                      name, status, reason, data)
             raise RuntimeError(errmsg)
 
@@ -447,19 +553,8 @@ class KubeHTTPClient(AbstractSchedulerClient):
         pass
 
     def _delete_rc(self, name, namespace):
-        headers = {'Content-Type': 'application/json'}
-        con_dest = httplib.HTTPConnection(self.target+":"+self.port)
-        con_dest.request('DELETE', '/api/'+self.apiversion+'/namespaces/'+namespace+'/' +
-                         'replicationcontrollers/'+name, headers=headers, body=POD_DELETE)
-        resp = con_dest.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_dest.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to delete Replication Controller:{} {} {} - {}".format(
-                name, status, reason, data)
-            raise RuntimeError(errmsg)
+        self._request('DELETE', '/namespaces/'+namespace+'/replicationcontrollers/'+name,
+                      body=POD_DELETE, error='Failed to delete Replication Controller '+name)
 
     def destroy(self, name):
         """Destroy a container."""
@@ -468,35 +563,22 @@ class KubeHTTPClient(AbstractSchedulerClient):
         name = name[0]+'-'+name[1]
         name = name.replace("_", "-")
 
-        headers = {'Content-Type': 'application/json'}
-        con_dest = httplib.HTTPConnection(self.target+":"+self.port)
-        con_dest.request('DELETE', '/api/'+self.apiversion+'/namespaces/'+appname+'/' +
-                         'replicationcontrollers/'+name, headers=headers, body=POD_DELETE)
-        resp = con_dest.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_dest.close()
+        status, data, reason = self._request(
+            'DELETE', '/namespaces/'+appname+'/replicationcontrollers/'+name, body=POD_DELETE)
         if status == 404:
             return
         if not 200 <= status <= 299:
-            errmsg = "Failed to delete Replication Controller:{} {} {} - {}".format(
+            errmsg = "Failed to delete Replication Controller {}: {} {} - {}".format(
                 name, status, reason, data)
             raise RuntimeError(errmsg)
 
         random.seed(appname)
         app_id = random.randint(1, 100000)
         app_name = "app-"+str(app_id)
-        con_serv = httplib.HTTPConnection(self.target+":"+self.port)
-        con_serv.request('DELETE', '/api/'+self.apiversion +
-                         '/namespaces/'+appname+'/services/'+app_name)
-        resp = con_serv.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_serv.close()
+        status, data, reason = self._request('DELETE',
+                                             '/namespaces/'+appname+'/services/'+app_name)
         if status != 404 and not 200 <= status <= 299:
-            errmsg = "Failed to delete service:{} {} {} - {}".format(
+            errmsg = "Failed to delete service {}: {} {} - {}".format(
                 name, status, reason, data)
             raise RuntimeError(errmsg)
 
@@ -505,56 +587,21 @@ class KubeHTTPClient(AbstractSchedulerClient):
         for pod in parsed_json['items']:
             if 'generateName' in pod['metadata'] and pod['metadata']['generateName'] == name+'-':
                 self._delete_pod(pod['metadata']['name'], appname)
-        con_ns = httplib.HTTPConnection(self.target+":"+self.port)
-        con_ns.request('DELETE', '/api/'+self.apiversion+'/namespaces/'+appname)
-        resp = con_ns.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_ns.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to delete namespace:{} {} {} - {}".format(
-                appname, status, reason, data)
-            raise RuntimeError(errmsg)
+        self._request('DELETE', '/namespaces/'+appname,
+                      error='Failed to delete namespace '+appname)
 
     def _get_pod(self, name, namespace):
-        conn_pod = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_pod.request('GET', '/api/'+self.apiversion+'/namespaces/'+namespace+'/pods/'+name)
-        resp = conn_pod.getresponse()
-        status = resp.status
-        data = resp.read()
-        reason = resp.reason
-        conn_pod.close()
-        return (status, data, reason)
+        return self._request('GET', '/namespaces/'+namespace+'/pods/'+name)
 
-    def _get_pods(self, namespace):
-        con_get = httplib.HTTPConnection(self.target+":"+self.port)
-        con_get.request('GET', '/api/'+self.apiversion+'/namespaces/'+namespace+'/pods')
-        resp = con_get.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_get.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to get Pods: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
-        return (status, data, reason)
+    def _get_pods(self, namespace, selector=None):
+        path = '/namespaces/'+namespace+'/pods'
+        if selector:
+            path += '?'+urllib.urlencode({'labelSelector': selector})
+        return self._request('GET', path, error='Failed to get Pods')
 
     def _delete_pod(self, name, namespace):
-        headers = {'Content-Type': 'application/json'}
-        con_dest_pod = httplib.HTTPConnection(self.target+":"+self.port)
-        con_dest_pod.request('DELETE', '/api/'+self.apiversion+'/namespaces/' +
-                             namespace+'/pods/'+name, headers=headers, body=POD_DELETE)
-        resp = con_dest_pod.getresponse()
-        reason = resp.reason
-        status = resp.status
-        data = resp.read()
-        con_dest_pod.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to delete Pod: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
+        self._request('DELETE', '/namespaces/'+namespace+'/pods/'+name, body=POD_DELETE,
+                      error='Failed to delete Pod')
         for _ in xrange(5):
             status, data, reason = self._get_pod(name, namespace)
             if status != 404:
@@ -567,19 +614,8 @@ class KubeHTTPClient(AbstractSchedulerClient):
             raise RuntimeError(errmsg)
 
     def _pod_log(self, name, namespace):
-        conn_log = httplib.HTTPConnection(self.target+":"+self.port)
-        conn_log.request('GET', '/api/'+self.apiversion+'/namespaces/' +
-                         namespace+'/pods/'+name+'/log')
-        resp = conn_log.getresponse()
-        status = resp.status
-        data = resp.read()
-        reason = resp.reason
-        conn_log.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to get the log: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
-        return (status, data, reason)
+        return self._request('GET', '/namespaces/'+namespace+'/pods/'+name+'/log',
+                             error='Failed to get the log')
 
     def logs(self, name):
         appname = name.split("_")[0]
@@ -613,19 +649,8 @@ class KubeHTTPClient(AbstractSchedulerClient):
         js_template['spec']['containers'][0]['command'] = [entrypoint]
         js_template['spec']['containers'][0]['args'] = args
 
-        con_dest = httplib.HTTPConnection(self.target+":"+self.port)
-        headers = {'Content-Type': 'application/json'}
-        con_dest.request('POST', '/api/'+self.apiversion+'/namespaces/'+appname+'/pods',
-                         headers=headers, body=json.dumps(js_template))
-        resp = con_dest.getresponse()
-        data = resp.read()
-        status = resp.status
-        reason = resp.reason
-        con_dest.close()
-        if not 200 <= status <= 299:
-            errmsg = "Failed to create a Pod: {} {} - {}".format(
-                status, reason, data)
-            raise RuntimeError(errmsg)
+        self._request('POST', '/namespaces/'+appname+'/pods', body=json.dumps(js_template),
+                      error='Failed to create a Pod')
         while(1):
             parsed_json = {}
             status = 404
@@ -683,4 +708,45 @@ class KubeHTTPClient(AbstractSchedulerClient):
         except RuntimeError:
             return JobState.destroyed
 
+    def states(self, names):
+        """Display the running state of several jobs with one labelled pod list per app."""
+        phaseStateMap = {
+            'Running': JobState.up,
+            'Pending': JobState.created,
+            'Succeeded': JobState.down,
+            'Failed': JobState.crashed,
+        }
+        states = {}
+        pods_by_app = {}
+        for name in names:
+            match = re.match(MATCH, name)
+            if not match:
+                states[name] = JobState.error
+                continue
+            l = match.groupdict()
+            appname = l['app']
+            if appname not in pods_by_app:
+                try:
+                    status, data, reason = self._get_pods(appname, 'name='+appname)
+                    pods_by_app[appname] = json.loads(data)['items']
+                except RuntimeError:
+                    # the app's namespace does not exist
+                    pods_by_app[appname] = []
+                except (KeyError, ValueError):
+                    # failed retrieving a proper response from the k8s API
+                    pods_by_app[appname] = None
+            if pods_by_app[appname] is None:
+                states[name] = JobState.error
+                continue
+            phases = [pod['status'].get('phase') for pod in pods_by_app[appname]
+                      if pod['metadata'].get('labels', {}).get('version') == l['version'] and
+                      pod['metadata'].get('labels', {}).get('type') == l['c_type']]
+            if 'Running' in phases:
+                states[name] = JobState.up
+            elif phases:
+                states[name] = phaseStateMap.get(phases[0], JobState.error)
+            else:
+                states[name] = JobState.destroyed
+        return states
+
 SchedulerClient = KubeHTTPClient
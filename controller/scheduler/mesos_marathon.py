@@ -6,7 +6,7 @@ from docker import Client
 from marathon import MarathonClient
 from marathon.models import MarathonApp
 
-from . import AbstractSchedulerClient
+from . import AbstractSchedulerClient, JOB_NAME
 from .fleet import FleetHTTPClient
 from .states import JobState
 
@@ -112,4 +112,34 @@ class MarathonHTTPClient(AbstractSchedulerClient):
         except:
             return JobState.destroyed
 
+    def states(self, names):
+        """Display the running state of several jobs with a single app listing."""
+        try:
+            apps = {a.id.lstrip('/'): a for a in self.client.list_apps()}
+        except Exception:
+            return {name: JobState.error for name in names}
+        states = {}
+        for name in names:
+            app = apps.get(self._app_id(name))
+            if app is None:
+                states[name] = JobState.destroyed
+            elif app.tasks_running >= 1:
+                states[name] = JobState.up
+            else:
+                states[name] = JobState.created
+        return states
+
+    def list(self):
+        """List the running state of every app container job with a single app listing."""
+        states = {}
+        for app in self.client.list_apps():
+            # undo _app_id(), which turned every underscore of the job name into a dot
+            parts = app.id.lstrip('/').split('.')
+            if len(parts) < 4:
+                continue
+            name = '{}_{}.{}.{}'.format(parts[0], parts[1], '_'.join(parts[2:-1]), parts[-1])
+            if JOB_NAME.match(name):
+                states[name] = JobState.up if app.tasks_running >= 1 else JobState.created
+        return states
+
 SchedulerClient = MarathonHTTPClient
@@ -44,6 +44,15 @@ class MockSchedulerClient(AbstractSchedulerClient):
         """Display the given job's running state."""
         return jobs.get(name, {}).get('state', JobState.initialized)
 
+    def states(self, names):
+        """Display the running state of several jobs at once."""
+        return {name: jobs.get(name, {}).get('state', JobState.initialized) for name in names}
+
+    def list(self):
+        """List the running state of every job which has not been destroyed."""
+        return {name: job['state'] for name, job in jobs.items()
+                if job.get('state') not in (None, JobState.destroyed)}
+
     def stop(self, name):
         """Stop a container."""
         job = jobs.get(name, {})
@@ -1,10 +1,11 @@
 import re
+import threading
 import time
 
 from django.conf import settings
 from docker import Client
 
-from . import AbstractSchedulerClient
+from . import AbstractSchedulerClient, JOB_NAME
 from .states import JobState
 
 
@@ -17,10 +18,17 @@ class SwarmClient(AbstractSchedulerClient):
     def __init__(self, target, auth, options, pkey):
         super(SchedulerClient, self).__init__(target, auth, options, pkey)
         self.target = settings.SWARM_HOST
-        # single global connection
         self.registry = settings.REGISTRY_HOST + ':' + settings.REGISTRY_PORT
-        self.docker_cli = Client("tcp://{}:2395".format(self.target),
-                                 timeout=1200, version='1.17')
+        # every thread keeps its own persistent connection
+        self._local = threading.local()
+
+    @property
+    def docker_cli(self):
+        cli = getattr(self._local, 'docker_cli', None)
+        if cli is None:
+            cli = self._local.docker_cli = Client("tcp://{}:2395".format(self.target),
+                                                  timeout=1200, version='1.17')
+        return cli
 
     def create(self, name, image, command='', template=None, **kwargs):
         """Create a new container."""
@@ -98,6 +106,36 @@ class SwarmClient(AbstractSchedulerClient):
         except RuntimeError:
             return JobState.destroyed
 
+    def _running(self):
+        """Return whether each container on the cluster is running, keyed by container name."""
+        running = {}
+        for c in self.docker_cli.containers(all=True):
+            # swarm prefixes container names with the node they were scheduled on
+            for n in c.get('Names') or []:
+                running[n.rsplit('/', 1)[-1]] = c.get('Status', '').startswith('Up')
+        return running
+
+    def states(self, names):
+        """Display the running state of several jobs with a single container listing."""
+        try:
+            running = self._running()
+        except Exception:
+            return {name: JobState.error for name in names}
+        states = {}
+        for name in names:
+            if name not in running:
+                states[name] = JobState.destroyed
+            elif running[name]:
+                states[name] = JobState.up
+            else:
+                states[name] = JobState.created
+        return states
+
+    def list(self):
+        """List the running state of every app container job with a single container listing."""
+        return {name: JobState.up if up else JobState.created
+                for name, up in self._running().items() if JOB_NAME.match(name)}
+
     def _get_hostname(self, application_name):
         hostname = settings.UNIT_HOSTNAME
         if hostname == 'default':
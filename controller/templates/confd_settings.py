@@ -18,6 +18,14 @@ MARATHON_HOST = '{{ if exists "/deis/scheduler/mesos/marathon" }}{{ getv "/deis/
 
 K8S_MASTER = '{{ if exists "/deis/scheduler/k8s/master" }}{{ getv "/deis/scheduler/k8s/master" }}{{ else }}127.0.0.1{{ end }}'
 
+# bound the number of concurrent container operations sent to the scheduler
+{{ if exists "/deis/controller/containerConcurrency" }}
+DEIS_CONTAINER_CONCURRENCY = int('{{ getv "/deis/controller/containerConcurrency" }}')
+{{ end }}
+{{ if exists "/deis/controller/appContainerConcurrency" }}
+DEIS_APP_CONTAINER_CONCURRENCY = int('{{ getv "/deis/controller/appContainerConcurrency" }}')
+{{ end }}
+
 # base64-encoded SSH private key to facilitate current version of "deis run"
 SSH_PRIVATE_KEY = """{{ if exists "/deis/platform/sshPrivateKey" }}{{ getv "/deis/platform/sshPrivateKey" }}{{ else }}""{{end}}"""
 